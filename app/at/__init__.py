@@ -1,3 +1,4 @@
-from .command import Command, ResultValue, ResultValueState
+from .command import Command, ResultField, ResultValue, ResultValueState, NOT_AVAILABLE
 from .poller import Poller
+from .history import History
 
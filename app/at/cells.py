@@ -0,0 +1,148 @@
+import time
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+class RollingStat:
+    """
+    Running statistics of a measurement - the last value, min/max & an exponentially weighted moving average.
+    """
+
+    __slots__ = ('last', 'minimum', 'maximum', 'average', 'count')
+
+    # Weight given to each new sample in the moving average
+    ALPHA = 0.1
+
+    def __init__(self):
+        self.last = self.minimum = self.maximum = self.average = None
+        self.count = 0
+
+    def add(self, value):
+        """
+        Add a sample - values that aren't available (None) are ignored.
+        """
+        if value is None:
+            return
+
+        self.last = value
+        if self.count == 0:
+            self.minimum = self.maximum = self.average = value
+        else:
+            if value < self.minimum:
+                self.minimum = value
+            if value > self.maximum:
+                self.maximum = value
+            self.average += RollingStat.ALPHA * (value - self.average)
+        self.count += 1
+
+    def to_dict(self):
+        return {
+            'last': self.last,
+            'min': self.minimum,
+            'max': self.maximum,
+            'avg': round(self.average, 1) if self.average is not None else None,
+            'count': self.count
+        }
+
+class Cell:
+    """
+    What we know about one cell, identified by its (RAT, (E)ARFCN, PCI).
+    """
+
+    __slots__ = ('rat', 'arfcn', 'pci', 'role', 'band', 'first_seen', 'last_seen', 'sightings', 'rsrp', 'rsrq')
+
+    def __init__(self, rat, arfcn, pci, timestamp):
+        self.rat = rat
+        self.arfcn = arfcn
+        self.pci = pci
+
+        # How we last saw the cell (e.g. "intra"/"inter" frequency neighbour, "PCC"/"SCC" carrier aggregation component)
+        self.role = None
+        self.band = None
+
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.sightings = 0
+
+        self.rsrp = RollingStat()
+        self.rsrq = RollingStat()
+
+    def to_dict(self):
+        return {
+            'rat': self.rat,
+            'arfcn': self.arfcn,
+            'pci': self.pci,
+            'role': self.role,
+            'band': self.band,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'sightings': self.sightings,
+            'rsrp': self.rsrp.to_dict(),
+            'rsrq': self.rsrq.to_dict()
+        }
+
+class CellIndex:
+    """
+    A bounded index of the cells the modem has reported, keyed by (RAT, ARFCN, PCI).
+    Lookups & updates are O(1); once full, the cell seen least recently is evicted.
+    """
+
+    def __init__(self, capacity=1024):
+        """
+        Create a new index holding up to capacity cells.
+        """
+        self.capacity = capacity
+
+        # Cells in least to most recently seen order
+        self.cells = collections.OrderedDict()
+
+        # Updates happen on the poller's thread, reads on the web server's
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.cells)
+
+    def observe(self, rat, arfcn, pci, role, rsrp=None, rsrq=None, band=None, timestamp=None):
+        """
+        Record a sighting of a cell, with its signal measurements if available.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        key = (rat, arfcn, pci)
+        with self.lock:
+            cell = self.cells.get(key)
+            if cell is None:
+                cell = Cell(rat, arfcn, pci, timestamp)
+                self.cells[key] = cell
+                if len(self.cells) > self.capacity:
+                    self.cells.popitem(last=False)
+            else:
+                self.cells.move_to_end(key)
+
+            cell.role = role
+            if band is not None:
+                cell.band = band
+            cell.last_seen = timestamp
+            cell.sightings += 1
+            cell.rsrp.add(rsrp)
+            cell.rsrq.add(rsrq)
+
+    def get(self, rat, arfcn, pci):
+        """
+        Get a cell's details as a dictionary, or None if it isn't in the index.
+        """
+        with self.lock:
+            cell = self.cells.get((rat, arfcn, pci))
+            return cell.to_dict() if cell is not None else None
+
+    def to_list(self, since=None):
+        """
+        Get the details of every cell (seen at or after since), most recently seen first.
+        """
+        with self.lock:
+            return [
+                cell.to_dict() for cell in reversed(self.cells.values()) if since is None or cell.last_seen >= since
+            ]
@@ -1,5 +1,6 @@
 import time
 import logging
+from .diagnostics import LatencyHistogram
 
 logger = logging.getLogger(__name__)
 
@@ -9,19 +10,118 @@ class ResultValueState:
     ERROR = 2
     NOT_APPLICABLE = 3
 
-class ResultValue:
-    def __init__(self, key, name, description, value, state=ResultValueState.OK):
+class ResultField:
+    """
+    The static description of a result - shared by every ResultValue reporting it, so only the value changes each cycle.
+    """
+
+    __slots__ = ('key', 'name', 'description', 'kind', 'unavailable')
+
+    # What the modem reports for values it doesn't have
+    UNAVAILABLE = ('', '-', '-32768')
+
+    def __init__(self, key, name, description, kind=str, unavailable=()):
+        """
+        Create a new field, whose values are of type kind (int, float or str).
+        unavailable lists any raw values, besides ResultField.UNAVAILABLE, that mean "not available" for this field.
+        """
         self.key = key
         self.name = name
         self.description = description
+        self.kind = kind
+        self.unavailable = frozenset(ResultField.UNAVAILABLE + tuple(unavailable))
+
+    def parse(self, raw):
+        """
+        Convert a raw value (a response parameter, without quotes) to this field's type.
+        Returns NOT_AVAILABLE if the modem doesn't have the value (or it can't be parsed).
+        """
+        if raw in self.unavailable:
+            return NOT_AVAILABLE
+
+        try:
+            return self.kind(raw)
+        except ValueError:
+            logger.debug("Could not parse %s value %s" % (self.key, raw))
+            return NOT_AVAILABLE
+
+    def value(self, raw, state=ResultValueState.OK):
+        """
+        Build a ResultValue from a raw value.
+        """
+        return ResultValue(self, self.parse(raw), state)
+
+# The value of a result the modem doesn't have
+NOT_AVAILABLE = None
+
+class ResultValue:
+    """
+    A single result: its field, its value (an int, float or str, or NOT_AVAILABLE) and its state.
+    """
+
+    __slots__ = ('field', 'value', 'state')
+
+    def __init__(self, field, value, state=ResultValueState.OK):
+        self.field = field
         self.value = value
         self.state = state
 
+        # Nothing to classify without a value
+        if value is NOT_AVAILABLE and state == ResultValueState.OK:
+            self.state = ResultValueState.NOT_APPLICABLE
+
+    @property
+    def key(self):
+        return self.field.key
+
+    @property
+    def name(self):
+        return self.field.name
+
+    @property
+    def description(self):
+        return self.field.description
+
+    @property
+    def is_numeric(self):
+        """
+        Is the value a number (that can be plotted, aggregated, etc)?
+        """
+        return self.field.kind is not str and self.value is not NOT_AVAILABLE
+
+    @property
+    def text(self):
+        """
+        The value for display.
+        """
+        return '-' if self.value is NOT_AVAILABLE else str(self.value)
+
 class Command:
     """
     Abstract AT command.
     """
 
+    # The query sent to poll this command, without the leading "AT" (e.g. "+CSQ")
+    query = None
+
+    # Prefixes of the response lines that belong to this command (e.g. "+CSQ:")
+    response_prefixes = []
+
+    # How often to poll this command, in ms (None uses the poller's poll_delay)
+    interval = None
+
+    # When several commands are due at once, lower numbers are polled first
+    priority = 10
+
+    # Commands (without the leading "AT") sent when the port is opened to turn on the URCs this command handles
+    urc_setup = []
+
+    # Prefixes of unsolicited result codes passed to handle_urc()
+    urc_prefixes = []
+
+    # Prefixes of unsolicited result codes that make this command due for polling straight away
+    refresh_prefixes = []
+
     def __init__(self, name, description):
         """
         Create a new command.
@@ -33,68 +133,138 @@ class Command:
         # The time when the command was last checked
         self.last_update = None
 
-    def receive(self, port, timeout=3, multi_result=False, success=['OK'], failure=['ERROR']):
+        # Diagnostics - the time from sending the query to an OK, how many polls timed out or
+        # were answered with an error, and the bytes of response lines received
+        self.latency = LatencyHistogram()
+        self.polls = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.bytes_read = 0
+
+    async def poll(self, port):
+        """
+        Send the query & update the results from the response.
+        """
+        logger.debug("Polling %s..." % self.name)
+        sent = time.monotonic()
+        port.write(("AT%s\r\n" % self.query).encode("utf-8"), self.response_prefixes)
+
+        # Read the response content
+        state, lines = await self.receive(port, multi_result=True)
+        self.update(state, lines, time.monotonic() - sent)
+
+    def update(self, state, lines, latency=None):
+        """
+        Replace the results with those parsed from a response.
+        latency is how long the response took, in seconds, if it was timed.
+        """
+
+        # Clear the results
+        self.results = []
+
+        self.polls += 1
+        self.bytes_read += sum(len(line) for line in lines)
+        if state is None:
+            self.timeouts += 1
+        elif state is False:
+            self.errors += 1
+        elif latency is not None:
+            self.latency.add(latency)
+
+        if not state:
+            logger.warn("No response to %s query" % self.name)
+            # No results to work with
+            return
+
+        self.parse(lines)
+        self.last_update = time.time()
+
+    def parse(self, lines):
+        """
+        Parse the result lines of a successful response into self.results.
+        """
+        raise NotImplementedError()
+
+    def diagnostics(self):
+        """
+        Get the command's diagnostic counters & latency histogram.
+        """
+        return {
+            'name': self.name,
+            'query': self.query,
+            'interval': self.interval,
+            'polls': self.polls,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'bytes_read': self.bytes_read,
+            'last_update': self.last_update,
+            'latency': self.latency.to_dict()
+        }
+
+    def handle_urc(self, line):
+        """
+        Update the results from an unsolicited result code matching one of urc_prefixes.
+        """
+        pass
+
+    def owns(self, line):
+        """
+        Check whether a response line belongs to this command.
+        """
+        return line.startswith(tuple(self.response_prefixes))
+
+    @staticmethod
+    async def receive(port, timeout=3, multi_result=False, success=['OK'], failure=['ERROR', '+CME ERROR', '+CMS ERROR']):
         """
         Receive a typical AT response.
         Returns a tuple containing the result state (None=Timeout, True=OK, False=ERROR) and the result line(s).
         If multi_result=False, a maximum of one result line will be returned, otherwise a list of result lines will always be returned.
+        Returns as soon as a final result line arrives - failure entries also match "+CME ERROR: <n>" style lines.
         """
         # Timeout handling
-        start_time = time.time()
-
-        # The receive buffer
-        r_buf = ""
+        deadline = time.monotonic() + timeout
 
-        # The result state - 
+        # The result state
         result_state = None
         result_lines = []
 
-        while True:
-            
-            # Have we waited too long?
-            #if total_waited > timeout:
-            if time.time() - start_time > timeout:
-                logger.debug('Receive timed out')
-                break
-
-            # Read bytes from the interface (python3 needs decode from bytes to string)
-            got = port.read(1024).decode('ascii')
-            if not got:
-                continue
-            r_buf += got
-
-            # Have we received a linebreak?
-            split_str = '\r\n'
-            if split_str in r_buf:
-
-                # Process the lines
-                r_lines = r_buf.split(split_str)
-                for r_line in r_lines:
-
-                    # Just skip completely empty lines
-                    if r_line == '':
-                        continue
-
-                    # Good result?
-                    if r_line.upper() in success:
-                        result_state = True
-                        break
-                    
-                    # Bad result?
-                    if r_line.upper() in failure:
-                        result_state = False
-                        break
-
-                    result_lines.append(r_line)
-
-                # Clear the receive buffer
-                r_buf = ''
-
-                # Have we got a result state?
-                if result_state is not None:
+        try:
+            while True:
+
+                # Have we waited too long?
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.debug('Receive timed out')
+                    break
+
+                r_line = await port.read_line(remaining)
+                if r_line is None:
+                    logger.debug('Receive timed out')
                     break
 
+                # Good result?
+                if r_line.upper() in success:
+                    result_state = True
+                    break
+
+                # Bad result?
+                if Command.is_final(r_line, failure):
+                    result_state = False
+                    break
+
+                result_lines.append(r_line)
+
+        finally:
+            port.done()
+
         if multi_result:
             return (result_state, result_lines)
         else:
             return (result_state, result_lines[0] if len(result_lines) > 0 else '')
+
+    @staticmethod
+    def is_final(line, finals):
+        """
+        Check whether a line is one of the given final result codes, ignoring any ": <detail>" suffix.
+        """
+        return line.upper().split(':', 1)[0] in finals
@@ -1,3 +1,5 @@
 from .serving_cell import ServingCellCommand
 from .signal_quality import SignalQualityCommand
 from .temperature import TemperatureCommand
+from .registration import RegistrationCommand
+from .neighbour_cell import NeighbourCellCommand
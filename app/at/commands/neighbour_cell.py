@@ -0,0 +1,106 @@
+import logging
+from ..command import Command, ResultField, ResultValue
+from ..decoder import split_line
+from ..cells import CellIndex
+
+logger = logging.getLogger(__name__)
+
+class NeighbourCellCommand(Command):
+    """
+    Checks Neighbour Cell & Carrier Aggregation information, keeping track of every cell seen in a CellIndex
+    """
+
+    query = "+QENG=\"neighbourcell\";+QCAINFO"
+    response_prefixes = ["+QENG:", "+QCAINFO:"]
+    interval = 10000
+    priority = 25
+
+    NEIGHBOURS = ResultField("neighbour_cells", "Neighbour Cells", "Number of neighbour cells reported", int)
+    CA_COMPONENTS = ResultField("ca_components", "CA Components", "Number of carrier aggregation component carriers", int)
+
+    # Where the measurements are in each kind of neighbour cell line: RAT & the ARFCN, PCI, RSRP & RSRQ parameter indexes
+    # (WCDMA cells are identified by their PSC & measured by RSCP & Ec/Io)
+    NEIGHBOUR_LAYOUTS = {
+        ("neighbourcell intra", "LTE"): ("LTE", 2, 3, 5, 4),
+        ("neighbourcell inter", "LTE"): ("LTE", 2, 3, 5, 4),
+        ("neighbourcell", "NR5G"): ("NR5G", 2, 3, 4, 5),
+        ("neighbourcell", "WCDMA"): ("WCDMA", 2, 6, 7, 8),
+    }
+
+    # The same for carrier aggregation lines - +QCAINFO: "PCC"|"SCC",<freq>,<bw>,<band>,<state>,<PCI>,<RSRP>,<RSRQ>,...
+    CA_LAYOUT = (1, 5, 6, 7)
+    CA_BAND = 3
+
+    def __init__(self, capacity=1024):
+        super().__init__("Neighbour Cells", "Neighbour Cell & Carrier Aggregation Information")
+
+        # Every cell seen, with its signal statistics
+        self.cells = CellIndex(capacity)
+
+    def owns(self, line):
+        # Serving cell responses share the +QENG: prefix
+        return super().owns(line) and (line.startswith("+QCAINFO:") or "\"neighbourcell" in line)
+
+    @staticmethod
+    def __number(token):
+        """
+        Parse a measurement, returning None if it isn't available.
+        """
+        if token in ResultField.UNAVAILABLE:
+            return None
+        try:
+            return int(token)
+        except ValueError:
+            return None
+
+    def __observe(self, rat, role, tokens, arfcn, pci, rsrp, rsrq, band=None):
+        """
+        Record a cell from the parameters at the given indexes.
+        """
+        arfcn = NeighbourCellCommand.__number(tokens[arfcn])
+        pci = NeighbourCellCommand.__number(tokens[pci])
+        if arfcn is None or pci is None:
+            return False
+
+        self.cells.observe(
+            rat,
+            arfcn,
+            pci,
+            role,
+            NeighbourCellCommand.__number(tokens[rsrp]),
+            NeighbourCellCommand.__number(tokens[rsrq]),
+            band
+        )
+        return True
+
+    def parse(self, lines):
+        neighbours = 0
+        components = 0
+
+        for result_line in lines:
+            prefix, tokens = split_line(result_line)
+
+            # Neighbour cells - +QENG: "neighbourcell[ intra|inter]",<RAT>,...
+            if prefix == "+QENG" and len(tokens) >= 2:
+                layout = NeighbourCellCommand.NEIGHBOUR_LAYOUTS.get((tokens[0], tokens[1]))
+                if layout is None:
+                    logger.debug("Unknown neighbour cell line: %s" % result_line)
+                    continue
+
+                rat, arfcn, pci, rsrp, rsrq = layout
+                if len(tokens) <= max(arfcn, pci, rsrp, rsrq):
+                    continue
+
+                role = tokens[0][len("neighbourcell "):] or "neighbour"
+                if self.__observe(rat, role, tokens, arfcn, pci, rsrp, rsrq):
+                    neighbours += 1
+
+            # Carrier aggregation components
+            elif prefix == "+QCAINFO" and len(tokens) > max(NeighbourCellCommand.CA_LAYOUT):
+                band = tokens[NeighbourCellCommand.CA_BAND]
+                rat = "NR5G" if band.upper().startswith("NR") else "LTE"
+                if self.__observe(rat, tokens[0].upper(), tokens, *NeighbourCellCommand.CA_LAYOUT, band=band):
+                    components += 1
+
+        self.results.append(ResultValue(NeighbourCellCommand.NEIGHBOURS, neighbours))
+        self.results.append(ResultValue(NeighbourCellCommand.CA_COMPONENTS, components))
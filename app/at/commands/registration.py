@@ -0,0 +1,121 @@
+import time
+import logging
+from ..command import Command, ResultField, ResultValue, ResultValueState, NOT_AVAILABLE
+from ..decoder import RESPONSE_LINE, tokenize
+
+logger = logging.getLogger(__name__)
+
+class RegistrationCommand(Command):
+    """
+    Checks Network Registration Status
+    """
+
+    query = "+CREG?;+CGREG?;+CEREG?"
+    response_prefixes = ["+CREG:", "+CGREG:", "+CEREG:"]
+    interval = 30000
+    priority = 15
+
+    # Have the modem tell us about registration changes (with location info) as they happen
+    urc_setup = ["+CREG=2", "+CGREG=2", "+CEREG=2"]
+    urc_prefixes = ["+CREG:", "+CGREG:", "+CEREG:"]
+
+    # The registration domains, keyed by response prefix
+    DOMAINS = {
+        "+CREG": ResultField("creg", "CS Registration", "Circuit Switched Network Registration"),
+        "+CGREG": ResultField("cgreg", "GPRS Registration", "GPRS/Packet Switched Network Registration"),
+        "+CEREG": ResultField("cereg", "EPS Registration", "EPS (LTE/5G NSA) Network Registration"),
+    }
+
+    # Registration status descriptions & states
+    STATUSES = {
+        0: ("Not Registered", ResultValueState.ERROR),
+        1: ("Home", ResultValueState.OK),
+        2: ("Searching", ResultValueState.WARNING),
+        3: ("Denied", ResultValueState.ERROR),
+        4: ("Unknown", ResultValueState.ERROR),
+        5: ("Roaming", ResultValueState.OK),
+    }
+
+    def __init__(self):
+        super().__init__("Registration", "Network Registration Status")
+
+        # The latest result & <stat> for each domain - URCs update one domain at a time
+        self.domain_results = {}
+        self.domain_stats = {}
+
+    @staticmethod
+    def split(line):
+        """
+        Split a registration line into its prefix & <stat>[,<lac/tac>,<ci>[,<AcT>...]] parameters.
+        The query response leads with the <n> URC setting (<n>,<stat>[,"<lac>",...]) but URCs don't (<stat>[,"<lac>",...]),
+        and either can turn up while polling, so they're told apart by whether the second parameter is quoted.
+        Returns (None, None) if the line isn't a registration line.
+        """
+        match = RESPONSE_LINE.match(line)
+        if match is None or match.group(1) not in RegistrationCommand.DOMAINS:
+            return None, None
+
+        parameters = match.group(2)
+        tokens = tokenize(parameters)
+        raw = parameters.split(',')
+        if len(tokens) >= 2 and not raw[1].strip().startswith('"'):
+            tokens = tokens[1:]
+        return match.group(1), tokens
+
+    def __update_domain(self, prefix, params):
+        """
+        Update the result for a registration domain from its <stat>[,<lac/tac>,<ci>[,<AcT>]] parameters.
+        """
+        field = RegistrationCommand.DOMAINS[prefix]
+        try:
+            stat = int(params[0])
+        except ValueError:
+            logger.debug("Could not parse %s registration status %s" % (prefix, params[0]))
+            self.domain_stats.pop(prefix, None)
+            self.domain_results[prefix] = ResultValue(field, NOT_AVAILABLE)
+            return
+
+        self.domain_stats[prefix] = stat
+        status, state = RegistrationCommand.STATUSES.get(stat, ("Unknown (%d)" % stat, ResultValueState.ERROR))
+
+        # Include the location if we have it
+        if len(params) >= 3:
+            status = "%s (%s/%s)" % (status, params[1], params[2])
+
+        self.domain_results[prefix] = ResultValue(field, status, state)
+
+    # Domains that carry packet data - the ones that matter for a data connection
+    PACKET_DOMAINS = ("+CGREG", "+CEREG")
+
+    # Registered on the home network, or roaming
+    REGISTERED = (1, 5)
+
+    @property
+    def registered(self):
+        """
+        Is the modem registered for packet data in any domain? None if we don't know.
+        """
+        stats = [self.domain_stats[prefix] for prefix in RegistrationCommand.PACKET_DOMAINS if prefix in self.domain_stats]
+        if not stats:
+            return None
+        return any(stat in RegistrationCommand.REGISTERED for stat in stats)
+
+    def parse(self, lines):
+        for result_line in lines:
+            prefix, params = RegistrationCommand.split(result_line)
+            if prefix is None:
+                continue
+
+            self.__update_domain(prefix, params)
+
+        self.results = list(self.domain_results.values())
+
+    def handle_urc(self, line):
+        prefix, params = RegistrationCommand.split(line)
+        if prefix is None:
+            return
+
+        logger.info("Registration changed: %s" % line)
+        self.__update_domain(prefix, params)
+        self.results = list(self.domain_results.values())
+        self.last_update = time.time()
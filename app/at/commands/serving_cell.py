@@ -1,7 +1,6 @@
-import time
-import re
 import logging
-from ..command import Command, ResultValue, ResultValueState
+from ..command import Command, ResultField, ResultValueState
+from ..decoder import Schema, split_line
 
 logger = logging.getLogger(__name__)
 
@@ -10,104 +9,139 @@ class ServingCellCommand(Command):
     Checks Serving Cell information
     """
 
+    query = "+QENG=\"Servingcell\""
+    response_prefixes = ["+QENG:"]
+    priority = 0
+
+    # Registration & data connection changes usually mean the serving cell has changed too
+    refresh_prefixes = ["+CREG:", "+CGREG:", "+CEREG:", "+QNETDEVSTATUS:"]
+
+    # The overall UE status, reported on the "servingcell" line
+    STATUS = ResultField("status", "UE Status", "Overall UE Status")
+
+    # Status colours
+    STATUS_STATES = {
+        "SEARCH": ResultValueState.ERROR,
+        "LIMSRV": ResultValueState.WARNING,
+        "NOCONN": ResultValueState.OK,
+        "CONNECT": ResultValueState.OK,
+    }
+
+    # The parameters reported for each technology, in response order
+    # Older firmware stops short of the trailing fields, so only the leading ones are required
+    LTE = Schema("LTE", (
+        ResultField("lte_dup_type", "LTE Duplex", "LTE Duplex Mode"),
+        ResultField("lte_mcc", "LTE MCC", "LTE Mobile Country Code"),
+        ResultField("lte_mnc", "LTE MNC", "LTE Mobile Network Code"),
+        ResultField("lte_cid", "LTE Cell ID", "LTE Cell ID"),
+        ResultField("lte_pcid", "LTE PhyCell ID", "LTE Physical Cell ID", int),
+        ResultField("lte_earfcn", "LTE EARFCN", "LTE E-UTRA Absolute Radio Frequency Channel Number", int),
+        ResultField("lte_freq_band_ind", "LTE Freq. Band Index", "LTE Frequency Band Index", int),
+        ResultField("lte_ul_bw", "LTE Upstream BW", "LTE Upstream Bandwidth", int),
+        ResultField("lte_dl_bw", "LTE Downstream BW", "LTE Downstream Bandwidth", int),
+        ResultField("lte_tac", "LTE TAC", "LTE Tracking Area Code"),
+        ResultField("lte_rsrp", "LTE RSRP", "LTE Signal Power (dBmW)", int),
+        ResultField("lte_rsrq", "LTE RSRQ", "LTE Signal Quality (dB)", int),
+        ResultField("lte_rssi", "LTE RSSI", "LTE Signal Strength (dBm)", int),
+        ResultField("lte_sinr", "LTE SINR", "LTE Signal:Noise+Intrf. Ratio", int),
+        ResultField("lte_cqi", "LTE CQI", "LTE Channel Quality Indicator", int),
+        ResultField("lte_tx_power", "LTE TX Power", "LTE Transmit Power", int),
+        ResultField("lte_srxlev", "LTE Srxlev", "LTE Cell Selection RX Level (dB)", int),
+    ), required=14)
+
+    NR5G_NSA = Schema("NR5G-NSA", (
+        ResultField("nr_nsa_mcc", "5GNR-NSA MCC", "5G Mobile Country Code"),
+        ResultField("nr_nsa_mnc", "5GNR-NSA MNC", "5G Mobile Network Code"),
+        ResultField("nr_nsa_pcid", "5GNR-NSA PhyCell ID", "5G Physical Cell ID", int),
+        ResultField("nr_nsa_rsrp", "5GNR-NSA RSRP", "5G Signal Power (dBmW)", int),
+        ResultField("nr_nsa_sinr", "5GNR-NSA SINR", "5G Signal:Noise+Intrf. Ratio", int),
+        ResultField("nr_nsa_rsrq", "5GNR-NSA RSRQ", "5G Signal Quality (dBmW)", int),
+        ResultField("nr_nsa_arfcn", "5GNR-NSA ARFCN", "5G Absolute Radio Frequency Channel Number", int),
+        ResultField("nr_nsa_band", "5GNR-NSA Band", "5G Frequency Band", int),
+        ResultField("nr_nsa_dl_bw", "5GNR-NSA Downstream BW", "5G Downstream Bandwidth", int),
+        ResultField("nr_nsa_scs", "5GNR-NSA SCS", "5G Subcarrier Spacing", int),
+    ), required=6)
+
+    NR5G_SA = Schema("NR5G-SA", (
+        ResultField("nr_sa_dup_type", "5GNR-SA Duplex", "5G Duplex Mode"),
+        ResultField("nr_sa_mcc", "5GNR-SA MCC", "5G Mobile Country Code"),
+        ResultField("nr_sa_mnc", "5GNR-SA MNC", "5G Mobile Network Code"),
+        ResultField("nr_sa_cid", "5GNR-SA Cell ID", "5G Cell ID"),
+        ResultField("nr_sa_pcid", "5GNR-SA PhyCell ID", "5G Physical Cell ID", int),
+        ResultField("nr_sa_tac", "5GNR-SA TAC", "5G Tracking Area Code"),
+        ResultField("nr_sa_arfcn", "5GNR-SA ARFCN", "5G Absolute Radio Frequency Channel Number", int),
+        ResultField("nr_sa_band", "5GNR-SA Band", "5G Frequency Band", int),
+        ResultField("nr_sa_dl_bw", "5GNR-SA Downstream BW", "5G Downstream Bandwidth", int),
+        ResultField("nr_sa_rsrp", "5GNR-SA RSRP", "5G Signal Power (dBmW)", int),
+        ResultField("nr_sa_rsrq", "5GNR-SA RSRQ", "5G Signal Quality (dB)", int),
+        ResultField("nr_sa_sinr", "5GNR-SA SINR", "5G Signal:Noise+Intrf. Ratio", int),
+        ResultField("nr_sa_scs", "5GNR-SA SCS", "5G Subcarrier Spacing", int),
+        ResultField("nr_sa_srxlev", "5GNR-SA Srxlev", "5G Cell Selection RX Level (dB)", int),
+    ), required=12)
+
+    WCDMA = Schema("WCDMA", (
+        ResultField("wcdma_mcc", "WCDMA MCC", "WCDMA Mobile Country Code"),
+        ResultField("wcdma_mnc", "WCDMA MNC", "WCDMA Mobile Network Code"),
+        ResultField("wcdma_lac", "WCDMA LAC", "WCDMA Location Area Code"),
+        ResultField("wcdma_cid", "WCDMA Cell ID", "WCDMA Cell ID"),
+        ResultField("wcdma_uarfcn", "WCDMA UARFCN", "WCDMA UTRA Absolute Radio Frequency Channel Number", int),
+        ResultField("wcdma_psc", "WCDMA PSC", "WCDMA Primary Scrambling Code", int),
+        ResultField("wcdma_rac", "WCDMA RAC", "WCDMA Routing Area Code"),
+        ResultField("wcdma_rscp", "WCDMA RSCP", "WCDMA Received Signal Code Power", int),
+        ResultField("wcdma_ecio", "WCDMA ECIO", "WCDMA Energy/chip : Interference Ratio", int),
+        ResultField("wcdma_phy_ch", "WCDMA Physical Channel", "WCDMA Physical Channel", int),
+        ResultField("wcdma_sf", "WCDMA SF", "WCDMA Spreading Factor", int),
+        ResultField("wcdma_slot", "WCDMA Slot", "WCDMA Slot ID", int),
+        # Speech code & compression mode aren't interesting for data
+        None,
+        None,
+    ), required=12)
+
+    # The schema for each technology, by the name the modem gives it
+    SCHEMAS = {schema.name: schema for schema in (LTE, NR5G_NSA, NR5G_SA, WCDMA)}
+
     def __init__(self):
         super().__init__("Serving Cell", "Serving Cell Information")
 
-    def poll(self, serial_port):
-
-        # Send the Serving Cell query
-        logger.debug("Polling ServingCell...")
-        serial_port.write("AT+QENG=\"Servingcell\"\r\n".encode("utf-8"))
-
-        # Wait for the response to be written
-        time.sleep(0.5)
-
-        # Read the response content
-        cmd_result = self.receive(serial_port, multi_result=True)
-
-        # Clear the results
-        self.results = []
-        
-        if not cmd_result[0]:
-            logger.warn("No response to ServingCell query")
-            # No results to work with
-            return
+    def owns(self, line):
+        # Neighbour cell responses share the +QENG: prefix
+        return super().owns(line) and "\"neighbourcell" not in line
 
-        for result_line in cmd_result[1]:
+    def parse(self, lines):
 
-            # Process the result line for any status details
-            status_matches = re.match(r'\+QENG:\s?"servingcell","(.*?)"', result_line)
-            if status_matches is not None:
-                status = status_matches.group(1)
-                status_rv = ResultValue("status", "UE Status", "Overall UE Status", status)
-
-                # Colour the status based on value
-                if status == "SEARCH":
-                    status_rv.state = ResultValueState.ERROR
-                elif status == "LIMSRV":
-                    status_rv.state = ResultValueState.WARNING
-                elif status == "NOCONN" or status == "CONNECT":
-                    status_rv.state = ResultValueState.OK
-                else:
-                    status_rv.state = ResultValueState.ERROR
-
-                self.results.append(status_rv)
-
-            # Process the result line for any technology details
-            tech_matches = re.search(r'"(LTE|NR5G-NSA|WCDMA)",(.*)', result_line)
+        # Single mode:  +QENG: "servingcell",<state>,<RAT>,<parameters>
+        # EN-DC:        +QENG: "servingcell",<state>
+        #               +QENG: "LTE",<parameters>
+        #               +QENG: "NR5G-NSA",<parameters>
+        for result_line in lines:
+            prefix, tokens = split_line(result_line)
+            if prefix != "+QENG" or not tokens:
+                continue
 
-            if tech_matches is None:
+            # Where the RAT name is
+            rat = 0
+            if tokens[0] == "servingcell":
+                if len(tokens) < 2:
+                    continue
+
+                # Process the result line for any status details
+                status = tokens[1]
+                self.results.append(ServingCellCommand.STATUS.value(
+                    status,
+                    ServingCellCommand.STATUS_STATES.get(status, ResultValueState.ERROR)
+                ))
+
+                # Any technology details follow on the same line
+                rat = 2
+                if len(tokens) <= rat:
+                    continue
+
+            schema = ServingCellCommand.SCHEMAS.get(tokens[rat])
+            if schema is None:
+                logger.debug("Unknown serving cell technology %s" % tokens[rat])
                 continue
 
-            if tech_matches.group(1) == 'NR5G-NSA':
-                # Process NR5G group
-                nr_params = tech_matches.group(2).split(",")
-                if len(nr_params) >= 6:
-                    self.results.append(ResultValue("nr_nsa_mcc", "5GNR-NSA MCC", "5G Mobile Country Code", nr_params[0]))
-                    self.results.append(ResultValue("nr_nsa_mnc", "5GNR-NSA MNC", "5G Mobile Network Code", nr_params[1]))
-                    self.results.append(ResultValue("nr_nsa_pcid", "5GNR-NSA PhyCell ID", "5G Physical Cell ID", nr_params[2]))
-                    self.results.append(ResultValue("nr_nsa_rsrp", "5GNR-NSA RSRP", "5G Signal Power (dBmW)", nr_params[3]))
-                    self.results.append(ResultValue("nr_nsa_sinr", "5GNR-NSA SINR", "5G Signal:Noise+Intrf. Ratio", nr_params[4]))
-                    self.results.append(ResultValue("nr_nsa_rsrq", "5GNR-NSA RSRQ", "5G Signal Quality (dBmW)", nr_params[5]))
-
-            elif tech_matches.group(1) == 'LTE':
-                # Process LTE group
-                lte_params = tech_matches.group(2).split(",")
-                if len(lte_params) >= 14:
-                    self.results.append(ResultValue("lte_dup_type", "LTE Duplex", "LTE Duplex Mode", lte_params[0].replace("\"", "")))
-                    self.results.append(ResultValue("lte_mcc", "LTE MCC", "LTE Mobile Country Code", lte_params[1]))
-                    self.results.append(ResultValue("lte_mnc", "LTE MNC", "LTE Mobile Network Code", lte_params[2]))
-                    self.results.append(ResultValue("lte_cid", "LTE Cell ID", "LTE Cell ID", lte_params[3]))
-                    self.results.append(ResultValue("lte_pcid", "LTE PhyCell ID", "LTE Physical Cell ID", lte_params[4]))
-                    self.results.append(ResultValue("lte_earfcn", "LTE EARFCN", "LTE E-UTRA Absolute Radio Frequency Channel Number", lte_params[5]))
-                    self.results.append(ResultValue("lte_freq_band_ind", "LTE Freq. Band Index", "LTE Frequency Band Index", lte_params[6]))
-                    self.results.append(ResultValue("lte_ul_bw", "LTE Upstream BW", "LTE Upstream Bandwidth", lte_params[7]))
-                    self.results.append(ResultValue("lte_dl_bw", "LTE Downstream BW", "LTE Downstream Bandwidth", lte_params[8]))
-                    self.results.append(ResultValue("lte_tac", "LTE TAC", "LTE Tracking Area Code", lte_params[9]))
-                    self.results.append(ResultValue("lte_rsrp", "LTE RSRP", "LTE Signal Power (dBmW)", lte_params[10]))
-                    self.results.append(ResultValue("lte_rsrq", "LTE RSRQ", "LTE Signal Quality (dB)", lte_params[11]))
-                    self.results.append(ResultValue("lte_rssi", "LTE RSSI", "LTE Signal Strength (dBm)", lte_params[12]))
-                    self.results.append(ResultValue("lte_sinr", "LTE SINR", "LTE Signal:Noise+Intrf. Ratio", lte_params[13]))
-                    # self.results.append(ResultValue("lte_cqi", "LTE CQI", "LTE Channel Quality Indicator", lte_params[14]))
-                    # self.results.append(ResultValue("lte_tx_power", "LTE TX Power", "LTE Transmit Power (dBmW)", lte_params[15]))
-
-            elif tech_matches.group(1) == 'WCDMA':
-                # Process UMTS group
-                wcdma_params = tech_matches.group(2).split(",")
-                if len(wcdma_params) >= 12:
-                    self.results.append(ResultValue("wcdma_mcc", "WCDMA MCC", "WCDMA Mobile Country Code", wcdma_params[0]))
-                    self.results.append(ResultValue("wcdma_mnc", "WCDMA MNC", "WCDMA Mobile Network Code", wcdma_params[1]))
-                    self.results.append(ResultValue("wcdma_lac", "WCDMA LAC", "WCDMA Location Area Code", wcdma_params[2]))
-                    self.results.append(ResultValue("wcdma_cid", "WCDMA Cell ID", "WCDMA Cell ID", wcdma_params[3]))
-                    self.results.append(ResultValue("wcdma_uarfcn", "WCDMA UARFCN", "WCDMA UTRA Absolute Radio Frequency Channel Number", wcdma_params[4]))
-                    self.results.append(ResultValue("wcdma_psc", "WCDMA PSC", "WCDMA Primary Scrambling Code", wcdma_params[5]))
-                    self.results.append(ResultValue("wcdma_rac", "WCDMA RAC", "WCDMA Routing Area Code", wcdma_params[6]))
-                    self.results.append(ResultValue("wcdma_rscp", "WCDMA RSCP", "WCDMA Received Signal Code Power", wcdma_params[7]))
-                    self.results.append(ResultValue("wcdma_ecio", "WCDMA ECIO", "WCDMA Energy/chip : Interference Ratio", wcdma_params[8]))
-                    self.results.append(ResultValue("wcdma_phy_ch", "WCDMA Physical Channel", "WCDMA Physical Channel", wcdma_params[9]))
-                    self.results.append(ResultValue("wcdma_sf", "WCDMA SF", "WCDMA Spreading Factor", wcdma_params[10]))
-                    self.results.append(ResultValue("wcdma_slot", "WCDMA Slot", "WCDMA Slot ID", wcdma_params[11]))
-                    # self.results.append(ResultValue("wcdma_speech_code", "WCDMA Speech Code", "WCDMA Speech Code", wcdma_params[12]))
-                    # self.results.append(ResultValue("wcdma_com_mode", "WCDMA Compression", "WCDMA Compression On/Off", wcdma_params[13]))
-                    
-        self.last_update = time.time()
\ No newline at end of file
+            # Only report a technology if the modem gave us all of its required fields
+            results = schema.decode(tokens, rat + 1)
+            if results is not None:
+                self.results.extend(results)
@@ -1,7 +1,7 @@
 import time
-import re
 import logging
-from ..command import Command, ResultValue, ResultValueState
+from ..command import Command, ResultField, ResultValueState
+from ..decoder import Schema, split_line
 
 logger = logging.getLogger(__name__)
 
@@ -10,6 +10,17 @@ class SignalQualityCommand(Command):
     Checks Signal Quality
     """
 
+    query = "+CSQ"
+    response_prefixes = ["+CSQ:"]
+    priority = 5
+    urc_setup = ["+QINDCFG=\"csq\",1,0"]
+    urc_prefixes = ["+QIND: \"csq\""]
+
+    # 99 means the modem doesn't know
+    CSQ = ResultField("csq", "Signal Quality (CSQ)", "Signal Strength Indication (0-31)", int, ("99",))
+    BER = ResultField("csq_ber", "Channel BER", "Channel Bit Error Rate", int, ("99",))
+    SCHEMA = Schema("CSQ", (CSQ, BER))
+
     def __init__(self):
         super().__init__("Signal Quality", "Cell Signal Quality Information")
 
@@ -18,47 +29,42 @@ class SignalQualityCommand(Command):
         """
         Get a state classification for a CSQ level.
         """
-        if csq == 99 or csq < 6:
+        if csq is None or csq < 6:
             return ResultValueState.ERROR
         elif csq < 12:
             return ResultValueState.WARNING
         else:
             return ResultValueState.OK
 
-    def poll(self, serial_port):
-
-        # Send the CSQ query
-        logger.debug("Polling CSQ...")
-        serial_port.write("AT+CSQ\r\n".encode("utf-8"))
-
-        # Wait for the response to be written
-        time.sleep(0.5)
-
-        # Read the response content
-        cmd_result = self.receive(serial_port, multi_result=True)
+    def __csq_results(self, tokens, start=0):
+        """
+        Build the results for a CSQ reading's <rssi>,<ber> tokens.
+        """
+        results = SignalQualityCommand.SCHEMA.decode(tokens, start)
+        if results is not None:
+            results[0].state = self.__get_csq_state(results[0].value)
+        return results
 
-        # Clear the results
-        self.results = []
-        
-        if not cmd_result[0]:
-            logger.warn("No response to CSQ query")
-            # No results to work with
-            return
+    def parse(self, lines):
 
         # Parse the CSQ output
-        for result_line in cmd_result[1]:
-            csq_matches = re.match(r'\+CSQ:\s?(\d+),(\d+)', result_line)
-            if csq_matches is None:
+        for result_line in lines:
+            prefix, tokens = split_line(result_line)
+            if prefix != "+CSQ":
                 continue
-            
-            self.results.append(ResultValue(
-                "csq",
-                "Signal Quality (CSQ)",
-                "Signal Strength Indication (0-31)",
-                csq_matches.group(1),
-                self.__get_csq_state(int(csq_matches.group(1)))
-            ))
-            self.results.append(ResultValue("csq_ber", "Channel BER", "Channel Bit Error Rate", csq_matches.group(2)))
 
+            results = self.__csq_results(tokens)
+            if results is not None:
+                self.results.extend(results)
+
+    def handle_urc(self, line):
+
+        # The modem reports CSQ changes as they happen - +QIND: "csq",<rssi>,<ber>
+        prefix, tokens = split_line(line)
+        if prefix != "+QIND" or tokens[0] != "csq":
+            return
 
-        self.last_update = time.time()
\ No newline at end of file
+        results = self.__csq_results(tokens, 1)
+        if results is not None:
+            self.results = results
+            self.last_update = time.time()
@@ -1,7 +1,6 @@
-import time
-import re
 import logging
-from ..command import Command, ResultValue, ResultValueState
+from ..command import Command, ResultField, ResultValue, ResultValueState, NOT_AVAILABLE
+from ..decoder import split_line
 
 logger = logging.getLogger(__name__)
 
@@ -10,9 +9,32 @@ class TemperatureCommand(Command):
     Checks MT Temperature Information
     """
 
+    query = "+QTEMP"
+    response_prefixes = ["+QTEMP:"]
+    interval = 60000
+    priority = 20
+
     def __init__(self):
         super().__init__("UE Temperature", "User Equipment Temperature")
 
+        # The field for each region the modem reports, created as regions are first seen
+        self.fields = {}
+
+    def __field(self, region):
+        """
+        Get the field for a temperature region.
+        """
+        field = self.fields.get(region)
+        if field is None:
+            field = ResultField(
+                "temp_" + region,
+                region + " Temperature",
+                "Temperature of the \"%s\" region of the UE" % region,
+                int
+            )
+            self.fields[region] = field
+        return field
+
     @staticmethod
     def __get_temperature_state(temp):
         """
@@ -25,38 +47,18 @@ class TemperatureCommand(Command):
         else:
             return ResultValueState.OK
 
-    def poll(self, serial_port):
-
-        # Send the Temperature query
-        logger.debug("Polling Temperature...")
-        serial_port.write("AT+QTEMP\r\n".encode("utf-8"))
+    def parse(self, lines):
 
-        # Wait for the response to be written
-        time.sleep(0.5)
-
-        # Read the response content
-        cmd_result = self.receive(serial_port, multi_result=True)
-
-        # Clear the results
-        self.results = []
-        
-        if not cmd_result[0]:
-            logger.warn("No response to Temperature query")
-            # No results to work with
-            return
-
-        # Parse the output
-        for result_line in cmd_result[1]:
-            temp_matches = re.match(r'\+QTEMP:\s?"([a-z0-9\-]+)","(\d+)"', result_line)
-            if temp_matches is None:
+        # Parse the output - +QTEMP: "<region>","<temperature>"
+        for result_line in lines:
+            prefix, tokens = split_line(result_line)
+            if prefix != "+QTEMP" or len(tokens) < 2:
                 continue
-            
+
+            field = self.__field(tokens[0])
+            temperature = field.parse(tokens[1])
             self.results.append(ResultValue(
-                "temp_" + temp_matches.group(1),
-                temp_matches.group(1) + " Temperature",
-                "Temperature of the \"%s\" region of the UE" % temp_matches.group(1),
-                temp_matches.group(2),
-                self.__get_temperature_state(int(temp_matches.group(2)))
+                field,
+                temperature,
+                self.__get_temperature_state(temperature) if temperature is not NOT_AVAILABLE else ResultValueState.OK
             ))
-
-        self.last_update = time.time()
\ No newline at end of file
@@ -0,0 +1,83 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# An information response line - "+PREFIX: <parameters>"
+RESPONSE_LINE = re.compile(r'(\+[A-Z0-9]+):\s*(.*)')
+
+def tokenize(parameters):
+    """
+    Split the parameters of a response into a list of strings, in a single pass over the comma-separated pieces.
+    Quoted parameters have their quotes removed and may contain commas. Empty parameters are kept as ''.
+    """
+
+    # Unless a quoted parameter contains a comma (which is rare), splitting at commas is enough
+    if '"' not in parameters or not any(',' in quoted for quoted in parameters.split('"')[1::2]):
+        return [token.strip(' "') for token in parameters.split(',')]
+
+    tokens = []
+
+    # A quoted parameter that has been split at a comma inside it
+    pending = None
+
+    for token in parameters.split(','):
+        if pending is not None:
+            pending += ',' + token
+            if token.rstrip().endswith('"'):
+                tokens.append(pending.strip()[1:-1])
+                pending = None
+            continue
+
+        token = token.strip()
+        if token.startswith('"'):
+            if len(token) > 1 and token.endswith('"'):
+                tokens.append(token[1:-1])
+            else:
+                pending = token
+        else:
+            tokens.append(token)
+
+    # Unterminated quotes run to the end of the line
+    if pending is not None:
+        tokens.append(pending.strip()[1:])
+
+    return tokens
+
+def split_line(line):
+    """
+    Split an information response line into its prefix & parameter tokens.
+    Returns (None, None) if the line isn't an information response.
+    """
+    match = RESPONSE_LINE.match(line)
+    if match is None:
+        return None, None
+    return match.group(1), tokenize(match.group(2))
+
+class Schema:
+    """
+    The layout of a response's parameters - a ResultField per position (or None for parameters we don't report).
+    Supporting a new firmware layout is a matter of editing a schema's field table.
+    """
+
+    __slots__ = ('name', 'fields', 'required')
+
+    def __init__(self, name, fields, required=None):
+        """
+        Create a new schema.
+        required is the number of parameters that must be present - any fields after that are reported if present.
+        """
+        self.name = name
+        self.fields = tuple(fields)
+        self.required = len(self.fields) if required is None else required
+
+    def decode(self, tokens, start=0):
+        """
+        Decode tokens (from start onwards) into a list of ResultValues.
+        Returns None if there are fewer parameters than the schema requires.
+        """
+        if len(tokens) - start < self.required:
+            logger.debug("Too few %s parameters: %s" % (self.name, tokens[start:]))
+            return None
+
+        return [field.value(token) for field, token in zip(self.fields, tokens[start:]) if field is not None]
@@ -0,0 +1,110 @@
+import os
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+
+logger = logging.getLogger(__name__)
+
+class DeviceWatcher:
+    """
+    Waits for a device node (or a symlink to one, e.g. under /dev/serial/by-id) to appear, for when the modem
+    re-enumerates on USB. Uses inotify on the nearest existing parent directory where available, so we find out
+    straight away, and otherwise falls back to checking every POLL_INTERVAL seconds.
+    """
+
+    # How often to check for the device without inotify, in seconds
+    POLL_INTERVAL = 0.25
+
+    # inotify flags (see inotify(7)) - anything that could mean the path now exists or can now be opened
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, path, loop):
+        """
+        Create a new watcher for path, which waits on the given event loop.
+        """
+        self.path = path
+        self.loop = loop
+
+        # Set whenever something changes in a watched directory
+        self.changed = asyncio.Event()
+
+        # The inotify descriptor, or None if we have to poll
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self.__add_watch = libc.inotify_add_watch
+            self.__add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            fd = libc.inotify_init1(DeviceWatcher.IN_NONBLOCK | DeviceWatcher.IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+            self.fd = fd
+            self.loop.add_reader(self.fd, self.__on_event)
+        except (OSError, AttributeError) as inotify_ex:
+            logger.info("inotify isn't available (%s) - polling for %s instead" % (inotify_ex, self.path))
+
+    def __on_event(self):
+        """
+        Drain the inotify events - we only need to know that something happened.
+        """
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self.changed.set()
+
+    def __watch(self):
+        """
+        Watch the nearest existing directory on the way to the path.
+        Returns False if it couldn't be watched.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        while not os.path.isdir(directory):
+            directory = os.path.dirname(directory)
+
+        mask = DeviceWatcher.IN_CREATE | DeviceWatcher.IN_MOVED_TO | DeviceWatcher.IN_ATTRIB
+        return self.__add_watch(self.fd, directory.encode(), mask) >= 0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    async def wait(self, timeout):
+        """
+        Wait for up to timeout seconds for the path to exist.
+        Returns whether it does.
+        """
+        deadline = self.loop.time() + timeout
+        while not self.exists():
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return False
+
+            # Watch for the next step towards the path (e.g. /dev/serial/by-id being created before the link in it),
+            # checking again in case it appeared before the watch was in place
+            self.changed.clear()
+            if self.fd is None or not self.__watch():
+                await asyncio.sleep(min(DeviceWatcher.POLL_INTERVAL, remaining))
+                continue
+            if self.exists():
+                break
+
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+        return True
+
+    def close(self):
+        """
+        Stop watching.
+        """
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,85 @@
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class LatencyHistogram:
+    """
+    Counts durations (in seconds) into fixed buckets, so recording is O(log buckets) and memory use never grows.
+    Percentiles are estimated from the buckets - each is reported as the upper bound of the bucket it falls in.
+    """
+
+    # Upper bounds of the buckets for AT command & network round trips (there's an overflow bucket after the last)
+    LATENCY_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    # Upper bounds for recovering from failures (e.g. modem resets)
+    RECOVERY_BOUNDS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800)
+
+    # Upper bounds for how long processes stay up
+    UPTIME_BOUNDS = (10, 60, 300, 900, 3600, 4 * 3600, 24 * 3600, 7 * 24 * 3600)
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        """
+        Create a new histogram with the given (ascending) bucket upper bounds.
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+
+        # Totals across every bucket
+        self.count = 0
+        self.total = 0.0
+        self.maximum = None
+        self.last = None
+
+        # Durations can be recorded from several threads (e.g. racing probes)
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        """
+        Record a duration.
+        """
+        with self.lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            if self.maximum is None or seconds > self.maximum:
+                self.maximum = seconds
+
+    def percentile(self, fraction):
+        """
+        Estimate a percentile (fraction between 0 and 1), or None if nothing has been recorded.
+        Durations in the overflow bucket are estimated as the maximum seen.
+        """
+        with self.lock:
+            if self.count == 0:
+                return None
+
+            rank = fraction * self.count
+            seen = 0
+            for bound, count in zip(self.bounds, self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(bound, self.maximum)
+            return self.maximum
+
+    def to_dict(self):
+        with self.lock:
+            count = self.count
+            total = self.total
+            maximum = self.maximum
+            last = self.last
+            buckets = [[bound, bucket_count] for bound, bucket_count in zip(self.bounds + (None,), self.counts)]
+
+        return {
+            'count': count,
+            'sum': total,
+            'mean': total / count if count else None,
+            'max': maximum,
+            'last': last,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'buckets': buckets
+        }
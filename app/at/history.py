@@ -0,0 +1,211 @@
+import math
+import time
+import logging
+import threading
+from array import array
+
+logger = logging.getLogger(__name__)
+
+class RingBuffer:
+    """
+    A fixed-size circular buffer of samples, stored column-wise in typed arrays.
+    Each sample is a timestamp followed by one or more float32 values.
+    """
+
+    def __init__(self, capacity, columns=1):
+        """
+        Create a new ring buffer holding up to capacity samples of the given number of values each.
+        """
+        self.capacity = capacity
+
+        # The sample timestamps & values - allocated up front so memory use never changes
+        self.times = array('d', bytes(8 * capacity))
+        self.columns = [array('f', bytes(4 * capacity)) for _ in range(columns)]
+
+        # The index the next sample will be written at, and the number of samples held
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp, *values):
+        """
+        Add a sample, overwriting the oldest one if the buffer is full.
+        """
+        self.times[self.head] = timestamp
+        for column, value in zip(self.columns, values):
+            column[self.head] = value
+
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def __index(self, position):
+        """
+        Get the array index of the sample at a chronological position (0 = oldest).
+        """
+        return (self.head - self.count + position) % self.capacity
+
+    def __first_since(self, since):
+        """
+        Binary search for the chronological position of the first sample at or after since.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[self.__index(middle)] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, since=None):
+        """
+        Get the samples at or after since (or all of them), oldest first.
+        Returns a tuple of arrays - the timestamps followed by each column of values.
+        """
+        first = 0 if since is None else self.__first_since(since)
+        if first >= self.count:
+            return (array('d'),) + tuple(array('f') for _ in self.columns)
+
+        # The samples are either one contiguous run or wrap around the end of the arrays
+        start = self.__index(first)
+        end = start + (self.count - first)
+        if end <= self.capacity:
+            return (self.times[start:end],) + tuple(column[start:end] for column in self.columns)
+
+        end -= self.capacity
+        return (self.times[start:] + self.times[:end],) + tuple(column[start:] + column[:end] for column in self.columns)
+
+class Rollup:
+    """
+    Aggregates samples into fixed-length periods, keeping the min/avg/max of each in a ring buffer.
+    """
+
+    def __init__(self, period, capacity):
+        """
+        Create a new rollup of period-second buckets, keeping the latest capacity of them.
+        """
+        self.period = period
+        self.buffer = RingBuffer(capacity, columns=3)
+
+        # The bucket currently being accumulated
+        self.bucket = None
+        self.minimum = self.maximum = self.total = 0.0
+        self.samples = 0
+
+    def add(self, timestamp, value):
+        """
+        Add a sample, completing the current bucket if the sample is beyond it.
+        """
+        bucket = timestamp - timestamp % self.period
+        if bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+            self.minimum = self.maximum = self.total = value
+            self.samples = 1
+            return
+
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        self.total += value
+        self.samples += 1
+
+    def flush(self):
+        """
+        Write out the bucket being accumulated.
+        """
+        if self.samples > 0:
+            self.buffer.append(self.bucket, self.minimum, self.total / self.samples, self.maximum)
+            self.samples = 0
+
+    def query(self, since=None):
+        """
+        Get the (timestamps, mins, avgs, maxs) arrays for the completed buckets starting at or after since.
+        """
+        return self.buffer.query(since)
+
+class History:
+    """
+    Keeps bounded, multi-resolution history for each numeric result value, keyed by ResultValue.key.
+    Raw samples are kept for a short period, with min/avg/max rollups covering progressively longer periods.
+    """
+
+    # The name of the raw resolution
+    RAW = 'raw'
+
+    def __init__(self, raw_seconds=3600, raw_interval=1, rollups=((60, 24 * 60 * 60), (15 * 60, 30 * 24 * 60 * 60))):
+        """
+        Create a new history store.
+        Raw samples are kept for raw_seconds. Each metric's raw buffer is sized for a sample every raw_interval seconds,
+        unless record() is told how often that metric is sampled.
+        rollups is a sequence of (period, retention) tuples, both in seconds.
+        """
+        self.raw_seconds = raw_seconds
+        self.raw_interval = raw_interval
+        self.rollup_config = rollups
+
+        # Per-metric (raw buffer, {period: rollup}) tuples
+        self.metrics = {}
+
+        # Recording happens on the poller's thread, queries on the web server's
+        self.lock = threading.Lock()
+
+    @property
+    def resolutions(self):
+        """
+        The resolutions that can be queried - History.RAW followed by each rollup period.
+        """
+        return [History.RAW] + [period for period, retention in self.rollup_config]
+
+    def keys(self):
+        """
+        Get the keys of all the metrics with history.
+        """
+        with self.lock:
+            return list(self.metrics.keys())
+
+    def raw_capacity(self, interval=None):
+        """
+        Get the number of raw samples needed to cover raw_seconds when sampling every interval seconds.
+        """
+        interval = self.raw_interval if interval is None else max(interval, 0.001)
+        return int(math.ceil(self.raw_seconds / interval)) + 1
+
+    def record(self, key, value, timestamp=None, interval=None):
+        """
+        Record a sample for a metric.
+        interval is how often (in seconds) the metric is sampled, which sizes its raw buffer when it's first seen.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self.lock:
+            if key not in self.metrics:
+                self.metrics[key] = (
+                    RingBuffer(self.raw_capacity(interval)),
+                    {period: Rollup(period, int(retention / period)) for period, retention in self.rollup_config}
+                )
+
+            raw, rollups = self.metrics[key]
+            raw.append(timestamp, value)
+            for rollup in rollups.values():
+                rollup.add(timestamp, value)
+
+    def query(self, key, since=None, resolution=RAW):
+        """
+        Get the history of a metric at or after since.
+        Returns (timestamps, values) arrays for the raw resolution, or (timestamps, mins, avgs, maxs) arrays for rollups.
+        Returns None if there is no history for the metric at that resolution.
+        """
+        with self.lock:
+            if key not in self.metrics:
+                return None
+
+            raw, rollups = self.metrics[key]
+            if resolution == History.RAW:
+
+                # Samples can arrive faster or slower than the buffer was sized for, so only the last raw_seconds count
+                cutoff = time.time() - self.raw_seconds
+                return raw.query(cutoff if since is None else max(since, cutoff))
+            if resolution in rollups:
+                return rollups[resolution].query(since)
+            return None
@@ -0,0 +1,93 @@
+import re
+import time
+import logging
+from .diagnostics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+class StatsdAggregator:
+    """
+    Aggregates numeric results locally & sends them to statsd once per flush window.
+    For each metric, the window's last value is sent as the metric itself, with its min/max/avg & sample count
+    as .min/.max/.avg/.count sub-metrics. All the stats go out through one pipeline, packed into as few datagrams as fit.
+    """
+
+    def __init__(self, host, port=8125, flush_interval=10, tags=None, max_packet=512):
+        """
+        Create a new aggregator sending to the statsd server at host:port every flush_interval seconds.
+        tags optionally maps tag names (e.g. host, modem) to values, which are added to the metric prefix in order
+        (plain statsd has no tags, so quectel_cpe.<value>.<value>.<metric>).
+        """
+        # Only needed if statsd is configured - don't slow everyone's startup down importing it
+        import statsd
+
+        self.flush_interval = flush_interval
+
+        prefix = 'quectel_cpe'
+        if tags:
+            prefix += ''.join('.' + StatsdAggregator.__sanitise(value) for value in tags.values())
+
+        self.client = statsd.StatsClient(host, port, prefix=prefix, maxudpsize=max_packet)
+
+        # Per-metric [last, min, max, total, count] for the current window
+        self.window = {}
+
+        # When the current window started
+        self.window_start = time.monotonic()
+
+        # How long sending each window's stats takes
+        self.flush_latency = LatencyHistogram()
+
+    @staticmethod
+    def __sanitise(value):
+        """
+        Make a tag value safe to use as a statsd name segment.
+        """
+        return re.sub(r'[^A-Za-z0-9_-]', '_', str(value))
+
+    def add(self, key, value):
+        """
+        Add a sample of a metric to the current window.
+        """
+        stats = self.window.get(key)
+        if stats is None:
+            self.window[key] = [value, value, value, value, 1]
+            return
+
+        stats[0] = value
+        if value < stats[1]:
+            stats[1] = value
+        if value > stats[2]:
+            stats[2] = value
+        stats[3] += value
+        stats[4] += 1
+
+    def maybe_flush(self):
+        """
+        Flush if the flush window has passed.
+        """
+        if time.monotonic() - self.window_start >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Send the aggregated stats for the current window & start a new one.
+        """
+        window = self.window
+        self.window = {}
+        self.window_start = time.monotonic()
+        if not window:
+            return
+
+        start = time.monotonic()
+        try:
+            with self.client.pipeline() as pipe:
+                for key, (last, minimum, maximum, total, count) in window.items():
+                    pipe.gauge(key, last)
+                    pipe.gauge(key + '.min', minimum)
+                    pipe.gauge(key + '.max', maximum)
+                    pipe.gauge(key + '.avg', total / count)
+                    pipe.gauge(key + '.count', count)
+        except Exception as statsd_err:
+            logger.warn("Could not send stats to statsd: %s" % statsd_err)
+        self.flush_latency.add(time.monotonic() - start)
@@ -1,44 +1,73 @@
+import re
 import time
+import asyncio
 import logging
 import threading
+import collections
+import concurrent.futures
 import serial
-import io
 import importlib
 import inspect
-import statsd
 from .command import Command
+from .port import Port
+from .scheduler import Scheduler
+from .history import History
+from .store import MetricStore
+from .metrics import StatsdAggregator
+from .diagnostics import LatencyHistogram
+from .device import DeviceWatcher
 
 logger = logging.getLogger(__name__)
 
 class Poller:
     """
     Polls a serial port with AT commands, collecting responses.
+    Polling runs on an asyncio event loop in a dedicated thread; the public methods are safe to call from any thread.
     """
 
-    def __init__(self, dev, poll_delay, statsd_config=None):
+    # The first & longest delays in seconds between attempts to open the port, doubling after each failure
+    RETRY_MIN = 0.1
+    RETRY_MAX = 10
+
+    # How long to wait for each "AT" sent to check the modem is answering, in seconds
+    READY_TIMEOUTS = (0.25, 0.5, 1, 2, 4)
+
+    # How long to wait between checks on the port when there's nothing to poll, in seconds
+    IDLE_DELAY = 1
+
+    def __init__(self, dev, poll_delay, statsd_config=None, batch=False, intervals=None, store_config=None):
         """
         Create a new poller.
+        If batch=True, all commands that are due together are sent as a single concatenated AT command line.
+        intervals optionally maps command class names to poll intervals in ms, overriding their defaults.
+        If store_config has a path, results are also kept in a persistent MetricStore there.
         """
 
         # The AT serial device file
         self.dev = dev
 
-        # The delay in ms between polls
+        # The default delay in ms between polls of each command
         self.poll_delay = poll_delay
 
-        # List of commands that need to be injected
-        self.inject_commands = []
+        # Send all commands in one round trip?
+        self.batch = batch
+
+        # Queue of (command, deadline, future) tuples that need to be injected - only touched on the event loop
+        self.inject_commands = collections.deque()
 
         # Are we polling periodically?
         self.is_polling = False
 
         # Send polled data to StatsD?
-        self.statsd_client = None
+        self.statsd = None
         if statsd_config is not None and 'host' in statsd_config:
             try:
-                self.statsd_client = statsd.StatsClient(
+                self.statsd = StatsdAggregator(
                     statsd_config['host'],
-                    statsd_config['port'] if 'port' in statsd_config else 8125, prefix='quectel_cpe'
+                    statsd_config['port'] if 'port' in statsd_config else 8125,
+                    statsd_config['flush_interval'] if 'flush_interval' in statsd_config else 10,
+                    statsd_config['tags'] if 'tags' in statsd_config else None,
+                    statsd_config['max_packet'] if 'max_packet' in statsd_config else 512
                 )
             except Exception as statsd_err:
                 logger.warn("Could not connect to statsd host %s: %s" % (statsd_config['host'], statsd_err))
@@ -55,21 +84,166 @@ class Poller:
                 # Don't render the base StatusCheck itself though
                 if command_class != Command:
                     logger.info('registering command class %s' % command_class)
-                    self.commands.append(command_class())
+                    command = command_class()
+
+                    # Work out how often this command should be polled
+                    if intervals is not None and command_name in intervals:
+                        command.interval = intervals[command_name]
+                    elif command.interval is None:
+                        command.interval = self.poll_delay
+
+                    self.commands.append(command)
+
+        # The index of cells seen, if a command keeps one
+        self.cells = None
+        for command in self.commands:
+            if getattr(command, 'cells', None) is not None:
+                self.cells = command.cells
+
+        # Decides which commands are due to be polled
+        self.scheduler = Scheduler()
+
+        # Recent history of every numeric result, with raw buffers sized for the most frequently polled command
+        self.history = History(raw_interval=min(
+            [command.interval for command in self.commands] or [self.poll_delay]
+        ) / 1000)
+
+        # Callables to notify when results change
+        self.listeners = []
+
+        # Set while the port is open & the modem is answering, and how many times it has been (re)attached to
+        self.ready = threading.Event()
+        self.attaches = 0
+        self.attached = threading.Condition()
+
+        # How long it took from losing (or first opening) the port until the modem was answering
+        self.attach_latency = LatencyHistogram()
+
+        # Poll cycle statistics - completed cycles, their total duration & the duration of the last one (in seconds)
+        self.cycles = 0
+        self.cycle_seconds = 0.0
+        self.last_cycle_seconds = 0.0
+        self.cycle_latency = LatencyHistogram()
+
+        # Port diagnostics - times the port was opened, failed to open & failed in use
+        self.port_opens = 0
+        self.port_open_failures = 0
+        self.port_errors = 0
+
+        # The open port, and the bytes, lines & unsolicited lines read from the ports before it
+        self.port = None
+        self.port_totals = (0, 0, 0)
+
+        # Injected command diagnostics - how many were sent, how many weren't answered in time & their round trips
+        self.injected = 0
+        self.inject_timeouts = 0
+        self.inject_latency = LatencyHistogram()
 
-        # The thread on which the serial port sending will be performed
-        self.__poll_thread = threading.Thread(target=self.__poll)
+        # Batched command lines the modem rejected
+        self.batch_rejections = 0
+
+        # Keep results across restarts?
+        self.store = None
+        if store_config is not None and 'path' in store_config:
+            try:
+                self.store = MetricStore(
+                    store_config['path'],
+                    store_config['max_size'] if 'max_size' in store_config else 16 * 1024 * 1024,
+                    store_config['sync_interval'] if 'sync_interval' in store_config else 60
+                )
+                self.store.replay(self.history)
+            except Exception as store_err:
+                logger.warn("Could not open metric store %s: %s" % (store_config['path'], store_err))
+
+        # The event loop that owns the serial port, and an event used to wake it early
+        self.loop = None
+        self.__wakeup = None
+
+        # The thread on which the event loop will run
+        self.__poll_thread = threading.Thread(target=self.__run)
         self.__poll_thread.daemon = True
 
-    def inject(self, command):
+    def wait_ready(self, timeout=None, after=None):
+        """
+        Wait for up to timeout seconds (None = forever) for the modem to be answering on the AT port.
+        If after is given, waits for an attachment later than the one attaches counted then - e.g. for the modem to
+        come back after being reset, rather than answering on the port that is about to disappear.
+        Returns whether it is.
+        """
+        if after is None:
+            return self.ready.wait(timeout)
+
+        with self.attached:
+            return self.attached.wait_for(lambda: self.attaches > after and self.ready.is_set(), timeout)
+
+    def inject(self, command, timeout=10):
         """
         Submit a command outside of the usual polling.
+        Returns a concurrent.futures.Future that resolves to a (state, lines) tuple as returned by Command.receive().
+        The future always resolves within timeout seconds - with a None state if the modem didn't answer in time.
         """
-        if self.is_polling:
+        future = concurrent.futures.Future()
+        if self.is_polling and self.loop is not None:
             logger.info("Command injection requested: \"%s\"" % command)
-            self.inject_commands.append(command)
+            self.loop.call_soon_threadsafe(self.__queue_inject, command, timeout, future)
         else:
             logger.warn("Cannot inject while not polling AT interface: %s" % command)
+            future.set_result((None, []))
+        return future
+
+    def add_listener(self, listener):
+        """
+        Register a callable to be called (on the poll thread) whenever command results change.
+        """
+        self.listeners.append(listener)
+
+    def __notify(self):
+        """
+        Tell the listeners that command results have changed.
+        """
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception as listener_ex:
+                logger.error("Poller listener error: %s" % listener_ex)
+
+    def __port_totals(self):
+        """
+        Get the (bytes, lines, unsolicited lines) read from every port so far.
+        """
+        bytes_read, lines_read, unsolicited_lines = self.port_totals
+        port = self.port
+        if port is not None:
+            bytes_read += port.bytes_read
+            lines_read += port.lines_read
+            unsolicited_lines += port.unsolicited_lines
+        return (bytes_read, lines_read, unsolicited_lines)
+
+    def diagnostics(self):
+        """
+        Get the poller's diagnostic counters & latency histograms, and those of each command.
+        """
+        bytes_read, lines_read, unsolicited_lines = self.__port_totals()
+        return {
+            'dev': self.dev,
+            'batch': self.batch,
+            'ready': self.ready.is_set(),
+            'attach_latency': self.attach_latency.to_dict(),
+            'cycles': self.cycles,
+            'cycle_latency': self.cycle_latency.to_dict(),
+            'port_opens': self.port_opens,
+            'port_open_failures': self.port_open_failures,
+            'port_errors': self.port_errors,
+            'bytes_read': bytes_read,
+            'lines_read': lines_read,
+            'unsolicited_lines': unsolicited_lines,
+            'batch_rejections': self.batch_rejections,
+            'injected': self.injected,
+            'inject_timeouts': self.inject_timeouts,
+            'inject_latency': self.inject_latency.to_dict(),
+            'statsd_flush_latency': self.statsd.flush_latency.to_dict() if self.statsd is not None else None,
+            'commands': [command.diagnostics() for command in self.commands]
+        }
 
     def start(self):
         """
@@ -79,74 +253,364 @@ class Poller:
         self.is_polling = True
         self.__poll_thread.start()
 
-    def stop(self):
+    def stop(self, timeout=5):
         """
-        Stop polling
+        Stop polling, waiting for up to timeout seconds for the poll loop to finish, then close the metric store so
+        everything recorded is on disk.
         """
         self.is_polling = False
+        if self.__poll_thread.is_alive():
+            try:
+                self.loop.call_soon_threadsafe(self.__wakeup.set)
+            except (AttributeError, RuntimeError):
+                # The loop hasn't started yet, or has already finished
+                pass
+            if threading.current_thread() is not self.__poll_thread:
+                self.__poll_thread.join(timeout)
 
-    def __poll(self):
+        store = self.store
+        if store is not None:
+            self.store = None
+            store.close()
+
+    def __queue_inject(self, command, timeout, future):
+        """
+        Queue an injected command & wake the poll loop (on the event loop).
+        """
+        self.inject_commands.append((command, self.loop.time() + timeout, future))
+        self.loop.call_later(timeout, self.__expire_inject, command, future)
+        self.__wakeup.set()
+
+    def __expire_inject(self, command, future):
+        """
+        Give up on an injected command that hasn't been answered in time.
+        """
+        if not future.done():
+            logger.warn("Injected AT command timed out: %s" % command)
+            self.inject_timeouts += 1
+            future.set_result((None, []))
+
+    async def __sleep(self, delay):
+        """
+        Wait for up to delay seconds, returning early if woken by stop() or inject().
+        """
+        try:
+            await asyncio.wait_for(self.__wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        self.__wakeup.clear()
+
+    async def __inject(self, at_handle):
+        """
+        Send any injected commands, resolving their futures with the responses.
+        """
+        while self.inject_commands:
+            inject_cmd, deadline, future = self.inject_commands.popleft()
+
+            # Already timed out (or the caller gave up)?
+            remaining = deadline - self.loop.time()
+            if future.done() or remaining <= 0:
+                continue
+
+            # Whatever the command is, its own response lines (e.g. "+CREG:" for AT+CREG?) aren't URCs
+            sent = time.monotonic()
+            at_handle.write((inject_cmd + "\r\n").encode("utf-8"), [re.split(r'[=?;]', inject_cmd[2:], 1)[0] + ':'])
+            logger.info("Inject AT command: %s" % inject_cmd)
+            self.injected += 1
+            result = await Command.receive(at_handle, timeout=remaining, multi_result=True)
+            if result[0] is not None:
+                self.inject_latency.add(time.monotonic() - sent)
+            logger.info("Injected AT command %s returned %s" % (inject_cmd, "OK" if result[0] else "ERROR" if result[0] is False else "nothing"))
+
+            if not future.done():
+                future.set_result(result)
+
+    async def __poll_batch(self, at_handle, commands):
+        """
+        Poll several commands with a single concatenated command line (e.g. AT+CSQ;+QTEMP).
+        Each command is handed the response lines that belong to it.
+        Returns False if the modem rejected the line, in which case the commands should be polled individually.
+        """
+        logger.debug("Polling %d commands as a batch..." % len(commands))
+        sent = time.monotonic()
+        at_handle.write(
+            ("AT%s\r\n" % ";".join(command.query for command in commands)).encode("utf-8"),
+            [prefix for command in commands for prefix in command.response_prefixes]
+        )
+
+        # A single final result code covers the whole line
+        state, lines = await Command.receive(at_handle, timeout=3 * len(commands), multi_result=True)
+        latency = time.monotonic() - sent
+
+        # One bad command fails the whole line - we can't tell which, so let the caller retry them one by one
+        if state is False:
+            logger.warn("Batched poll rejected - polling commands individually")
+            self.batch_rejections += 1
+            return False
+
+        # Hand each line to the command it belongs to
+        command_lines = {command: [] for command in commands}
+        for line in lines:
+            for command in commands:
+                if command.owns(line):
+                    command_lines[command].append(line)
+                    break
+            else:
+                logger.debug("Unclaimed response line: %s" % line)
+
+        # Each command's latency is that of the whole line
+        for command in commands:
+            command.update(state, command_lines[command], latency)
+
+        return True
+
+    def __run(self):
+        """
+        Run the event loop on the poll thread.
+        """
+        asyncio.run(self.__poll())
+
+    def __record(self, commands):
+        """
+        Record the latest results of some commands in the history (and store) & aggregate them for statsd.
+        """
+        now = time.time()
+        for command in commands:
+            for result in command.results:
+
+                # Not a number (e.g. a status), or not available - nothing to plot
+                if not result.is_numeric:
+                    continue
+
+                value = result.value
+                self.history.record(result.key, value, now, command.interval / 1000)
+                if self.store is not None:
+                    self.store.append(result.key, value, now, command.interval / 1000)
+                if self.statsd is not None:
+                    self.statsd.add(result.key, value)
+
+        self.__notify()
+
+    def __on_unsolicited(self, line):
+        """
+        Dispatch a line that was not part of a command response to the commands interested in it.
+        """
+        handled = False
+        for command in self.commands:
+
+            # Update results straight from the URC?
+            if line.startswith(tuple(command.urc_prefixes)):
+                command.handle_urc(line)
+                self.__record([command])
+                handled = True
+
+            # Or poll for the full picture as soon as possible?
+            if line.startswith(tuple(command.refresh_prefixes)):
+                if self.scheduler.expedite(command, self.loop.time()):
+                    self.__wakeup.set()
+                handled = True
+
+        if handled:
+            logger.debug("URC: %s" % line)
+        else:
+            logger.debug("Unsolicited line: %s" % line)
+
+    async def __enable_urcs(self, at_handle):
+        """
+        Turn on the unsolicited result codes the commands are interested in.
+        """
+        at_handle.urc_prefixes = tuple(
+            prefix for command in self.commands for prefix in command.urc_prefixes + command.refresh_prefixes
+        )
+
+        for command in self.commands:
+            for setup in command.urc_setup:
+                at_handle.write(("AT%s\r\n" % setup).encode("utf-8"))
+                if not (await Command.receive(at_handle, multi_result=True))[0]:
+                    logger.warn("Could not enable URCs with AT%s" % setup)
+
+    def __open(self):
+        """
+        Open the serial port, returning a Port or None if it couldn't be opened.
+        """
+        logger.info("Opening serial port %s..." % self.dev)
+        try:
+            # Non-blocking - the event loop tells us when there is something to read
+            # A failed port wakes the poll loop, rather than leaving it asleep until the next command is due
+            at_handle = Port(
+                serial.Serial(self.dev, 115200, timeout=0), self.loop, self.__on_unsolicited, self.__wakeup.set
+            )
+        except Exception as serial_open_ex:
+            self.port_open_failures += 1
+            logger.warn("Could not open the AT port: %s" % serial_open_ex)
+            return None
+
+        # Keep the totals read from the last port
+        self.port_totals = self.__port_totals()
+        self.port = at_handle
+        self.port_opens += 1
+        logger.info("Serial port open.")
+        return at_handle
+
+    async def __probe_ready(self, at_handle):
+        """
+        Check that the modem is answering AT commands, waiting longer after each unanswered attempt.
+        """
+        for timeout in Poller.READY_TIMEOUTS:
+            at_handle.write(b"AT\r\n")
+            state, lines = await Command.receive(at_handle, timeout=timeout, multi_result=True)
+
+            # Any final result means the command interpreter is up
+            if state is not None:
+                return True
+            if not self.is_polling:
+                break
+        return False
+
+    async def __attach(self, watcher):
+        """
+        Open the AT port & wait for the modem to answer, retrying with exponential backoff until it does.
+        Returns the ready Port, or None if polling was stopped first.
+        """
+        start = self.loop.time()
+        delay = Poller.RETRY_MIN
+        while self.is_polling:
+
+            # No device node (e.g. the modem is re-enumerating after a reset)? Wait for it to appear
+            if not watcher.exists():
+                logger.info("Waiting for %s to appear..." % self.dev)
+                while self.is_polling and not await watcher.wait(1):
+                    pass
+                continue
+
+            at_handle = self.__open()
+            if at_handle is not None:
+                try:
+                    if await self.__probe_ready(at_handle):
+                        await self.__enable_urcs(at_handle)
+                        self.attach_latency.add(self.loop.time() - start)
+                        with self.attached:
+                            self.attaches += 1
+                            self.ready.set()
+                            self.attached.notify_all()
+                        logger.info("Modem ready on %s after %.2fs" % (self.dev, self.loop.time() - start))
+                        return at_handle
+                    logger.warn("The modem isn't answering on %s" % self.dev)
+                except Exception as serial_error:
+                    logger.error("Serial comms error: %s" % serial_error)
+                    self.port_errors += 1
+                at_handle.close()
+
+            # Back off before trying again
+            await self.__sleep(delay)
+            delay = min(delay * 2, Poller.RETRY_MAX)
+
+        return None
+
+    async def __poll(self):
         """
         The main poll loop.
         """
+        self.loop = asyncio.get_running_loop()
+        self.__wakeup = asyncio.Event()
         self.is_polling = True
 
+        # Tells us when the device node (re)appears
+        watcher = DeviceWatcher(self.dev, self.loop)
+
         try:
 
             # While we've not been terminated
             while self.is_polling:
 
-                # Wait a while before opening
-                time.sleep(7.5)
-
-                logger.info("Opening serial port %s..." % self.dev)
-                try:
-                    at_handle = serial.Serial(self.dev, 115200, timeout=3)
-                    logger.info("Serial port open.")
-                except Exception as serial_open_ex:
-                    at_handle = None
-                    logger.warn("Could not open the AT port: %s" % serial_open_ex)
-                    
-                # Clear all the previous results
+                # Not connected (any more) - clear all the previous results
+                self.ready.clear()
                 for command in self.commands:
                     command.results = []
+                self.__notify()
 
-                # While connected...
-                while at_handle is not None and at_handle.is_open:
+                at_handle = await self.__attach(watcher)
+                if at_handle is None:
+                    break
+
+                # Everything is due as soon as we're connected
+                self.scheduler.clear()
+                for command in self.commands:
+                    self.scheduler.schedule(command, self.loop.time())
+
+                try:
+                    # While connected...
+                    while self.is_polling and at_handle is not None and at_handle.is_open:
+
+                        # Wait until a command is due, or for something to inject
+                        while self.is_polling and not self.inject_commands and at_handle.is_open:
+                            next_deadline = self.scheduler.next_deadline()
+
+                            # Nothing scheduled (e.g. no commands)? Idle until there's something to inject
+                            if next_deadline is None:
+                                await self.__sleep(Poller.IDLE_DELAY)
+                                continue
+                            if self.loop.time() >= next_deadline:
+                                break
+                            await self.__sleep(next_deadline - self.loop.time())
 
-                    # Wait the poll delay
-                    time.sleep(self.poll_delay / 1000)
-                    try:
-                        # Poll each of the registered AT commands
-                        for command in self.commands:
-                            
-                            # Collect results from the command
-                            command.poll(at_handle)
-
-                            if self.statsd_client is not None:
-                                for result in command.results:
-                                    try:
-                                        self.statsd_client.gauge(result.key, float(result.value) if '.' in result.value else int(result.value))
-                                    except:
-                                        pass
-
-                        # Anything to inject?
-                        for inject_cmd in self.inject_commands:
-                            at_handle.write((inject_cmd + "\r\n").encode("utf-8"))
-                            logger.info("Inject AT command: %s" % inject_cmd)
-                            time.sleep(5)
-                            at_handle.flush()
-
-                        self.inject_commands.clear()
-
-                    except Exception as serial_error:
-                        logger.error("Serial comms error: %s" % serial_error)
                         try:
-                            at_handle.close()
-                        except:
-                            pass
-                        break
+                            # Injected commands pre-empt anything waiting to be polled
+                            await self.__inject(at_handle)
+
+                            cycle_start = self.loop.time()
+                            due = self.scheduler.pop_due(cycle_start)
+                            if not due:
+                                continue
+                            polled = [command for deadline, command in due]
+
+                            # Poll the due AT commands, in one go if we can
+                            if not self.batch or len(polled) < 2 or not await self.__poll_batch(at_handle, polled):
+                                for command in polled:
+
+                                    # Collect results from the command
+                                    await command.poll(at_handle)
+
+                                    # Let injected commands jump the rest of the queue
+                                    await self.__inject(at_handle)
+
+                            # Keep each command's own cadence, but don't try to catch up on polls we missed
+                            for deadline, command in due:
+                                self.scheduler.schedule(command, max(deadline + command.interval / 1000, self.loop.time()))
+
+                            self.last_cycle_seconds = self.loop.time() - cycle_start
+                            self.cycle_seconds += self.last_cycle_seconds
+                            self.cycle_latency.add(self.last_cycle_seconds)
+                            self.cycles += 1
+
+                            self.__record(polled)
+                            if self.store is not None:
+                                self.store.maybe_sync()
+                            if self.statsd is not None:
+                                self.statsd.maybe_flush()
+
+                        except Exception as serial_error:
+                            logger.error("Serial comms error: %s" % serial_error)
+                            self.port_errors += 1
+                            break
+
+                    else:
+                        # The port failed while we weren't reading from it
+                        if at_handle.error is not None:
+                            logger.error("Serial comms error: %s" % at_handle.error)
+                            self.port_errors += 1
+
+                # Whatever happened, let go of the port before attaching again
+                finally:
+                    try:
+                        at_handle.close()
+                    except Exception:
+                        pass
 
         except Exception as poll_ex:
             logger.error('Error polling AT interface %s: %s' % (self.dev, poll_ex))
             raise poll_ex
+
+        finally:
+            self.ready.clear()
+            watcher.close()
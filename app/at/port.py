@@ -0,0 +1,182 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LineFramer:
+    """
+    Incrementally splits a stream of bytes from the AT interface into lines.
+    Partial lines are kept until the rest of the line arrives.
+    """
+
+    def __init__(self, encoding='ascii'):
+        """
+        Create a new line framer.
+        """
+        self.encoding = encoding
+
+        # Bytes received after the last complete line
+        self.buffer = b''
+
+    def feed(self, data):
+        """
+        Add received bytes, returning a list of any lines that are now complete.
+        Empty lines are dropped.
+        """
+        self.buffer += data
+
+        # Nothing to do until we've got at least one line terminator
+        if b'\n' not in self.buffer:
+            return []
+
+        # Everything after the last terminator is a partial line - keep it for later
+        complete, _, self.buffer = self.buffer.rpartition(b'\n')
+
+        lines = []
+        for line in complete.split(b'\n'):
+            line = line.strip(b'\r')
+            if line:
+                lines.append(line.decode(self.encoding, errors='replace'))
+        return lines
+
+    def reset(self):
+        """
+        Discard any partial line.
+        """
+        self.buffer = b''
+
+class Port:
+    """
+    A line-oriented AT interface on top of a non-blocking serial port, driven by an asyncio event loop.
+    Lines that arrive while no command is awaiting a response, or that look like unsolicited result codes (URCs)
+    the command isn't expecting, are handed to the unsolicited line handler.
+    """
+
+    def __init__(self, serial_port, loop, on_unsolicited=None, on_error=None):
+        """
+        Wrap an open serial port (which must have been opened with timeout=0).
+        on_error is called (on the event loop) if reading from the port fails.
+        """
+        self.serial_port = serial_port
+        self.loop = loop
+        self.framer = LineFramer()
+
+        # Called with each line received outside of a command/response exchange
+        self.on_unsolicited = on_unsolicited
+        self.on_error = on_error
+
+        # Complete lines received for the command in progress
+        self.lines = asyncio.Queue()
+
+        # Is a command awaiting its response?
+        self.in_transaction = False
+
+        # Prefixes of URCs that may turn up in the middle of a response, and of the responses the current command expects
+        self.urc_prefixes = ()
+        self.expected_prefixes = ()
+
+        # Any error raised while reading - reported to the next reader
+        self.error = None
+
+        # What has been received - bytes, complete lines & lines handed to the unsolicited line handler
+        self.bytes_read = 0
+        self.lines_read = 0
+        self.unsolicited_lines = 0
+
+        # Read whenever the descriptor becomes readable rather than blocking or polling
+        self.loop.add_reader(self.serial_port.fileno(), self.__on_readable)
+
+    @property
+    def is_open(self):
+        return self.error is None and self.serial_port.is_open
+
+    def __on_readable(self):
+        """
+        Take everything waiting on the serial port and dispatch any complete lines.
+        """
+        try:
+            got = self.serial_port.read(max(1, self.serial_port.in_waiting))
+        except Exception as read_ex:
+            # Stop watching a dead descriptor & wake anyone waiting on it
+            self.error = read_ex
+            self.loop.remove_reader(self.serial_port.fileno())
+            self.lines.put_nowait(None)
+            if self.on_error is not None:
+                self.on_error()
+            return
+
+        self.bytes_read += len(got)
+        for line in self.framer.feed(got):
+            self.lines_read += 1
+            if self.in_transaction and not self.__is_urc(line):
+                self.lines.put_nowait(line)
+            else:
+                self.__unsolicited(line)
+
+    def __unsolicited(self, line):
+        """
+        Hand a line to the unsolicited line handler - a handler that fails mustn't lose the lines that follow it.
+        """
+        self.unsolicited_lines += 1
+        if self.on_unsolicited is None:
+            logger.debug("Unsolicited line: %s" % line)
+            return
+
+        try:
+            self.on_unsolicited(line)
+        except Exception as handler_ex:
+            logger.error("Error handling unsolicited line %s: %s" % (line, handler_ex))
+
+    def __is_urc(self, line):
+        """
+        Check whether a line received mid-response is actually an unsolicited result code.
+        """
+        return line.startswith(self.urc_prefixes) and not line.startswith(self.expected_prefixes)
+
+    def write(self, data, response_prefixes=()):
+        """
+        Write a command to the interface, starting a command/response exchange.
+        response_prefixes are the prefixes of the response lines expected, which are never treated as URCs.
+        """
+        self.in_transaction = True
+        self.expected_prefixes = tuple(response_prefixes)
+        return self.serial_port.write(data)
+
+    def done(self):
+        """
+        Finish the command/response exchange - anything else received is unsolicited.
+        """
+        self.in_transaction = False
+
+        # Hand over anything that arrived after the final result
+        while not self.lines.empty():
+            line = self.lines.get_nowait()
+            if line is not None:
+                self.__unsolicited(line)
+
+    def flush(self):
+        self.serial_port.flush()
+
+    def close(self):
+        if self.error is None:
+            self.loop.remove_reader(self.serial_port.fileno())
+        self.framer.reset()
+        self.serial_port.close()
+
+    async def read_line(self, timeout):
+        """
+        Read a single line, waiting for at most timeout seconds.
+        Returns None if no complete line arrived in time.
+        """
+        if self.error is not None:
+            raise self.error
+
+        try:
+            line = await asyncio.wait_for(self.lines.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        if line is None and self.error is not None:
+            raise self.error
+
+        return line
@@ -0,0 +1,64 @@
+import heapq
+import itertools
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Scheduler:
+    """
+    Keeps track of when each command is next due, as a heap ordered by deadline then priority.
+    """
+
+    def __init__(self):
+        """
+        Create a new, empty scheduler.
+        """
+
+        # Heap of (deadline, priority, sequence, command) entries
+        self.heap = []
+
+        # Tie-breaker so commands themselves never need comparing
+        self.__sequence = itertools.count()
+
+    def schedule(self, command, deadline):
+        """
+        Schedule a command to be polled at (or after) deadline.
+        """
+        heapq.heappush(self.heap, (deadline, command.priority, next(self.__sequence), command))
+
+    def expedite(self, command, deadline):
+        """
+        Bring a scheduled command's deadline forward.
+        Returns False if the command isn't currently scheduled (e.g. because it is being polled right now).
+        """
+        for index, entry in enumerate(self.heap):
+            if entry[3] is command:
+                if entry[0] > deadline:
+                    self.heap[index] = (deadline, entry[1], entry[2], entry[3])
+                    heapq.heapify(self.heap)
+                return True
+        return False
+
+    def clear(self):
+        """
+        Forget all scheduled commands.
+        """
+        self.heap = []
+
+    def next_deadline(self):
+        """
+        Get the deadline of the command that is due soonest, or None if nothing is scheduled.
+        """
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now):
+        """
+        Remove & return all the commands due at or before now as (deadline, command) tuples, most important first.
+        """
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap))
+
+        # Everything here is already late, so priority decides the order
+        due.sort(key=lambda entry: (entry[1], entry[0], entry[2]))
+        return [(entry[0], entry[3]) for entry in due]
@@ -0,0 +1,267 @@
+import os
+import mmap
+import time
+import struct
+import logging
+import threading
+from array import array
+
+logger = logging.getLogger(__name__)
+
+class MetricStore:
+    """
+    A fixed-size, memory-mapped circular file of (sequence, timestamp, metric id, value) records that survives restarts.
+
+    The file starts with a header and a table of metrics, followed by the records:
+
+        header:  magic, version, record size, capacity, number of records written as of the last sync
+        metrics: MAX_METRICS x (null-padded key, float32 sampling interval in seconds or 0) - a metric's id is its index
+        records: capacity x (uint64 sequence, float64 timestamp, uint32 metric id, float32 value)
+
+    Appending only writes to the mapping, and sync() flushes it to disk. Each record carries its sequence number
+    (starting at 1, with 0 meaning an empty slot), so when the store is opened the write position is found from
+    the records themselves - it doesn't matter whether we were stopped before the header was last written, and
+    any slots left over from an earlier lap of the file are skipped.
+    """
+
+    MAGIC = b'QCPM'
+    VERSION = 1
+
+    HEADER = struct.Struct('<4sHHIQ')
+    METRIC = struct.Struct('<28sf')
+    RECORD = struct.Struct('<QdIf')
+
+    MAX_METRICS = 256
+    METRICS_OFFSET = 64
+
+    # Records start on a page boundary so they can be flushed independently of the header
+    RECORDS_OFFSET = -(-(METRICS_OFFSET + MAX_METRICS * METRIC.size) // mmap.PAGESIZE) * mmap.PAGESIZE
+
+    def __init__(self, path, max_size=16 * 1024 * 1024, sync_interval=60):
+        """
+        Open (or create) a store at path, using at most max_size bytes.
+        The records are flushed to disk at most every sync_interval seconds.
+        """
+        self.path = path
+        self.sync_interval = sync_interval
+        self.capacity = (max_size - MetricStore.RECORDS_OFFSET) // MetricStore.RECORD.size
+        if self.capacity <= 0:
+            raise ValueError("Metric store size %d is too small" % max_size)
+
+        # Appends happen on the poller's thread, reads on the web server's
+        self.lock = threading.Lock()
+
+        # When the records were last flushed
+        self.last_sync = time.monotonic()
+
+        size = MetricStore.RECORDS_OFFSET + self.capacity * MetricStore.RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            existing = os.fstat(fd).st_size
+            if existing != size:
+                os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        if existing != size or not self.__load():
+            self.__initialise()
+
+    def __load(self):
+        """
+        Read the header & metric names of an existing file.
+        Returns False if the file isn't a store we can use.
+        """
+        magic, version, record_size, capacity, synced = MetricStore.HEADER.unpack_from(self.mm, 0)
+        if magic != MetricStore.MAGIC or version != MetricStore.VERSION or record_size != MetricStore.RECORD.size or capacity != self.capacity:
+            logger.warn("Metric store %s is not compatible - starting afresh" % self.path)
+            return False
+
+        self.names = []
+        self.intervals = []
+        for index in range(MetricStore.MAX_METRICS):
+            name, interval = MetricStore.METRIC.unpack_from(self.mm, MetricStore.METRICS_OFFSET + index * MetricStore.METRIC.size)
+            name = name.rstrip(b'\0')
+            if not name:
+                break
+            self.names.append(name.decode('utf-8'))
+            self.intervals.append(interval if interval > 0 else None)
+        self.ids = {name: index for index, name in enumerate(self.names)}
+
+        # The newest record tells us where to carry on writing, whatever the header says
+        with memoryview(self.mm) as mapping, mapping[MetricStore.RECORDS_OFFSET:] as records, records.cast('Q') as words:
+            self.sequence = max(words[::MetricStore.RECORD.size // 8])
+        if self.sequence != synced:
+            logger.info("Metric store %s wasn't closed cleanly - recovered %d records written since it was last synced" % (
+                self.path, self.sequence - synced
+            ))
+
+        logger.info("Metric store %s opened with %d records of %d metrics" % (self.path, len(self), len(self.names)))
+        return True
+
+    def __initialise(self):
+        """
+        Write an empty store.
+        """
+        self.mm[:MetricStore.RECORDS_OFFSET] = bytes(MetricStore.RECORDS_OFFSET)
+        self.sequence = 0
+        self.names = []
+        self.intervals = []
+        self.ids = {}
+        self.__write_header()
+        self.mm.flush()
+
+    def __write_header(self):
+        MetricStore.HEADER.pack_into(self.mm, 0, MetricStore.MAGIC, MetricStore.VERSION, MetricStore.RECORD.size, self.capacity, self.sequence)
+
+    def __len__(self):
+        return min(self.sequence, self.capacity)
+
+    def __metric_id(self, key, interval):
+        """
+        Get the id of a metric, adding it to the metrics table if it's new (or updating its sampling interval).
+        Returns None if the table is full.
+        """
+        metric_id = self.ids.get(key)
+        if metric_id is not None and (interval is None or interval == self.intervals[metric_id]):
+            return metric_id
+
+        if metric_id is None:
+            if len(self.names) >= MetricStore.MAX_METRICS:
+                return None
+
+            metric_id = len(self.names)
+            self.names.append(key)
+            self.intervals.append(None)
+            self.ids[key] = metric_id
+
+        self.intervals[metric_id] = interval
+        MetricStore.METRIC.pack_into(
+            self.mm,
+            MetricStore.METRICS_OFFSET + metric_id * MetricStore.METRIC.size,
+            key.encode('utf-8'),
+            interval if interval is not None else 0
+        )
+        return metric_id
+
+    def append(self, key, value, timestamp=None, interval=None):
+        """
+        Append a record, overwriting the oldest if the store is full.
+        interval is how often (in seconds) the metric is sampled, which is kept so replay() can size its history.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self.lock:
+            metric_id = self.__metric_id(key, interval)
+            if metric_id is None:
+                logger.debug("Metric store full - not storing %s" % key)
+                return
+
+            offset = MetricStore.RECORDS_OFFSET + (self.sequence % self.capacity) * MetricStore.RECORD.size
+            self.sequence += 1
+            MetricStore.RECORD.pack_into(self.mm, offset, self.sequence, timestamp, metric_id, value)
+
+    def maybe_sync(self):
+        """
+        Flush to disk if sync_interval has passed since the last flush.
+        """
+        if time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """
+        Flush the records, then the header that points at them.
+        """
+        with self.lock:
+            self.mm.flush(MetricStore.RECORDS_OFFSET, len(self.mm) - MetricStore.RECORDS_OFFSET)
+            self.__write_header()
+            self.mm.flush(0, MetricStore.RECORDS_OFFSET)
+            self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.mm.close()
+
+    def __timestamp(self, index):
+        """
+        Get the timestamp of the index-th oldest record.
+        """
+        slot = (self.sequence - len(self) + index) % self.capacity
+        return MetricStore.RECORD.unpack_from(self.mm, MetricStore.RECORDS_OFFSET + slot * MetricStore.RECORD.size)[1]
+
+    def __read(self, since=None):
+        """
+        Copy the records at or after since (all of them if it's None), oldest first.
+        Returns the sequence number before the oldest record held - any record at or below it is an empty slot, or a
+        stale one from an earlier lap of the file - and the records as one or two byte strings.
+        """
+        with self.lock:
+            count = len(self)
+
+            # Records are appended in time order, so the first one we want can be found by bisecting
+            low = 0
+            if since is not None:
+                high = count
+                while low < high:
+                    middle = (low + high) // 2
+                    if self.__timestamp(middle) < since:
+                        low = middle + 1
+                    else:
+                        high = middle
+
+            # Copied while we hold the lock, as the slots may be overwritten as soon as it's released
+            size = MetricStore.RECORD.size
+            start = (self.sequence - count + low) % self.capacity
+            end = start + count - low
+            if end <= self.capacity:
+                chunks = [self.mm[MetricStore.RECORDS_OFFSET + start * size:MetricStore.RECORDS_OFFSET + end * size]]
+            else:
+                chunks = [
+                    self.mm[MetricStore.RECORDS_OFFSET + start * size:MetricStore.RECORDS_OFFSET + self.capacity * size],
+                    self.mm[MetricStore.RECORDS_OFFSET:MetricStore.RECORDS_OFFSET + (end - self.capacity) * size]
+                ]
+            return self.sequence - count, chunks
+
+    def __iter_records(self, since=None):
+        """
+        Decode the stored records at or after since, oldest first, as (timestamp, metric id, value) tuples.
+        """
+        first, chunks = self.__read(since)
+        for chunk in chunks:
+            for sequence, timestamp, metric_id, value in MetricStore.RECORD.iter_unpack(chunk):
+                if sequence > first:
+                    yield (timestamp, metric_id, value)
+
+    def query(self, key, since=None):
+        """
+        Get the (timestamps, values) arrays stored for a metric at or after since.
+        Returns None if nothing has been stored for the metric.
+        """
+        metric_id = self.ids.get(key)
+        if metric_id is None:
+            return None
+
+        times = array('d')
+        values = array('f')
+        for timestamp, record_id, value in self.__iter_records(since):
+            # The clock may have been set back since, leaving older records after the first one we want
+            if record_id == metric_id and (since is None or timestamp >= since):
+                times.append(timestamp)
+                values.append(value)
+        return (times, values)
+
+    def replay(self, history):
+        """
+        Feed all the stored records into a History, e.g. after a restart.
+        History needs each metric's samples in time order, so any that go back in time (e.g. the clock was set back)
+        are skipped.
+        """
+        names = list(self.names)
+        intervals = list(self.intervals)
+        latest = {}
+        for timestamp, metric_id, value in self.__iter_records():
+            if metric_id >= len(names) or timestamp < latest.get(metric_id, timestamp):
+                continue
+            latest[metric_id] = timestamp
+            history.record(names[metric_id], value, timestamp, intervals[metric_id])
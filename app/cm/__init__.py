@@ -1,2 +1,4 @@
 from .supervisor import Supervisor
 from .internet_checker import InternetChecker
+from .restart_policy import RestartPolicy, RestartAction
+from .connection import ConnectionMonitor, ConnectionState
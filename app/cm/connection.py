@@ -0,0 +1,245 @@
+import time
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+class ConnectionState:
+    """
+    The states of the connection, as seen by the ConnectionMonitor.
+    """
+
+    # We've never heard from the modem, so can't tell what the radio is doing
+    UNKNOWN = 'unknown'
+
+    # The modem has stopped answering on its AT port (e.g. it's rebooting)
+    NO_MODEM = 'no_modem'
+
+    # No cell to use - searching, or camped without being registered
+    NO_SERVICE = 'no_service'
+
+    # Registered, but the signal is too weak to carry data
+    POOR_SIGNAL = 'poor_signal'
+
+    # The radio is usable, but quectel_CM isn't running
+    CM_DOWN = 'cm_down'
+
+    # The radio is usable & quectel_CM is running, but the internet isn't reachable
+    DATA_DOWN = 'data_down'
+
+    CONNECTED = 'connected'
+
+    # States in which restarting quectel_CM can't help
+    RADIO_DOWN = (NO_MODEM, NO_SERVICE, POOR_SIGNAL)
+
+class ConnectionMonitor:
+    """
+    Combines the radio state (UE status, registration & RSRP from the poller), the internet checker's verdict and
+    whether quectel_CM is running into a single connection state, so the supervisor only restarts things that can
+    help. While the radio is down we wait for it (for up to max_wait seconds) rather than restarting, and as soon as
+    it's back the internet is checked straight away instead of waiting for the next poll.
+    """
+
+    # UE statuses (from AT+QENG="servingcell") meaning there's no cell we can use
+    NO_SERVICE_STATUSES = ('SEARCH', 'LIMSRV')
+
+    # UE statuses meaning we're camped on a cell & registered
+    SERVICE_STATUSES = ('NOCONN', 'CONNECT')
+
+    # Results holding the serving cell's signal power, for each technology
+    RSRP_KEYS = ('lte_rsrp', 'nr_sa_rsrp', 'nr_nsa_rsrp')
+
+    def __init__(self, poller, ip_checker, min_rsrp=-125, max_wait=300):
+        """
+        Create a new monitor & start following the poller & internet checker.
+        min_rsrp is the weakest signal (dBm) worth trying to carry data over.
+        max_wait is how long (in seconds) to hold off restarting while the radio is down, in case the modem is stuck.
+        """
+        self.poller = poller
+        self.ip_checker = ip_checker
+        self.min_rsrp = min_rsrp
+        self.max_wait = max_wait
+
+        # The command that reports registration, if any
+        self.registration = None
+        for command in poller.commands:
+            if hasattr(command, 'registered'):
+                self.registration = command
+
+        # Is quectel_CM running? Kept up to date by the supervisor
+        self.cm_running = False
+
+        # The current state, when (monotonic time) we entered it, and since when the radio has been down (or None)
+        self.state = ConnectionState.UNKNOWN
+        self.since = time.monotonic()
+        self.radio_down_since = None
+
+        # The latest radio readings
+        self.status = None
+        self.registered = None
+        self.rsrp = None
+
+        # Statistics - times each state was entered, and how often the radio came back
+        self.transitions = collections.Counter()
+        self.radio_recoveries = 0
+
+        # Callables to notify when the state changes
+        self.listeners = []
+
+        # Updates come from the poll, internet checker & supervision threads
+        self.lock = threading.Lock()
+
+        poller.add_listener(self.update)
+        ip_checker.add_listener(self.update)
+
+    @staticmethod
+    def from_config(connection_config, poller, ip_checker):
+        """
+        Create a monitor from its configuration (see the cm.connection section of config.yml.dist).
+        """
+        return ConnectionMonitor(
+            poller,
+            ip_checker,
+            connection_config['min_rsrp'] if 'min_rsrp' in connection_config else -125,
+            connection_config['max_wait'] if 'max_wait' in connection_config else 300
+        )
+
+    def add_listener(self, listener):
+        """
+        Register a callable to be called (on whichever thread noticed) whenever the state changes.
+        """
+        self.listeners.append(listener)
+
+    def __notify(self):
+        """
+        Tell the listeners that the state has changed.
+        """
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception as listener_ex:
+                logger.error("Connection monitor listener error: %s" % listener_ex)
+
+    def set_cm_running(self, running):
+        """
+        Record whether quectel_CM is running.
+        """
+        self.cm_running = running
+        self.update()
+
+    def __read_radio(self):
+        """
+        Pick the UE status, registration & best serving cell RSRP out of the poller's latest results.
+        """
+        status = None
+        rsrp = None
+        for command in self.poller.commands:
+            for result in command.results:
+                if result.key == 'status':
+                    status = result.value
+                elif result.key in ConnectionMonitor.RSRP_KEYS and result.value is not None:
+                    rsrp = result.value if rsrp is None else max(rsrp, result.value)
+
+        self.status = status
+        self.registered = self.registration.registered if self.registration is not None else None
+        self.rsrp = rsrp
+
+    def __radio_state(self):
+        """
+        Work out the radio's state - one of ConnectionState.RADIO_DOWN, or None if it's usable (or we can't tell).
+        """
+
+        # Never heard from the modem? Then we know nothing
+        if self.poller.attaches == 0:
+            return None
+        if not self.poller.ready.is_set():
+            return ConnectionState.NO_MODEM
+
+        # The UE status is the best guide, as registration doesn't cover every mode (e.g. 5G SA)
+        self.__read_radio()
+        if self.status in ConnectionMonitor.NO_SERVICE_STATUSES:
+            return ConnectionState.NO_SERVICE
+        if self.status not in ConnectionMonitor.SERVICE_STATUSES and self.registered is False:
+            return ConnectionState.NO_SERVICE
+        if self.rsrp is not None and self.rsrp < self.min_rsrp:
+            return ConnectionState.POOR_SIGNAL
+        return None
+
+    def update(self):
+        """
+        Re-evaluate the state from everything we follow, reacting to the radio coming back.
+        """
+        with self.lock:
+            state = self.__radio_state()
+            radio_known = state is not None or self.poller.attaches > 0
+            if state is None:
+                if not self.cm_running:
+                    state = ConnectionState.CM_DOWN
+                elif not self.ip_checker.has_internet():
+                    state = ConnectionState.DATA_DOWN
+                elif radio_known:
+                    state = ConnectionState.CONNECTED
+                else:
+                    state = ConnectionState.UNKNOWN
+
+            if state == self.state:
+                return
+
+            now = time.monotonic()
+            logger.info("Connection state %s -> %s (status %s, registered %s, RSRP %s)" % (
+                self.state, state, self.status, self.registered, self.rsrp
+            ))
+
+            # Radio gone, or back?
+            radio_restored = False
+            if state in ConnectionState.RADIO_DOWN:
+                if self.radio_down_since is None:
+                    self.radio_down_since = now
+            elif self.radio_down_since is not None:
+                logger.info("Radio usable again after %.1fs" % (now - self.radio_down_since))
+                self.radio_down_since = None
+                self.radio_recoveries += 1
+                radio_restored = True
+
+            self.state = state
+            self.since = now
+            self.transitions[state] += 1
+
+        # Give quectel_CM a clean slate to reconnect with & find out how it's doing straight away
+        if radio_restored:
+            self.ip_checker.reset()
+            self.ip_checker.check_now()
+
+        self.__notify()
+
+    def radio_down(self):
+        """
+        Is the radio down? i.e. restarting quectel_CM won't help.
+        """
+        return self.state in ConnectionState.RADIO_DOWN
+
+    def should_wait(self):
+        """
+        Should restarts be held off until the radio is back?
+        Only for up to max_wait seconds - the modem may be stuck, and something more drastic may help.
+        """
+        radio_down_since = self.radio_down_since
+        return radio_down_since is not None and time.monotonic() - radio_down_since < self.max_wait
+
+    def diagnostics(self):
+        """
+        Get the monitor's state & statistics.
+        """
+        radio_down_since = self.radio_down_since
+        return {
+            'state': self.state,
+            'for': time.monotonic() - self.since,
+            'status': self.status,
+            'registered': self.registered,
+            'rsrp': self.rsrp,
+            'cm_running': self.cm_running,
+            'radio_down_for': time.monotonic() - radio_down_since if radio_down_since is not None else None,
+            'radio_recoveries': self.radio_recoveries,
+            'transitions': dict(self.transitions)
+        }
@@ -1,8 +1,10 @@
 import time
-import datetime
 import logging
 import threading
-import socket
+import concurrent.futures
+
+from .probes import Probe
+from at.diagnostics import LatencyHistogram
 
 logger = logging.getLogger(__name__)
 
@@ -10,15 +12,36 @@ class InternetChecker:
     """
     Checks to see if we have IPv4 capability.
     Spawns a thread that periodically checks Internet connectivity and updates the instance.
+
+    Each check races all the configured probes concurrently & succeeds as soon as any of them answers.
+    Healthy links are checked at most every poll_delay ms; once a check fails we re-check every fast_delay ms,
+    backing off again (doubling the delay) once connectivity returns.
     """
 
-    def __init__(self, poll_delay=30000, max_failures=3):
+    # Google Public DNS & Cloudflare DNS on port 53 (dns)
+    DEFAULT_PROBES = [
+        {'type': 'tcp', 'host': '8.8.8.8', 'port': 53},
+        {'type': 'tcp', 'host': '1.1.1.1', 'port': 53}
+    ]
+
+    def __init__(self, poll_delay=30000, max_failures=3, probes=None, fast_delay=2000, timeout=3):
         """
         Create a new InternetChecker
+        probes is a list of probe configurations (see Probe.from_config), or Probe instances.
         """
 
-        # The delay in ms between polls
+        # The delay in ms between polls while healthy, and after a failure
         self.poll_delay = poll_delay
+        self.fast_delay = min(fast_delay, poll_delay)
+
+        # The delay before the next poll
+        self.delay = poll_delay
+
+        # How long (in seconds) each probe's network operations may take
+        self.timeout = timeout
+
+        # The targets to probe
+        self.probes = [probe if isinstance(probe, Probe) else Probe.from_config(probe) for probe in (probes if probes else InternetChecker.DEFAULT_PROBES)]
 
         # Are we polling periodically?
         self.is_polling = False
@@ -29,15 +52,53 @@ class InternetChecker:
         # Failure count
         self.failures = 0
 
+        # Total checks made, how many of them failed, and when (monotonic time) the last one passed
+        self.checks = 0
+        self.check_failures = 0
+        self.last_success = None
+
+        # Diagnostics - how long successful checks took, and each probe's round trips & failures
+        self.check_latency = LatencyHistogram()
+        self.probe_latency = {probe: LatencyHistogram() for probe in self.probes}
+        self.probe_failures = {probe: 0 for probe in self.probes}
+        self.probe_lock = threading.Lock()
+
+        # Probes run on a thread each - a probe still running from an earlier check is waited for rather than started
+        # again, so probes that hang (until their timeout) can't pile up threads
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.probes), thread_name_prefix='probe')
+        self.running = {}
+
+        # Callables to notify when connectivity is lost or restored
+        self.listeners = []
+
+        # Set to cut the wait before the next poll short
+        self.__wakeup = threading.Event()
+
         # The thread on which the serial port sending will be performed
         self.__poll_thread = threading.Thread(target=self.__poll)
         self.__poll_thread.daemon = True
 
+    def add_listener(self, listener):
+        """
+        Register a callable to be called (on the checker thread) whenever has_internet() changes.
+        """
+        self.listeners.append(listener)
+
+    def __notify(self):
+        """
+        Tell the listeners that connectivity has changed.
+        """
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception as listener_ex:
+                logger.error("Internet checker listener error: %s" % listener_ex)
+
     def start(self):
         """
         Start polling
         """
-        logger.info("Starting Internet Connectivity Monitoring")
+        logger.info("Starting Internet Connectivity Monitoring of %s" % ", ".join(str(probe) for probe in self.probes))
         self.is_polling = True
         self.__poll_thread.start()
 
@@ -47,6 +108,13 @@ class InternetChecker:
         """
         logger.info("Stopping Internet Connectivity Monitoring")
         self.is_polling = False
+        self.__wakeup.set()
+
+    def check_now(self):
+        """
+        Check connectivity as soon as possible rather than waiting for the next poll.
+        """
+        self.__wakeup.set()
 
     def reset(self):
         """
@@ -54,7 +122,10 @@ class InternetChecker:
         """
         if self.failures > 0:
             logger.info("Failure count reset to 0 - was %d" % self.failures)
+            had_internet = self.has_internet()
             self.failures = 0
+            if not had_internet:
+                self.__notify()
 
     def has_internet(self):
         """
@@ -62,22 +133,60 @@ class InternetChecker:
         """
         return self.failures < self.max_failures
 
-    @staticmethod
-    def __internet_on(host='8.8.8.8', port=53, timeout=3):
+    def diagnostics(self):
+        """
+        Get the checker's diagnostic counters & latency histograms.
         """
-        Poll a host to see if we have an internet connection.
-        By default polls Google Public DNS on port 53 (dns).
+        return {
+            'internet': self.has_internet(),
+            'failures': self.failures,
+            'checks': self.checks,
+            'check_failures': self.check_failures,
+            'delay': self.delay,
+            'check_latency': self.check_latency.to_dict(),
+            'probes': [{
+                'probe': str(probe),
+                'failures': self.probe_failures[probe],
+                'latency': self.probe_latency[probe].to_dict()
+            } for probe in self.probes]
+        }
+
+    def __internet_on(self):
         """
+        Race all the probes to see if we have an internet connection.
+        Returns as soon as one probe succeeds, or once they have all failed.
+        """
+        start = time.monotonic()
+
+        def run(probe):
+            probe_start = time.monotonic()
+            try:
+                ok = probe.check(self.timeout)
+                self.probe_latency[probe].add(time.monotonic() - probe_start)
+                return probe, ok, None
+            except Exception as probe_ex:
+                with self.probe_lock:
+                    self.probe_failures[probe] += 1
+                return probe, False, probe_ex
+
+        # Stragglers finish (bounded by their socket timeouts) on their own after we've returned
+        for probe in self.probes:
+            if probe not in self.running or self.running[probe].done():
+                self.running[probe] = self.executor.submit(run, probe)
+
         try:
-            socket.setdefaulttimeout(timeout)
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            sock.close()
-            logger.info("Internet connectivity OK.")
-            return True
-        except socket.error as ex:
-            logger.warn("Internet checker fault: %s" % ex)
-            return False
+            for future in concurrent.futures.as_completed(list(self.running.values()), timeout=self.timeout * 2 + 1):
+                probe, ok, error = future.result()
+                if ok:
+                    logger.debug("Internet connectivity OK via %s." % probe)
+                    self.check_latency.add(time.monotonic() - start)
+                    return True
+                logger.info("Internet checker fault on %s: %s" % (probe, error))
+        except concurrent.futures.TimeoutError:
+            pass
+
+        logger.warn("Internet checker fault: no probe succeeded")
+        return False
 
     def __poll(self):
         """
@@ -89,19 +198,37 @@ class InternetChecker:
         # While we've not been terminated
         while self.is_polling:
 
-            # Wait a while before opening
-            time.sleep(self.poll_delay / 1000)
+            # Wait a while (or until asked to check now) before checking
+            self.__wakeup.wait(self.delay / 1000)
+            self.__wakeup.clear()
+            if not self.is_polling:
+                break
+
+            had_internet = self.has_internet()
 
             try:
-                if not InternetChecker.__internet_on():
+                connected = self.__internet_on()
+                self.checks += 1
+                if not connected:
+                    self.check_failures += 1
                     self.failures += 1
+                    self.delay = self.fast_delay
                     logger.warn("No internet connectivity - %d consecutive failures now" % self.failures)
                 else:
+                    self.last_success = time.monotonic()
                     if self.failures > 0:
                         logger.info("Connectivity Restored - resetting failure count to 0 (was %d)" % self.failures)
                         self.failures = 0
 
+                    # Back off towards the normal poll delay while things stay healthy
+                    self.delay = min(self.delay * 2, self.poll_delay)
+
             except Exception as ic_check_err:
                 logger.error("Internet connectivity check error: %s" % ic_check_err)
                 continue
 
+            if self.has_internet() != had_internet:
+                self.__notify()
+
+        # Let any probes still running finish by themselves
+        self.executor.shutdown(wait=False)
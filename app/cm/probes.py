@@ -0,0 +1,116 @@
+import os
+import socket
+import struct
+import logging
+import http.client
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+class Probe:
+    """
+    Abstract connectivity probe.
+    """
+
+    def check(self, timeout):
+        """
+        Check connectivity, waiting at most timeout seconds for each network operation.
+        Returns True if the target answered, otherwise raises an exception (socket.error, etc).
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def from_config(probe_config):
+        """
+        Create a probe from its configuration (a dictionary with a "type" & the type's settings).
+        """
+        probe_type = probe_config['type'] if 'type' in probe_config else 'tcp'
+        if probe_type == 'tcp':
+            return TcpProbe(probe_config['host'], probe_config['port'] if 'port' in probe_config else 53)
+        elif probe_type == 'dns':
+            return DnsProbe(
+                probe_config['server'],
+                probe_config['name'] if 'name' in probe_config else 'example.com',
+                probe_config['port'] if 'port' in probe_config else 53
+            )
+        elif probe_type == 'http':
+            return HttpProbe(probe_config['url'])
+        raise ValueError("Unknown probe type %s" % probe_type)
+
+class TcpProbe(Probe):
+    """
+    Checks that a TCP connection can be opened.
+    """
+
+    def __init__(self, host, port=53):
+        self.host = host
+        self.port = port
+
+    def __str__(self):
+        return "tcp://%s:%d" % (self.host, self.port)
+
+    def check(self, timeout):
+        sock = socket.create_connection((self.host, self.port), timeout=timeout)
+        sock.close()
+        return True
+
+class DnsProbe(Probe):
+    """
+    Checks that a DNS server answers a query (whatever the answer is).
+    """
+
+    def __init__(self, server, name='example.com', port=53):
+        self.server = server
+        self.name = name
+        self.port = port
+
+    def __str__(self):
+        return "dns://%s:%d/%s" % (self.server, self.port, self.name)
+
+    def check(self, timeout):
+        query_id = struct.unpack('!H', os.urandom(2))[0]
+
+        # Header (recursion desired, one question) then the question - an A record in the IN class
+        query = struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0)
+        for label in self.name.strip('.').split('.'):
+            query += struct.pack('!B', len(label)) + label.encode('ascii')
+        query += b'\0' + struct.pack('!HH', 1, 1)
+
+        sock = socket.socket(socket.AF_INET6 if ':' in self.server else socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.settimeout(timeout)
+            sock.sendto(query, (self.server, self.port))
+            while True:
+                reply = sock.recv(512)
+
+                # Any response to our query will do - it's the round trip we care about
+                if len(reply) >= 4 and struct.unpack('!H', reply[:2])[0] == query_id and reply[2] & 0x80:
+                    return True
+        finally:
+            sock.close()
+
+class HttpProbe(Probe):
+    """
+    Checks that a web server answers a HEAD request (with any status).
+    """
+
+    def __init__(self, url):
+        self.url = url
+        parts = urlsplit(url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path if parts.path else '/'
+
+    def __str__(self):
+        return self.url
+
+    def check(self, timeout):
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        connection = connection_class(self.host, self.port, timeout=timeout)
+        try:
+            connection.request('HEAD', self.path)
+            connection.getresponse()
+            return True
+        finally:
+            connection.close()
@@ -0,0 +1,118 @@
+import random
+import logging
+import collections
+
+logger = logging.getLogger(__name__)
+
+class RestartAction:
+    """
+    What to do before starting quectel_CM again, cheapest first.
+    """
+
+    # Just start quectel_CM again
+    RESPAWN = 'respawn'
+
+    # Turn the radio off & on again (AT+CFUN=0, AT+CFUN=1)
+    SOFT_RESET = 'soft_reset'
+
+    # Reboot the modem (AT+CFUN=1,1)
+    FULL_RESET = 'full_reset'
+
+    TIERS = (RESPAWN, SOFT_RESET, FULL_RESET)
+
+class RestartPolicy:
+    """
+    Decides how to restart quectel_CM after it stops.
+
+    Failures are counted over a sliding window, so occasional restarts spread over days never add up to a modem reset.
+    Each failure in the window doubles the delay before respawning (up to max_delay, with random jitter so we don't
+    restart in lockstep with anything else), and every escalate_after failures the action escalates a tier -
+    respawn, then a soft modem reset, then a full modem reset. Once the window holds no failures we're back to the
+    cheapest tier.
+
+    Anything with the same next_action() method can be given to the Supervisor instead.
+    """
+
+    def __init__(self, base_delay=5000, max_delay=60000, jitter=0.2, window=600, escalate_after=5):
+        """
+        Create a new policy.
+        base_delay & max_delay are the shortest & longest delays before respawning, in ms.
+        jitter is the fraction by which each delay is randomly varied.
+        window is how long (in seconds) failures count for.
+        """
+        self.base_delay = base_delay
+        self.max_delay = max(max_delay, base_delay)
+        self.jitter = jitter
+        self.window = window
+        self.escalate_after = escalate_after
+
+        # When (monotonic time) each failure in the window happened
+        self.failures = collections.deque()
+
+        # The current tier (an index into RestartAction.TIERS), and the failures since we last escalated
+        self.tier = 0
+        self.failures_since_escalation = 0
+
+        # How many times each action has been chosen
+        self.actions = collections.Counter()
+
+    @staticmethod
+    def from_config(policy_config, respawn_delay):
+        """
+        Create a policy from its configuration (see the cm.restart_policy section of config.yml.dist).
+        """
+        return RestartPolicy(
+            respawn_delay,
+            policy_config['max_delay'] if 'max_delay' in policy_config else 60000,
+            policy_config['jitter'] if 'jitter' in policy_config else 0.2,
+            policy_config['window'] if 'window' in policy_config else 600,
+            policy_config['escalate_after'] if 'escalate_after' in policy_config else 5
+        )
+
+    def __expire(self, now):
+        """
+        Forget failures that have left the window - if there are none left, start again from the cheapest tier.
+        """
+        while self.failures and self.failures[0] <= now - self.window:
+            self.failures.popleft()
+
+        if not self.failures:
+            self.tier = 0
+            self.failures_since_escalation = 0
+
+    def next_action(self, now, failure=True):
+        """
+        Decide what to do now (monotonic time) that quectel_CM has stopped.
+        failure is False if it was stopped on purpose (e.g. restarted by hand), which is never held against it.
+        Returns a tuple of the RestartAction & the delay in seconds before starting quectel_CM again.
+        """
+        if not failure:
+            self.actions[RestartAction.RESPAWN] += 1
+            return (RestartAction.RESPAWN, 0)
+
+        self.__expire(now)
+        self.failures.append(now)
+        self.failures_since_escalation += 1
+
+        # Failing repeatedly at this tier? Try something more drastic
+        action = RestartAction.RESPAWN
+        if self.failures_since_escalation >= self.escalate_after:
+            self.tier = min(self.tier + 1, len(RestartAction.TIERS) - 1)
+            self.failures_since_escalation = 0
+            action = RestartAction.TIERS[self.tier]
+
+        delay = min(self.base_delay * 2 ** (len(self.failures) - 1), self.max_delay)
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+
+        self.actions[action] += 1
+        return (action, delay / 1000)
+
+    def diagnostics(self):
+        """
+        Get the policy's state.
+        """
+        return {
+            'window_failures': len(self.failures),
+            'tier': RestartAction.TIERS[self.tier],
+            'actions': dict(self.actions)
+        }
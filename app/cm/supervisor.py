@@ -1,9 +1,14 @@
+import os
 import time
 import datetime
+import selectors
 import logging
 import threading
-import pexpect
+import itertools
+import collections
 from os import path, system
+from at.diagnostics import LatencyHistogram
+from .restart_policy import RestartPolicy, RestartAction
 
 logger = logging.getLogger(__name__)
 
@@ -13,17 +18,24 @@ class Supervisor:
     Keeps it alive & collects an output buffer.
     """
 
-    def __init__(self, path, respawn_delay, apn, log_lines, poller, ip_checker):
+    def __init__(self, path, respawn_delay, apn, log_lines, poller, ip_checker, restart_policy=None, reset_timeout=90, monitor=None):
         """
         Create a new supervisor.
+        restart_policy decides how to restart quectel_CM when it stops (by default a RestartPolicy starting from
+        respawn_delay). After a modem reset we wait up to reset_timeout seconds for the modem to answer again.
+        If a ConnectionMonitor is given, restarts are held off while the radio is down, as they can't help.
         """
 
         # The path to the quectel_CM binary
         self.path = path
 
-        # The delay in ms between respawns if quectel_CM dies
+        # The shortest delay in ms between respawns if quectel_CM dies
         self.respawn_delay = respawn_delay
 
+        # Decides how long to wait before respawning, and whether to reset the modem first
+        self.restart_policy = restart_policy if restart_policy is not None else RestartPolicy(respawn_delay)
+        self.reset_timeout = reset_timeout
+
         # The APN details
         self.apn = apn
 
@@ -36,23 +48,88 @@ class Supervisor:
         # Is quectel_CM being supervised? 
         self.is_supervising = False
 
-        # The log buffer
-        self.log = []
+        # The log buffer - the oldest lines drop off the front once it's full
+        self.log = collections.deque(maxlen=log_lines)
+
+        # The sequence number the next log line will get - line numbers keep counting up as old lines drop off
+        self.log_sequence = 0
+        self.log_lock = threading.Lock()
 
-        # Was the process killed by us?
+        # Was the process killed by us? And was that because a restart was asked for (so it's not a failure)?
         self.is_killed = False
+        self.is_restart_requested = False
 
         # QCM Popen handle
         self.qcm_handle = None
 
+        # Is quectel_CM running? Maintained by the supervision thread so nobody else needs to check the process
+        self.is_running = False
+
+        # Callables to notify when the running state changes
+        self.listeners = []
+
+        # How many times quectel_CM has been started, how many of those were consecutive relaunches
+        # since the last modem restart, and when (wall clock time) the current instance was started
+        self.starts = 0
+        self.relaunches = -1
+        self.started_at = None
+
+        # Diagnostics - how long each instance ran for, how they exited, and why we restarted things
+        self.run_time = LatencyHistogram(LatencyHistogram.UPTIME_BOUNDS)
+        self.exit_codes = collections.Counter()
+        self.connectivity_kills = 0
+        self.manual_restarts = 0
+        self.modem_resets = 0
+
+        # Recovery statistics - how long modem resets took, and from quectel_CM failing until connectivity was
+        # confirmed again (as precise as the internet checker's polling)
+        self.reset_time = LatencyHistogram(LatencyHistogram.RECOVERY_BOUNDS)
+        self.recovery_time = LatencyHistogram(LatencyHistogram.RECOVERY_BOUNDS)
+
+        # When (monotonic time) the current outage started, or None if we're not recovering from one
+        self.outage_start = None
+
+        # When (monotonic time) the current instance was started
+        self.spawned = None
+
+        # Follows the radio state, so we don't restart things while there's no coverage
+        self.monitor = monitor
+
+        # Times we held off restarting because the radio was down
+        self.radio_waits = 0
+
+        # A pipe used to wake the supervision thread when something needs its attention
+        self.__wakeup_read, self.__wakeup_write = os.pipe()
+        os.set_blocking(self.__wakeup_write, False)
+
         # The thread on which the supervision will be done
         self.__supervise_thread = threading.Thread(target=self.__supervise)
         self.__supervise_thread.daemon = True
 
         # Spawn an Internet Connectivity Checker to see if we need to restart Quectel_CM due to internet connectivity problems
         self.ip_checker = ip_checker
+        self.ip_checker.add_listener(self.__wake)
         self.ip_checker.start()
 
+        if self.monitor is not None:
+            self.monitor.add_listener(self.__wake)
+
+    def add_listener(self, listener):
+        """
+        Register a callable to be called whenever quectel_CM starts, stops or is killed.
+        """
+        self.listeners.append(listener)
+
+    def __notify(self):
+        """
+        Tell the listeners that the state has changed.
+        """
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception as listener_ex:
+                logger.error("Supervisor listener error: %s" % listener_ex)
+
     def start(self):
         """
         Start quectel_CM
@@ -66,13 +143,17 @@ class Supervisor:
         """
         self.is_supervising = False
         self.__kill()
+        self.__wake()
 
     def restart(self):
         """
         Restart quectel_CM
         """
         self.__log_line(" *** KILLED due to restart @ %s" % datetime.datetime.now())
+        self.manual_restarts += 1
+        self.is_restart_requested = True
         self.__kill()
+        self.__wake()
 
     def __kill(self):
         """
@@ -83,6 +164,7 @@ class Supervisor:
             self.qcm_handle.kill(sig=9)
             self.is_killed = True
             logger.info("Killed using kill()")
+            self.__notify()
             return
         except Exception as int_kill_ex:
             logger.warn("Failed to kill using kill() method: %s" % int_kill_ex)
@@ -91,38 +173,216 @@ class Supervisor:
             system('sudo kill -9 %d' % self.qcm_handle.pid)
             self.is_killed = True
             logger.info("Killed using kill signal")
+            self.__notify()
         except Exception as ext_kill_ex:
             logger.warn("Failed to kill using kill signal: %s" % ext_kill_ex)
 
+    def log_since(self, sequence):
+        """
+        Get the log lines from sequence number onwards.
+        Returns a tuple of the sequence number of the next line to come, and the lines (oldest first).
+        Costs time proportional to the number of lines returned, not the size of the buffer.
+        """
+        with self.log_lock:
+            # A sequence number from the future must be from before we restarted - start again from the oldest line
+            if sequence > self.log_sequence:
+                sequence = 0
+
+            count = min(self.log_sequence - sequence, len(self.log))
+            lines = list(itertools.islice(reversed(self.log), count))
+            lines.reverse()
+            return (self.log_sequence, lines)
+
+    def diagnostics(self):
+        """
+        Get the supervisor's diagnostic counters & run time histogram.
+        """
+        return {
+            'running': self.is_running,
+            'starts': self.starts,
+            'relaunches': max(self.relaunches, 0),
+            'started_at': self.started_at,
+            'run_time': self.run_time.to_dict(),
+            'exit_codes': {str(code): count for code, count in sorted(self.exit_codes.items())},
+            'connectivity_kills': self.connectivity_kills,
+            'manual_restarts': self.manual_restarts,
+            'modem_resets': self.modem_resets,
+            'reset_time': self.reset_time.to_dict(),
+            'recovering': self.outage_start is not None,
+            'recovery_time': self.recovery_time.to_dict(),
+            'restart_policy': self.restart_policy.diagnostics() if hasattr(self.restart_policy, 'diagnostics') else None,
+            'radio_waits': self.radio_waits,
+            'connection': self.monitor.diagnostics() if self.monitor is not None else None
+        }
+
+    def __wake(self):
+        """
+        Wake the supervision thread (e.g. because internet connectivity changed).
+        """
+        try:
+            os.write(self.__wakeup_write, b'!')
+        except BlockingIOError:
+            # Already plenty of wakeups pending
+            pass
+
+    @staticmethod
+    def __open_pidfd(pid):
+        """
+        Get a descriptor that becomes readable when a process exits, or None if the platform can't do that.
+        """
+        try:
+            return os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            return None
+
+    def __log_output(self, output):
+        """
+        Log each complete line of some output, returning any partial line left over.
+        """
+        *lines, partial = output.split(b"\n")
+        for line in lines:
+            line = line.decode(errors='replace').strip()
+            if line != '':
+                self.__log_line(line)
+        return partial
+
+    def __handle_events(self, selector, timeout, partial):
+        """
+        Wait for up to timeout seconds (None = forever) for output, the process exiting or a wakeup.
+        Logs any output, taking & returning the partial line left over.
+        """
+        for key, events in selector.select(timeout):
+            if key.data == 'output':
+                try:
+                    output = os.read(key.fd, 4096)
+                except OSError:
+                    # The pty reports an error once the process has gone
+                    output = b''
+
+                if output:
+                    partial = self.__log_output(partial + output)
+                else:
+                    selector.unregister(key.fd)
+
+            elif key.data == 'wakeup':
+                os.read(self.__wakeup_read, 1024)
+
+        return partial
+
+    def __reset_modem(self, action):
+        """
+        Reset the modem as the restart policy decided, returning once it's answering again (or we give up waiting).
+        """
+        start = time.monotonic()
+        self.modem_resets += 1
+
+        if action == RestartAction.SOFT_RESET:
+            self.__log_line(" *** SOFT MODEM RESET (radio off & on) @ %s" % datetime.datetime.now())
+            self.poller.inject("AT+CFUN=0", timeout=15).result()
+
+            # The modem answering the radio being switched back on is as ready as it gets
+            ready = self.poller.inject("AT+CFUN=1", timeout=15).result()[0]
+        else:
+            self.__log_line(" *** FULL MODEM RESET @ %s" % datetime.datetime.now())
+
+            # The port goes away while the modem reboots - wait for it to be answering on the new one
+            attaches = self.poller.attaches
+            ready = self.poller.inject("AT+CFUN=1,1", timeout=15).result()[0]
+            if ready:
+                ready = self.poller.wait_ready(self.reset_timeout, after=attaches)
+            else:
+                logger.warn("Modem did not acknowledge the reset request")
+
+        elapsed = time.monotonic() - start
+        if ready:
+            self.reset_time.add(elapsed)
+            logger.info("Modem answering %.1fs after the %s" % (elapsed, action.replace('_', ' ')))
+        else:
+            logger.warn("Modem not answering %.1fs after the %s - starting quectel_CM anyway" % (elapsed, action.replace('_', ' ')))
+
+        # The next start is a fresh one rather than a relaunch
+        self.relaunches = -1
+
+    def __waiting_for_radio(self):
+        """
+        Should we hold off restarting because the radio is down?
+        """
+        return self.monitor is not None and self.monitor.should_wait()
+
+    def __wait_for_radio(self, held=False):
+        """
+        Wait for the radio to come back (or for the monitor to give up waiting).
+        held is True if we were already holding off when quectel_CM stopped, so this wait has been counted.
+        Returns whether it's back.
+        """
+        if not held:
+            self.radio_waits += 1
+        self.__log_line(" *** WAITING for the radio (%s) before relaunch @ %s" % (self.monitor.state.replace('_', ' '), datetime.datetime.now()))
+
+        selector = selectors.DefaultSelector()
+        selector.register(self.__wakeup_read, selectors.EVENT_READ, 'wakeup')
+        try:
+            # Woken by the monitor when the state changes - but also check each second, as the wait is time limited
+            while self.is_supervising and self.monitor.should_wait():
+                self.__handle_events(selector, 1.0, b'')
+        finally:
+            selector.close()
+
+        return not self.monitor.radio_down()
+
+    def __pause(self, delay):
+        """
+        Wait for delay seconds before relaunching, returning early if supervision is stopped or a restart is requested.
+        """
+        end = time.monotonic() + delay
+        selector = selectors.DefaultSelector()
+        selector.register(self.__wakeup_read, selectors.EVENT_READ, 'wakeup')
+        try:
+            while self.is_supervising and not self.is_restart_requested:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.__handle_events(selector, remaining, b'')
+        finally:
+            selector.close()
+
+    def __check_recovered(self):
+        """
+        Finish the current outage if connectivity has been confirmed since quectel_CM was started.
+        """
+        last_success = self.ip_checker.last_success
+        if self.outage_start is None or last_success is None or last_success < self.spawned:
+            return
+
+        recovery = last_success - self.outage_start
+        self.recovery_time.add(recovery)
+        self.outage_start = None
+        self.__log_line(" *** RECOVERED after %.1fs @ %s" % (recovery, datetime.datetime.now()))
+
     def __log_line(self, line):
         """
         Log a line, shifting out the oldest data if we're over log_lines.
         """
         logger.info("CM: %s" % line)
-        self.log.append(line)
-        if len(self.log) > self.log_lines:
-            self.log = self.log[-(self.log_lines):]
+        with self.log_lock:
+            self.log.append(line)
+            self.log_sequence += 1
 
     def __supervise(self):
         """
         Maintain the quectel_CM instance
         """
+        # Imported here, on the supervision thread, to keep it off the startup path
+        import pexpect
+
         self.is_supervising = True
-        relaunches = -1
+        self.relaunches = -1
 
         try:
 
             # While we've not been terminated
             while self.is_supervising:
 
-                # Have we relaunched lots of times? if so, restart the modem and wait a while for it to come back up
-                if relaunches > 10:
-                    logger.warn("%d consecutive relaunches - low-level restarting modem..." % relaunches)
-                    self.poller.inject("AT+CFUN=0")
-                    self.poller.inject("AT+CFUN=1,1")
-                    time.sleep(30)
-                    relaunches = 0
-
                 # If the binary can't be found, stop supervising
                 if not path.isfile(self.path):
                     logger.error("Quectel_CM path %s does not exist - cannot start" % self.path)
@@ -144,48 +404,110 @@ class Supervisor:
                 logger.info("Starting quectel_CM %s..." % ' '.join(command))
                 self.qcm_handle = pexpect.spawn("sudo", command)
                 self.is_killed = False
+                self.is_restart_requested = False
+                self.is_running = True
+                self.started_at = time.time()
+                self.spawned = time.monotonic()
+                self.starts += 1
+                self.relaunches += 1
+                self.__notify()
 
                 # Log the start
                 self.__log_line(" *** STARTED PID %d @ %s" % (self.qcm_handle.pid, datetime.datetime.now()))
-                relaunches += 1
                 
                 # Reset IP checker to give us time to get online
                 self.ip_checker.reset()
+                if self.monitor is not None:
+                    self.monitor.set_cm_running(True)
+
+                # Wake when there's output, when the process exits or when something else needs checking
+                selector = selectors.DefaultSelector()
+                selector.register(self.qcm_handle.child_fd, selectors.EVENT_READ, 'output')
+                selector.register(self.__wakeup_read, selectors.EVENT_READ, 'wakeup')
+
+                # Without a pidfd we can't be told about the process exiting, so fall back to checking each second
+                pidfd = Supervisor.__open_pidfd(self.qcm_handle.pid)
+                if pidfd is not None:
+                    selector.register(pidfd, selectors.EVENT_READ, 'exit')
+
+                # Output after the last line break
+                partial = b''
+
+                # Are we holding off a restart until the radio is back?
+                holding = False
 
                 # While running...
                 while True:
 
-                    # Check the process each second
-                    time.sleep(1.0)
-
-                    # Read all output
-                    while True:
-                        try:
-                            output = self.qcm_handle.read_nonblocking(1024, 1)
-                            if not output:
-                                break
-                            lines = output.split(b"\n")
-                            for line in lines:
-                                if line.decode().strip() != '':
-                                    self.__log_line(line.decode().strip())
-                        except:
-                            break
+                    # While recovering or holding off, check each second whether anything has changed
+                    partial = self.__handle_events(
+                        selector, None if pidfd is not None and self.outage_start is None and not holding else 1.0, partial
+                    )
+                    self.__check_recovered()
 
                     # Shall we kill quectel_cm due to no internet connectivity for a period of time?
+                    # Not while the radio is down though - a restart can't help, and only slows reconnecting once it's back
                     if not self.ip_checker.has_internet():
-                        self.__log_line("Lost internet connectivity - killing & restarting Quectel_CM...")
-                        self.__kill()
-                        
+                        if self.__waiting_for_radio():
+                            if not holding:
+                                self.__log_line("Lost internet connectivity while the radio is down (%s) - waiting for it..." % self.monitor.state.replace('_', ' '))
+                                self.radio_waits += 1
+                                holding = True
+                        else:
+                            self.__log_line("Lost internet connectivity - killing & restarting Quectel_CM...")
+                            self.connectivity_kills += 1
+                            self.__kill()
+                    else:
+                        holding = False
+
                     if not self.qcm_handle.isalive() or self.is_killed:
+
+                        # Collect anything still waiting in the pty, then whatever was left without a line break
+                        partial = self.__handle_events(selector, 0, partial)
+                        self.__log_output(partial + b"\n")
+                        selector.close()
+                        if pidfd is not None:
+                            os.close(pidfd)
+
                         exitcode = self.qcm_handle.exitstatus if self.qcm_handle.exitstatus is not None else -1
-                        logger.warn("Quectel_CM terminated with code %d - waiting %dms before relaunch..." % (exitcode, self.respawn_delay))
+                        self.exit_codes[exitcode] += 1
+                        self.run_time.add(time.time() - self.started_at)
 
                         # Log the termination
                         self.__log_line(" *** TERMINATED @ %s with exit code %d" % (datetime.datetime.now(), exitcode))
+                        self.is_running = False
+                        self.__notify()
+                        if self.monitor is not None:
+                            self.monitor.set_cm_running(False)
+
+                        # Stopped for good?
+                        if not self.is_supervising:
+                            break
+
+                        # Anything but a restart we asked for is a failure - and the start of an outage if we weren't already in one
+                        failure = not self.is_restart_requested
+                        if failure and self.outage_start is None:
+                            self.outage_start = time.monotonic()
+
+                        # No point restarting without a radio - and once it's back, relaunching straight away is the cheapest fix
+                        # Recovery is timed from the radio coming back, as the outage before that wasn't ours to fix
+                        if failure and self.__waiting_for_radio() and self.__wait_for_radio(held=holding):
+                            failure = False
+                            if self.outage_start is not None:
+                                self.outage_start = time.monotonic()
+                        if not self.is_supervising:
+                            break
+
+                        action, delay = self.restart_policy.next_action(time.monotonic(), failure)
+
+                        # Once the modem has been reset it's worth trying straight away
+                        if action != RestartAction.RESPAWN:
+                            logger.warn("Quectel_CM terminated with code %d - %s before relaunch..." % (exitcode, action.replace('_', ' ')))
+                            self.__reset_modem(action)
+                        else:
+                            logger.warn("Quectel_CM terminated with code %d - waiting %.1fs before relaunch..." % (exitcode, delay))
+                            self.__pause(delay)
 
-                        # Wait the delay time...
-                        time.sleep(self.respawn_delay / 1000)
-                        
                         # Break out to respawn...
                         break
 
@@ -1,12 +1,11 @@
 import os
 import sys
+import atexit
+import signal
 import logging
 import yaml
-import time
 
-from cm import Supervisor, InternetChecker
 from at import Poller
-from webserver import Webserver
 
 # Set up the logging subsystem
 logger = logging.getLogger()
@@ -29,30 +28,56 @@ with open(config_path, 'r') as ymlfile:
 at_poller = Poller(
     config['at']['dev'],
     config['at']['poll_delay'],
-    config['at']['statsd'] if 'statsd' in config['at'] else None
+    config['at']['statsd'] if 'statsd' in config['at'] else None,
+    config['at']['batch'] if 'batch' in config['at'] else False,
+    config['at']['intervals'] if 'intervals' in config['at'] else None,
+    config['at']['store'] if 'store' in config['at'] else None
 )
 at_poller.start()
 
+# Stop polling & flush the metric store on the way out - including when systemd stops us with SIGTERM
+atexit.register(at_poller.stop)
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+# Everything else can load while the poller attaches to the modem
+from cm import Supervisor, InternetChecker, RestartPolicy, ConnectionMonitor
+from webserver import Webserver
+
 # Create the internet connection checker
-ip_checker = InternetChecker()
+ip_check_config = config['cm']['internet_check'] if 'internet_check' in config['cm'] else {}
+ip_checker = InternetChecker(
+    ip_check_config['poll_delay'] if 'poll_delay' in ip_check_config else 30000,
+    ip_check_config['max_failures'] if 'max_failures' in ip_check_config else 3,
+    ip_check_config['probes'] if 'probes' in ip_check_config else None,
+    ip_check_config['fast_delay'] if 'fast_delay' in ip_check_config else 2000,
+    ip_check_config['timeout'] if 'timeout' in ip_check_config else 3
+)
 
-# Create the supervisor instance
+# Follow the radio state, so quectel_CM isn't restarted while there's no coverage
+connection_monitor = ConnectionMonitor.from_config(
+    config['cm']['connection'] if 'connection' in config['cm'] else {},
+    at_poller,
+    ip_checker
+)
+
+# Create the supervisor instance, with the policy deciding how it restarts quectel_CM
+restart_config = config['cm']['restart_policy'] if 'restart_policy' in config['cm'] else {}
 cm_supervisor = Supervisor(
     config['cm']['path'],
     config['cm']['respawn_delay'],
     config['cm']['apn'],
     config['cm']['log_lines'],
     at_poller,
-    ip_checker
+    ip_checker,
+    RestartPolicy.from_config(restart_config, config['cm']['respawn_delay']),
+    restart_config['reset_timeout'] if 'reset_timeout' in restart_config else 90,
+    connection_monitor
 )
 cm_supervisor.start()
 
 # Create the webserver
-server = Webserver(config['web']['port'], at_poller, cm_supervisor, ip_checker)
+server = Webserver(config['web']['port'], at_poller, cm_supervisor, ip_checker, config['web'].get('server'))
 
-# Start the server
+# Start the server in the background & keep the main thread alive while it runs
 server.start_server()
-
-# Keep the main thread alive in case the web server was configured not to start
-while cm_supervisor.is_supervising:
-    time.sleep(1)
+server.wait()
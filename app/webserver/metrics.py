@@ -0,0 +1,129 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class MetricsExporter:
+    """
+    Renders the status in the Prometheus text exposition format.
+    The text is only rebuilt when something it covers has changed, so scrapes are normally served from a cache.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    # Result key prefixes & the radio technology they belong to
+    TECHNOLOGIES = (
+        ('lte_', 'LTE'),
+        ('nr_nsa_', 'NR5G-NSA'),
+        ('nr_sa_', 'NR5G-SA'),
+        ('wcdma_', 'WCDMA')
+    )
+
+    def __init__(self, at_poller, cm_supervisor, ip_checker, snapshot_publisher):
+        """
+        Create a new exporter.
+        """
+        self.at_poller = at_poller
+        self.cm_supervisor = cm_supervisor
+        self.ip_checker = ip_checker
+        self.snapshot_publisher = snapshot_publisher
+
+        # (version, text) of the last rendering
+        self.cache = (None, b'')
+
+    def __version(self):
+        """
+        Get a value that changes whenever anything rendered does.
+        """
+        return (
+            self.snapshot_publisher.current.generation,
+            self.at_poller.cycles,
+            self.cm_supervisor.starts,
+            self.ip_checker.checks
+        )
+
+    @staticmethod
+    def __escape(value):
+        """
+        Escape a label value.
+        """
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @staticmethod
+    def __labels(**labels):
+        return '{' + ','.join('%s="%s"' % (name, MetricsExporter.__escape(value)) for name, value in labels.items()) + '}'
+
+    @staticmethod
+    def __technology(key):
+        """
+        Get the radio technology a result belongs to, from its key.
+        """
+        for prefix, technology in MetricsExporter.TECHNOLOGIES:
+            if key.startswith(prefix):
+                return technology
+        return ''
+
+    def render(self):
+        """
+        Get the exposition text, rebuilding it only if something has changed.
+        """
+        version = self.__version()
+        cached_version, text = self.cache
+        if cached_version == version:
+            return text
+
+        text = self.__render(self.snapshot_publisher.current).encode('utf-8')
+        self.cache = (version, text)
+        return text
+
+    def __render(self, snapshot):
+        """
+        Build the exposition text.
+        """
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            for labels, value in samples:
+                lines.append('%s%s %s' % (name, labels, repr(float(value)) if isinstance(value, float) else value))
+
+        # Every result - numbers as gauges, everything else (e.g. statuses) as info metrics
+        numbers = []
+        infos = []
+        states = []
+        for command in snapshot.data['commands']:
+            for result in command['results']:
+                technology = MetricsExporter.__technology(result['key'])
+                labels = MetricsExporter.__labels(command=command['name'], key=result['key'], technology=technology)
+                value = result['value']
+                if isinstance(value, (int, float)):
+                    numbers.append((labels, value))
+                elif value is not None:
+                    infos.append((MetricsExporter.__labels(
+                        command=command['name'], key=result['key'], technology=technology, value=value
+                    ), 1))
+                states.append((labels, result['state']))
+
+        family('quectel_cpe_result', 'gauge', 'Numeric result values reported by the modem.', numbers)
+        family('quectel_cpe_result_info', 'gauge', 'Non-numeric result values reported by the modem.', infos)
+        family('quectel_cpe_result_state', 'gauge', 'Result states (0 = OK, 1 = warning, 2 = error, 3 = not applicable).', states)
+
+        # The poller
+        family('quectel_cpe_poll_cycles_total', 'counter', 'AT poll cycles completed.', [('', self.at_poller.cycles)])
+        family('quectel_cpe_poll_cycle_seconds_total', 'counter', 'Time spent in AT poll cycles.', [('', self.at_poller.cycle_seconds)])
+        family('quectel_cpe_poll_cycle_last_seconds', 'gauge', 'Duration of the last AT poll cycle.', [('', self.at_poller.last_cycle_seconds)])
+
+        # The connection manager
+        family('quectel_cm_running', 'gauge', 'Whether quectel-CM is running.', [('', 1 if snapshot.data['cm']['running'] else 0)])
+        family('quectel_cm_starts_total', 'counter', 'Times quectel-CM has been started.', [('', self.cm_supervisor.starts)])
+        family('quectel_cm_relaunches', 'gauge', 'Consecutive quectel-CM relaunches since the last modem restart.', [('', max(self.cm_supervisor.relaunches, 0))])
+        if self.cm_supervisor.started_at is not None:
+            family('quectel_cm_start_time_seconds', 'gauge', 'When the current quectel-CM was started, in seconds since the epoch.', [('', self.cm_supervisor.started_at)])
+
+        # The internet checker
+        family('quectel_internet_up', 'gauge', 'Whether internet connectivity is considered available.', [('', 1 if snapshot.data['internet'] else 0)])
+        family('quectel_internet_consecutive_failures', 'gauge', 'Consecutive failed connectivity checks.', [('', self.ip_checker.failures)])
+        family('quectel_internet_checks_total', 'counter', 'Connectivity checks made.', [('', self.ip_checker.checks)])
+        family('quectel_internet_check_failures_total', 'counter', 'Connectivity checks that failed.', [('', self.ip_checker.check_failures)])
+
+        return '\n'.join(lines) + '\n'
@@ -1 +1,3 @@
-from .home import Home
\ No newline at end of file
+from .home import Home
+from .api import Api
+from .metrics import Metrics
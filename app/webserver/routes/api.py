@@ -0,0 +1,176 @@
+import json
+import time
+import logging
+from at.history import History
+from flask import Blueprint, Response, abort, request, stream_with_context
+
+logger = logging.getLogger(__name__)
+
+class Api:
+    """
+    Route class for the JSON API.
+    """
+
+    blueprint = Blueprint('api', __name__)
+    at_poller = None
+    cm_supervisor = None
+    ip_checker = None
+    snapshot_publisher = None
+
+    # How long a streaming or long-poll request waits for something to change before sending a keepalive/reply, in seconds
+    stream_keepalive = 15
+    long_poll_timeout = 25
+
+    # How long an event stream lasts before the client is asked to reconnect, so each stream frees its slot on the server regularly
+    stream_lifetime = 300
+
+    # Free event stream slots - each open stream holds a server worker (None for no limit)
+    stream_slots = None
+
+    @staticmethod
+    def __json(data):
+        """
+        Build a JSON response.
+        """
+        return Response(json.dumps(data, separators=(',', ':')), mimetype='application/json')
+
+    @staticmethod
+    @blueprint.route('/status')
+    def status():
+        snapshot = Api.snapshot_publisher.current
+
+        # Nothing has changed since the client last asked?
+        if request.if_none_match.contains(snapshot.etag):
+            response = Response(status=304)
+        else:
+            response = Response(snapshot.body, mimetype='application/json')
+
+        response.set_etag(snapshot.etag)
+        return response
+
+    @staticmethod
+    @blueprint.route('/stream')
+    def stream():
+        # No room for another stream? The client falls back to long polling
+        if Api.stream_slots is not None and not Api.stream_slots.acquire(blocking=False):
+            response = Response("Too many event streams", status=503, mimetype='text/plain')
+            response.headers['Retry-After'] = '30'
+            return response
+
+        # Resuming after a reconnect, or carrying on from the snapshot the page was rendered with?
+        # If we still know the client's snapshot we only need to send what changed
+        known = Api.snapshot_publisher.find(request.headers.get('Last-Event-ID', request.args.get('etag', '')))
+
+        def events():
+            end = time.monotonic() + Api.stream_lifetime
+            yield b'retry: 2000\n\n'
+
+            # Start with everything (or what changed since the client's snapshot), then only what changes
+            snapshot = Api.snapshot_publisher.current
+            if known is None:
+                yield b'id: %s\nevent: snapshot\ndata: %s\n\n' % (snapshot.etag.encode('ascii'), snapshot.body)
+            elif known is not snapshot:
+                yield b'id: %s\nevent: delta\ndata: %s\n\n' % (snapshot.etag.encode('ascii'), snapshot.delta_from(known))
+
+            while time.monotonic() < end:
+                latest = Api.snapshot_publisher.wait(snapshot, min(Api.stream_keepalive, max(0, end - time.monotonic())))
+                if latest is snapshot:
+                    # Nothing new - make sure the connection is still there
+                    yield b': keepalive\n\n'
+                    continue
+
+                yield b'id: %s\nevent: delta\ndata: %s\n\n' % (latest.etag.encode('ascii'), latest.delta_from(snapshot))
+                snapshot = latest
+
+        response = Response(stream_with_context(events()), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+
+        # The server closes the response once the stream ends or the client goes away, even if it never started
+        if Api.stream_slots is not None:
+            response.call_on_close(Api.stream_slots.release)
+        return response
+
+    @staticmethod
+    @blueprint.route('/poll')
+    def poll():
+        # Long-poll fallback for clients without EventSource support:
+        # wait for a snapshot newer than the one with the given ETag, returning just the changes if we still know that one
+        known = Api.snapshot_publisher.find(request.args.get('etag', ''))
+        latest = Api.snapshot_publisher.current
+        if known is not None and known is latest:
+            latest = Api.snapshot_publisher.wait(known, Api.long_poll_timeout)
+
+        if known is None:
+            body = b'{"etag":"%s","snapshot":%s}' % (latest.etag.encode('ascii'), latest.body)
+        else:
+            body = b'{"etag":"%s","delta":%s}' % (latest.etag.encode('ascii'), latest.delta_from(known))
+
+        response = Response(body, mimetype='application/json')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @staticmethod
+    @blueprint.route('/cmlog')
+    def cmlog():
+        since = request.args.get('since', 0, type=int)
+        log_sequence, lines = Api.cm_supervisor.log_since(since)
+        return Api.__json({'next': log_sequence, 'lines': lines})
+
+    @staticmethod
+    @blueprint.route('/cells')
+    def cells():
+        if Api.at_poller.cells is None:
+            abort(404)
+
+        since = request.args.get('since', type=float)
+        return Api.__json({'capacity': Api.at_poller.cells.capacity, 'cells': Api.at_poller.cells.to_list(since)})
+
+    @staticmethod
+    @blueprint.route('/diagnostics')
+    def diagnostics():
+        return Api.__json({
+            'time': time.time(),
+            'poller': Api.at_poller.diagnostics(),
+            'cm': Api.cm_supervisor.diagnostics(),
+            'internet': Api.ip_checker.diagnostics()
+        })
+
+    @staticmethod
+    @blueprint.route('/history')
+    def history_keys():
+        return Api.__json({
+            'keys': sorted(Api.at_poller.history.keys()),
+            'resolutions': Api.at_poller.history.resolutions + (['stored'] if Api.at_poller.store is not None else [])
+        })
+
+    @staticmethod
+    @blueprint.route('/history/<key>')
+    def history(key):
+        since = request.args.get('since', type=float)
+        resolution = request.args.get('resolution', History.RAW)
+
+        # Everything kept on disk, or what's in memory at the chosen resolution
+        if resolution == 'stored':
+            if Api.at_poller.store is None:
+                abort(404)
+            series = Api.at_poller.store.query(key, since)
+        elif resolution == History.RAW or resolution.isdigit():
+            series = Api.at_poller.history.query(key, since, resolution if resolution == History.RAW else int(resolution))
+        else:
+            abort(400)
+
+        if series is None:
+            abort(404)
+
+        if len(series) == 2:
+            return Api.__json({'key': key, 'resolution': resolution, 'time': series[0].tolist(), 'value': series[1].tolist()})
+
+        return Api.__json({
+            'key': key,
+            'resolution': resolution,
+            'time': series[0].tolist(),
+            'min': series[1].tolist(),
+            'avg': series[2].tolist(),
+            'max': series[3].tolist()
+        })
@@ -1,5 +1,6 @@
 import json
 import logging
+import datetime
 from at.command import ResultValueState
 from flask import Blueprint, render_template, request
 
@@ -14,6 +15,7 @@ class Home:
     at_poller = None
     cm_supervisor = None
     ip_checker = None
+    snapshot_publisher = None
 
     @staticmethod
     def __bulma_class(state):
@@ -29,11 +31,37 @@ class Home:
         else:
             return 'has-background-grey-lighter'
 
+    @staticmethod
+    def __format_time(timestamp):
+        """
+        Format a timestamp for display
+        """
+        return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+    @staticmethod
+    def __format_duration(seconds):
+        """
+        Format a duration for display, in the most readable unit
+        """
+        if seconds is None:
+            return '-'
+        elif seconds < 1:
+            return '%.1f ms' % (seconds * 1000)
+        elif seconds < 120:
+            return '%.2f s' % seconds
+        elif seconds < 7200:
+            return '%.1f min' % (seconds / 60)
+        else:
+            return '%.1f h' % (seconds / 3600)
+
     @staticmethod
     @blueprint.route('/')
     def index():
+        # The page is at least as new as the latest snapshot, so the live updates can carry on from that one
+        etag = Home.snapshot_publisher.current.etag
         return render_template(
             'home.j2',
+            etag=etag,
             commands=Home.at_poller.commands,
             bulma_class=Home.__bulma_class,
             supervisor=Home.cm_supervisor,
@@ -43,9 +71,33 @@ class Home:
     @staticmethod
     @blueprint.route('/cmlog')
     def cmlog():
+        log_sequence, log = Home.cm_supervisor.log_since(0)
         return render_template(
             'cmlog.j2',
-            cm_log="\r\n".join(Home.cm_supervisor.log)
+            cm_log="\r\n".join(log),
+            log_sequence=log_sequence,
+            log_limit=Home.cm_supervisor.log_lines
+        )
+
+    @staticmethod
+    @blueprint.route('/cells')
+    def cells():
+        return render_template(
+            'cells.j2',
+            cells=Home.at_poller.cells.to_list() if Home.at_poller.cells is not None else [],
+            format_time=Home.__format_time
+        )
+
+    @staticmethod
+    @blueprint.route('/diagnostics')
+    def diagnostics():
+        return render_template(
+            'diagnostics.j2',
+            poller=Home.at_poller.diagnostics(),
+            cm=Home.cm_supervisor.diagnostics(),
+            internet=Home.ip_checker.diagnostics(),
+            format_time=Home.__format_time,
+            format_duration=Home.__format_duration
         )
 
     @staticmethod
@@ -0,0 +1,17 @@
+import logging
+from flask import Blueprint, Response
+
+logger = logging.getLogger(__name__)
+
+class Metrics:
+    """
+    Route class for the Prometheus metrics endpoint.
+    """
+
+    blueprint = Blueprint('metrics', __name__)
+    exporter = None
+
+    @staticmethod
+    @blueprint.route('/metrics')
+    def metrics():
+        return Response(Metrics.exporter.render(), content_type=Metrics.exporter.CONTENT_TYPE)
@@ -0,0 +1,150 @@
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class Snapshot:
+    """
+    An immutable, pre-serialised view of the status at one point in time.
+    """
+
+    def __init__(self, generation, data, body, etag, previous=None):
+        self.generation = generation
+        self.data = data
+        self.body = body
+        self.etag = etag
+
+        # Every result's (value, state), keyed by result key - for working out what changed
+        self.values = {
+            result['key']: (result['value'], result['state'])
+            for command in data['commands'] for result in command['results']
+        }
+
+        # What changed since the previous generation - most clients will be one generation behind
+        self.delta_body = None
+        if previous is not None:
+            self.delta_body = json.dumps(self.delta(previous), separators=(',', ':')).encode('utf-8')
+
+    def delta(self, old):
+        """
+        Get the parts of this snapshot that differ from an older one.
+        """
+        changes = {}
+        if old.data['cm'] != self.data['cm']:
+            changes['cm'] = self.data['cm']
+        if old.data['internet'] != self.data['internet']:
+            changes['internet'] = self.data['internet']
+
+        results = {
+            key: {'value': value, 'state': state}
+            for key, (value, state) in self.values.items() if old.values.get(key) != (value, state)
+        }
+        if results:
+            changes['results'] = results
+
+        removed = [key for key in old.values if key not in self.values]
+        if removed:
+            changes['removed'] = removed
+
+        return changes
+
+    def delta_from(self, old):
+        """
+        Get the serialised delta from an older snapshot.
+        """
+        if self.delta_body is not None and old.generation == self.generation - 1:
+            return self.delta_body
+        return json.dumps(self.delta(old), separators=(',', ':')).encode('utf-8')
+
+class SnapshotPublisher:
+    """
+    Builds a status snapshot whenever the poller, supervisor or internet checker report a change.
+    Requests are served from the latest snapshot rather than by querying those objects.
+    """
+
+    def __init__(self, at_poller, cm_supervisor, ip_checker):
+        """
+        Create a new publisher & start listening for changes.
+        """
+        self.at_poller = at_poller
+        self.cm_supervisor = cm_supervisor
+        self.ip_checker = ip_checker
+
+        # Distinguishes generations from different runs, so a restart can't produce a matching ETag
+        self.boot_id = os.urandom(4).hex()
+
+        # Publishing happens on several threads, and streaming clients wait for new snapshots
+        self.lock = threading.Lock()
+        self.published = threading.Condition(self.lock)
+        self.current = None
+        self.previous = None
+        self.publish()
+
+        at_poller.add_listener(self.publish)
+        cm_supervisor.add_listener(self.publish)
+        ip_checker.add_listener(self.publish)
+
+    def __build(self):
+        """
+        Collect the current status.
+        """
+        return {
+            'cm': {
+                'running': self.cm_supervisor.is_running and not self.cm_supervisor.is_killed
+            },
+            'internet': self.ip_checker.has_internet(),
+            'commands': [
+                {
+                    'name': command.name,
+                    'description': command.description,
+                    'last_update': command.last_update,
+                    'results': [
+                        {
+                            'key': result.key,
+                            'name': result.name,
+                            'description': result.description,
+                            'value': result.value,
+                            'state': result.state
+                        } for result in command.results
+                    ]
+                } for command in self.at_poller.commands
+            ]
+        }
+
+    def publish(self):
+        """
+        Build a new snapshot, if anything has changed since the last one.
+        """
+
+        # Built under the lock so that a build started earlier can't replace a newer one
+        with self.lock:
+            data = self.__build()
+            body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+            if self.current is not None and self.current.body == body:
+                return
+
+            generation = self.current.generation + 1 if self.current is not None else 0
+            self.previous = self.current
+            self.current = Snapshot(generation, data, body, "%s-%d" % (self.boot_id, generation), self.previous)
+            self.published.notify_all()
+
+    def wait(self, snapshot, timeout):
+        """
+        Wait for up to timeout seconds for a snapshot newer than the one given.
+        Returns the current snapshot, which is the same one if nothing changed in time.
+        """
+        with self.lock:
+            self.published.wait_for(lambda: self.current is not snapshot, timeout)
+            return self.current
+
+    def find(self, etag):
+        """
+        Get the current or previous snapshot with the given ETag, or None if it is older than that.
+        """
+        with self.lock:
+            for snapshot in (self.current, self.previous):
+                if snapshot is not None and snapshot.etag == etag:
+                    return snapshot
+        return None
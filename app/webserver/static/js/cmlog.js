@@ -0,0 +1,46 @@
+/**
+ * Tails the CM log, fetching only the lines added since the last fetch.
+ */
+(() => {
+
+    const container = document.getElementById('cmlog');
+    const pre = container.querySelector('pre');
+    let next = parseInt(container.dataset.next, 10);
+
+    // Keep no more lines than the server does
+    const limit = parseInt(container.dataset.limit, 10);
+    const lines = pre.textContent.length > 0 ? pre.textContent.split('\r\n') : [];
+
+    // Start at the bottom
+    container.scrollTop = container.scrollHeight;
+
+    const tail = () => {
+        fetch('api/cmlog?since=' + next)
+            .then(response => response.json())
+            .then(update => {
+                next = update.next;
+                if (update.lines.length === 0) {
+                    return;
+                }
+
+                // Only follow the log if we were already at the bottom
+                const following = container.scrollTop + container.clientHeight >= container.scrollHeight - 5;
+                const text = (lines.length > 0 ? '\r\n' : '') + update.lines.join('\r\n');
+                lines.push(...update.lines);
+                if (lines.length > limit) {
+                    // Drop the oldest lines
+                    lines.splice(0, lines.length - limit);
+                    pre.textContent = lines.join('\r\n');
+                } else {
+                    pre.appendChild(document.createTextNode(text));
+                }
+                if (following) {
+                    container.scrollTop = container.scrollHeight;
+                }
+            })
+            .catch(() => {})
+            .finally(() => setTimeout(tail, 2000));
+    };
+    setTimeout(tail, 2000);
+
+})();
@@ -0,0 +1,109 @@
+/**
+ * Keeps the status page up to date in place, using the /api/stream event stream
+ * (or long-polling /api/poll where EventSource isn't available).
+ */
+(() => {
+
+    // Bulma classes for each result state (see Home.__bulma_class)
+    const stateClasses = [
+        'has-background-success-light',
+        'has-background-warning-light',
+        'has-background-danger-light',
+        'has-background-grey-lighter'
+    ];
+
+    // Set the state colour & value text of a status row
+    const setRow = (row, stateClass, value) => {
+        stateClasses.forEach(cls => row.classList.remove(cls));
+        row.classList.add(stateClass);
+        row.querySelector('[data-value]').textContent = value;
+    };
+
+    // Apply a set of changes to the page
+    // Returns false if the changes can't be applied in place (e.g. a different set of results)
+    const applyDelta = (delta) => {
+        if (delta.cm !== undefined) {
+            setRow(
+                document.getElementById('cm-status'),
+                delta.cm.running ? stateClasses[0] : stateClasses[2],
+                delta.cm.running ? 'Running' : 'Not Running'
+            );
+        }
+
+        if (delta.internet !== undefined) {
+            setRow(
+                document.getElementById('internet-status'),
+                delta.internet ? stateClasses[0] : stateClasses[2],
+                delta.internet ? 'Up' : 'Down'
+            );
+        }
+
+        if (delta.removed !== undefined && delta.removed.length > 0) {
+            return false;
+        }
+
+        for (const key in (delta.results || {})) {
+            const row = document.querySelector('tr[data-key="' + CSS.escape(key) + '"]');
+            if (row === null) {
+                return false;
+            }
+            const value = delta.results[key].value;
+            setRow(row, stateClasses[delta.results[key].state], value === null ? '-' : value);
+        }
+
+        return true;
+    };
+
+    // The layout has changed - fetch the whole page again
+    const reload = () => window.location.reload();
+
+    // Long-poll fallback
+    const poll = (etag) => {
+        fetch('api/poll?etag=' + encodeURIComponent(etag))
+            .then(response => response.json())
+            .then(update => {
+                // The server no longer knows our snapshot
+                if (update.snapshot !== undefined) {
+                    return reload();
+                }
+                if (update.delta !== undefined && !applyDelta(update.delta)) {
+                    return reload();
+                }
+                poll(update.etag);
+            })
+            .catch(() => setTimeout(() => poll(etag), 5000));
+    };
+
+    // The snapshot the page was rendered with - the server sends what changed since
+    let etag = document.getElementById('status').dataset.etag;
+
+    if (window.EventSource !== undefined) {
+        const source = new EventSource('api/stream?etag=' + encodeURIComponent(etag));
+
+        // The server no longer knows the page's snapshot, so it can't tell us what changed
+        source.addEventListener('snapshot', () => {
+            source.close();
+            reload();
+        });
+
+        source.addEventListener('delta', (event) => {
+            if (!applyDelta(JSON.parse(event.data))) {
+                source.close();
+                reload();
+            }
+            etag = event.lastEventId;
+        });
+
+        // Turned away (e.g. the server has too many streams open)? Long-poll instead
+        source.addEventListener('error', () => {
+            if (source.readyState === EventSource.CLOSED) {
+                poll(etag);
+            }
+        });
+
+        return;
+    }
+
+    poll(etag);
+
+})();
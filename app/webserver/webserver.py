@@ -1,6 +1,10 @@
 import logging
+import threading
+import waitress
 from flask import Flask
-from .routes import Home
+from .routes import Home, Api, Metrics
+from .snapshot import SnapshotPublisher
+from .metrics import MetricsExporter
 
 logger = logging.getLogger(__name__)
 
@@ -9,33 +13,91 @@ class Webserver:
     Provides a web console for viewing CPE information.
     """
 
-    def __init__(self, port, at_poller, cm_supervisor, ip_checker):
+    def __init__(self, port, at_poller, cm_supervisor, ip_checker, server_config=None):
         """
         Create a new webserver.
+        server_config selects & configures the HTTP server (see the web section of config.yml.dist).
         """
 
         # Provide the AT poller & supervisor objects to routes that need it
         self.port = port
+        self.server_config = server_config if server_config is not None else {}
         Home.ip_checker = ip_checker
         Home.at_poller = at_poller
         Home.cm_supervisor = cm_supervisor
+        Api.ip_checker = ip_checker
+        Api.at_poller = at_poller
+        Api.cm_supervisor = cm_supervisor
+
+        # Requests for the status are served from a snapshot published as things change
+        Api.snapshot_publisher = SnapshotPublisher(at_poller, cm_supervisor, ip_checker)
+        Home.snapshot_publisher = Api.snapshot_publisher
+
+        # Prometheus scrapes are served from text cached until something changes
+        Metrics.exporter = MetricsExporter(at_poller, cm_supervisor, ip_checker, Api.snapshot_publisher)
         
         # The WSGI app
         self.app = None
 
-    def start_server(self):
+        # The server (unless it's the development server) & the thread it runs on
+        self.server = None
+        self.__server_thread = None
+
+    def create_app(self):
         """
-        Start the web server.
+        Create the WSGI app, without serving it.
         """
         self.app = Flask(__name__, template_folder='templates/')    
         self.app.config["SECRET_KEY"] = "appkey"
         self.app.jinja_env.add_extension('jinja2.ext.loopcontrols')
         self.app.register_blueprint(Home.blueprint, url_prefix='/')
+        self.app.register_blueprint(Api.blueprint, url_prefix='/api')
+        self.app.register_blueprint(Metrics.blueprint, url_prefix='/')
+        return self.app
+
+    def start_server(self):
+        """
+        Start the web server.
+        """
+        self.create_app()
 
         # Disable excessive logging
         log = logging.getLogger('werkzeug')
         log.setLevel(logging.ERROR)
 
+        # Live status event streams each hold a worker for as long as they're open, so only so many are allowed
+        Api.stream_slots = threading.BoundedSemaphore(self.server_config.get('streams', 4))
+
+        # Run the Flask development server?
+        if self.server_config.get('mode', 'waitress') == 'development':
+            logger.info("Starting development web server on port %d" % self.port)
+            self.__server_thread = threading.Thread(
+                target=self.app.run, kwargs={'host': '0.0.0.0', 'port': self.port, 'threaded': True}
+            )
+        else:
+            # Waitress reads requests & writes responses itself, so slow clients & idle keep-alive connections don't
+            # hold a worker - the workers only run the app
+            workers = self.server_config.get('workers', 16)
+            self.server = waitress.create_server(
+                self.app,
+                host='0.0.0.0',
+                port=self.port,
+                threads=workers,
+                backlog=self.server_config.get('queue', 32),
+                connection_limit=self.server_config.get('max_connections', 256),
+                channel_timeout=self.server_config.get('timeout', 30)
+            )
+            self.port = int(self.server.effective_port)
+            logger.info("Starting web server on port %d with %d workers" % (self.port, workers))
+            self.__server_thread = threading.Thread(target=self.server.run)
+
         # Start the server
-        self.app.run(host='0.0.0.0', port=self.port)
+        self.__server_thread.daemon = True
+        self.__server_thread.start()
 
+    def wait(self):
+        """
+        Block until the web server stops.
+        """
+        if self.__server_thread is not None:
+            self.__server_thread.join()
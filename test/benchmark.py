@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the hot paths - response parsing, poll cycles against the modem emulator & serving HTTP requests.
+
+    python3 test/benchmark.py                      # run & compare against test/benchmark_baseline.json
+    python3 test/benchmark.py --output results.json
+    python3 test/benchmark.py --update-baseline    # store this run as the new baseline
+
+Results are JSON. The run fails (exit code 1) if any benchmark is more than --threshold worse than the baseline.
+Baselines are only comparable on the same hardware - regenerate it on the machine you compare on.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import threading
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'app'))
+sys.path.insert(0, TEST_DIR)
+
+DEFAULT_BASELINE = os.path.join(TEST_DIR, 'benchmark_baseline.json')
+
+def load_corpus(name):
+    """
+    Load a corpus of responses - blocks of lines separated by blank lines, with # comments.
+    """
+    responses = []
+    block = []
+    with open(os.path.join(TEST_DIR, 'corpus', name), 'r') as corpus_file:
+        for line in corpus_file:
+            line = line.strip()
+            if line.startswith('#'):
+                continue
+            if line:
+                block.append(line)
+            elif block:
+                responses.append(block)
+                block = []
+    if block:
+        responses.append(block)
+    return responses
+
+def measure(function, duration):
+    """
+    Call function repeatedly for about duration seconds, returning the mean time per call in microseconds.
+    """
+    # Warm up, and work out how many calls to time at once so the clock overhead doesn't matter
+    function()
+    batch = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(batch):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed > duration / 10:
+            break
+        batch *= 2
+
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for _ in range(batch):
+            function()
+        calls += batch
+    return (time.perf_counter() - start) / calls * 1e6
+
+def percentile(samples, fraction):
+    """
+    Get a percentile of a sorted list of samples (nearest rank).
+    """
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+def bench_parsers(duration):
+    """
+    Parser throughput - mean time to parse each response in the corpus.
+    """
+    from at.commands import ServingCellCommand, SignalQualityCommand, TemperatureCommand, NeighbourCellCommand
+
+    results = {}
+    for name, command_class, corpus in (
+        ('serving_cell', ServingCellCommand, 'servingcell.txt'),
+        ('signal_quality', SignalQualityCommand, 'signal_quality.txt'),
+        ('temperature', TemperatureCommand, 'temperature.txt'),
+        ('neighbour_cell', NeighbourCellCommand, 'neighbourcell.txt'),
+    ):
+        command = command_class()
+        responses = load_corpus(corpus)
+
+        def parse_all():
+            for response in responses:
+                command.results = []
+                command.parse(response)
+
+        results['parse.%s' % name] = {
+            'value': measure(parse_all, duration) / len(responses),
+            'unit': 'us/response',
+            'better': 'lower'
+        }
+    return results
+
+def bench_cycles(duration):
+    """
+    Poll cycle latency against the modem emulator, batched & not.
+    """
+    from modem_emulator import ModemEmulator
+    from at import Poller
+
+    results = {}
+    for batch in (True, False):
+        emulator = ModemEmulator(conditions={'latency': 1}).start()
+        poller = Poller(emulator.path, 100, batch=batch, intervals={
+            'ServingCellCommand': 100,
+            'SignalQualityCommand': 100,
+            'TemperatureCommand': 100,
+            'RegistrationCommand': 100,
+            'NeighbourCellCommand': 100,
+        })
+
+        # Time every completed poll cycle
+        cycles = []
+        first_cycle = threading.Event()
+
+        def on_cycle():
+            if poller.cycles > len(cycles):
+                cycles.append(poller.last_cycle_seconds)
+                first_cycle.set()
+
+        poller.add_listener(on_cycle)
+        poller.start()
+        if not first_cycle.wait(30):
+            raise RuntimeError("The poller never completed a cycle")
+
+        # Skip the first cycle, which includes opening the port
+        cycles.clear()
+        time.sleep(duration)
+        poller.stop()
+        emulator.stop()
+
+        samples = sorted(cycles)
+        if not samples:
+            raise RuntimeError("No poll cycles completed")
+
+        name = 'cycle.%s' % ('batch' if batch else 'sequential')
+        results[name + '.p50'] = {'value': statistics.median(samples) * 1000, 'unit': 'ms', 'better': 'lower'}
+        results[name + '.p95'] = {'value': percentile(samples, 0.95) * 1000, 'unit': 'ms', 'better': 'lower'}
+    return results
+
+def benchmark_supervisor(poller):
+    """
+    Create a Supervisor that is never started, but looks as if quectel_CM has been running for an hour.
+    The web pages only read its state.
+    """
+    from cm import Supervisor
+
+    class IdleChecker:
+        """
+        Stands in for the internet checker, which the Supervisor would otherwise start.
+        """
+
+        def add_listener(self, listener):
+            pass
+
+        def start(self):
+            pass
+
+    supervisor = Supervisor('/bin/false', 5000, None, 1000, poller, IdleChecker())
+    supervisor.is_running = True
+    supervisor.starts = 1
+    supervisor.relaunches = 0
+    supervisor.started_at = time.time()
+    supervisor.run_time.add(3600)
+    supervisor.exit_codes[0] += 1
+    supervisor.log.extend(["[10-17_12:00:00:000] requestRegistrationState2 MCC: 234, MNC: 20, PS: Attached, DataCap: LTE"] * 1000)
+    supervisor.log_sequence = 1000
+    return supervisor
+
+def bench_http(duration):
+    """
+    HTTP request throughput for the pages & API endpoints, through the WSGI app.
+    """
+    from at import Poller
+    from cm import InternetChecker
+    from webserver import Webserver
+
+    # A poller with a full set of results, as if it had polled a modem
+    poller = Poller('/dev/null', 1000)
+    corpora = {
+        'ServingCellCommand': 'servingcell.txt',
+        'SignalQualityCommand': 'signal_quality.txt',
+        'TemperatureCommand': 'temperature.txt',
+        'NeighbourCellCommand': 'neighbourcell.txt',
+    }
+    for command in poller.commands:
+        if command.__class__.__name__ in corpora:
+            command.update(True, load_corpus(corpora[command.__class__.__name__])[0])
+        for result in command.results:
+            if result.is_numeric:
+                for age in range(3600):
+                    poller.history.record(result.key, result.value, time.time() - age)
+
+    webserver = Webserver(8080, poller, benchmark_supervisor(poller), InternetChecker())
+    client = webserver.create_app().test_client()
+    etag = client.get('/api/status').headers['ETag']
+
+    results = {}
+    for name, path, headers in (
+        ('home', '/', {}),
+        ('cmlog', '/cmlog', {}),
+        ('cells', '/cells', {}),
+        ('api_status', '/api/status', {}),
+        ('api_status_not_modified', '/api/status', {'If-None-Match': etag}),
+        ('api_history', '/api/history/lte_rsrp', {}),
+        ('api_cells', '/api/cells', {}),
+        ('metrics', '/metrics', {}),
+        ('diagnostics', '/diagnostics', {}),
+        ('api_diagnostics', '/api/diagnostics', {}),
+    ):
+        def request():
+            response = client.get(path, headers=headers)
+            if response.status_code not in (200, 304):
+                raise RuntimeError("%s returned %d" % (path, response.status_code))
+
+        results['http.%s' % name] = {'value': 1e6 / measure(request, duration), 'unit': 'requests/s', 'better': 'higher'}
+    return results
+
+def compare(results, baseline, threshold):
+    """
+    Compare results to a baseline, returning the names of the benchmarks that regressed by more than threshold.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+
+        old = baseline[name]['value']
+        new = result['value']
+        change = (new - old) / old if old else 0.0
+        worse = change > threshold if result['better'] == 'lower' else change < -threshold
+        print("%-40s %12.2f -> %12.2f %-12s %+7.1f%%%s" % (
+            name, old, new, result['unit'], change * 100, "  REGRESSION" if worse else ""
+        ), file=sys.stderr)
+        if worse:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsing, polling & HTTP serving.')
+    parser.add_argument('--output', help='Write the results here as JSON (default: stdout)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline results to compare against')
+    parser.add_argument('--update-baseline', action='store_true', help='Store these results as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed regression as a fraction (default 0.25)')
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds to run each benchmark for')
+    parser.add_argument('--only', choices=['parse', 'cycle', 'http'], action='append', help='Only run these suites')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    # Keep anything the app writes out of the way
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+
+    suites = {'parse': bench_parsers, 'cycle': bench_cycles, 'http': bench_http}
+    results = {}
+    try:
+        for name, suite in suites.items():
+            if args.only and name not in args.only:
+                continue
+            print("Running %s benchmarks..." % name, file=sys.stderr)
+            results.update(suite(args.duration))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'time': time.time()
+        },
+        'benchmarks': results
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            baseline_file.write(output + '\n')
+        print("Baseline updated: %s" % args.baseline, file=sys.stderr)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at %s - nothing to compare with" % args.baseline, file=sys.stderr)
+        return 0
+
+    with open(args.baseline, 'r') as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline['environment']['machine'] != report['environment']['machine']:
+        print("Warning: the baseline was recorded on a %s machine" % baseline['environment']['machine'], file=sys.stderr)
+
+    regressions = compare(results, baseline['benchmarks'], args.threshold)
+    if regressions:
+        print("%d benchmark(s) regressed by more than %d%%: %s" % (
+            len(regressions), args.threshold * 100, ", ".join(regressions)
+        ), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+"""
+Emulates the AT port of a Quectel modem on a pseudo-terminal, so the poller & command parsers can be run without hardware.
+
+    python3 test/modem_emulator.py --link /tmp/ttyQuectel --scenario test/scenarios/flaky.yml
+
+Then set at.dev to /tmp/ttyQuectel (or the /dev/pts/N path printed on startup).
+
+Responses can be delayed (latency & jitter), written in fragments, preceded by garbage lines or dropped entirely,
+URCs are sent periodically, and scenarios can change the radio conditions & the adverse conditions over time.
+"""
+import os
+import re
+import pty
+import sys
+import tty
+import time
+import random
+import select
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger(__name__)
+
+class ModemState:
+    """
+    What the emulated modem reports.
+    """
+
+    # Defaults - any of these can be set by a scenario's modem section
+    DEFAULTS = {
+        'rat': 'LTE',
+        'status': 'NOCONN',
+        'registration': 1,
+        'mcc': '234',
+        'mnc': '20',
+        'tac': '1A2B',
+        'cell_id': '1A2B3C4',
+        'pci': 123,
+        'earfcn': 1617,
+        'band': 3,
+        'bandwidth': 5,
+        'rsrp': -95,
+        'rsrq': -10,
+        'rssi': -65,
+        'sinr': 12,
+        'cqi': 9,
+        'tx_power': 230,
+        'nr_pci': 100,
+        'nr_arfcn': 627264,
+        'nr_band': 78,
+        'nr_rsrp': -90,
+        'nr_rsrq': -11,
+        'nr_sinr': 20,
+        'csq': 20,
+        'temperature': 42,
+        'neighbours': [
+            {'type': 'intra', 'earfcn': 1617, 'pci': 301, 'rsrp': -104, 'rsrq': -13},
+            {'type': 'inter', 'earfcn': 6300, 'pci': 44, 'rsrp': -110, 'rsrq': -14},
+        ],
+        'ca': [
+            {'earfcn': 6300, 'bandwidth': 50, 'band': 'LTE BAND 20', 'pci': 44, 'rsrp': -108, 'rsrq': -13},
+        ],
+    }
+
+    # Signal measurements that wander about if Conditions.wander is set
+    WANDERING = ('rsrp', 'rsrq', 'sinr', 'nr_rsrp', 'nr_rsrq', 'nr_sinr')
+
+    def __init__(self, settings=None):
+        self.values = dict(ModemState.DEFAULTS)
+        self.cfun = 1
+        self.urc_csq = False
+        self.reg_urcs = {'+CREG': 0, '+CGREG': 0, '+CEREG': 0}
+        if settings:
+            self.values.update(settings)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['values'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def wander(self, amount):
+        """
+        Move the signal measurements randomly by up to amount.
+        """
+        for name in ModemState.WANDERING:
+            self.values[name] = int(self.values[name] + random.randint(-amount, amount))
+
+    def radio_on(self):
+        return self.cfun == 1
+
+    def serving_cell(self):
+        """
+        The +QENG="servingcell" response lines.
+        """
+        if not self.radio_on() or self.status == 'SEARCH':
+            return ['+QENG: "servingcell","SEARCH"']
+
+        lte = '"LTE","FDD",%s,%s,%s,%d,%d,%d,%d,%d,%s,%d,%d,%d,%d,%d,%d,-' % (
+            self.mcc, self.mnc, self.cell_id, self.pci, self.earfcn, self.band, self.bandwidth, self.bandwidth,
+            self.tac, self.rsrp, self.rsrq, self.rssi, self.sinr, self.cqi, self.tx_power
+        )
+        if self.rat == 'EN-DC':
+            return [
+                '+QENG: "servingcell","%s"' % self.status,
+                '+QENG: %s' % lte,
+                '+QENG: "NR5G-NSA",%s,%s,%d,%d,%d,%d,%d,%d,12,1' % (
+                    self.mcc, self.mnc, self.nr_pci, self.nr_rsrp, self.nr_sinr, self.nr_rsrq, self.nr_arfcn, self.nr_band
+                ),
+            ]
+        if self.rat == 'NR5G-SA':
+            return ['+QENG: "servingcell","%s","NR5G-SA","TDD",%s,%s,%s,%d,%s,%d,%d,12,%d,%d,%d,1,-' % (
+                self.status, self.mcc, self.mnc, self.cell_id, self.nr_pci, self.tac, self.nr_arfcn, self.nr_band,
+                self.nr_rsrp, self.nr_rsrq, self.nr_sinr
+            )]
+        if self.rat == 'WCDMA':
+            return ['+QENG: "servingcell","%s","WCDMA",%s,%s,%s,%s,10612,%d,1,%d,-6,-,-,-,-,-' % (
+                self.status, self.mcc, self.mnc, self.tac, self.cell_id, self.pci, self.rsrp
+            )]
+        return ['+QENG: "servingcell","%s",%s' % (self.status, lte)]
+
+    def neighbour_cells(self):
+        """
+        The +QENG="neighbourcell" response lines.
+        """
+        if not self.radio_on():
+            return []
+        return [
+            '+QENG: "neighbourcell %s","LTE",%d,%d,%d,%d,-70,10,30,5,10,2,30' % (
+                cell['type'], cell['earfcn'], cell['pci'], cell['rsrq'], cell['rsrp']
+            ) for cell in self.neighbours
+        ]
+
+    def carrier_aggregation(self):
+        """
+        The +QCAINFO response lines.
+        """
+        if not self.radio_on() or self.status == 'SEARCH':
+            return []
+        lines = ['+QCAINFO: "PCC",%d,%d,"LTE BAND %d",1,%d,%d,%d,%d,%d' % (
+            self.earfcn, self.bandwidth * 5, self.band, self.pci, self.rsrp, self.rsrq, self.rssi, self.sinr
+        )]
+        lines.extend(
+            '+QCAINFO: "SCC",%d,%d,"%s",1,%d,%d,%d,-80,5' % (
+                cell['earfcn'], cell['bandwidth'], cell['band'], cell['pci'], cell['rsrp'], cell['rsrq']
+            ) for cell in self.ca
+        )
+        return lines
+
+    def registration_line(self, prefix, query=True):
+        """
+        A +CREG/+CGREG/+CEREG line - as a query response (with the URC setting) or as a URC.
+        """
+        stat = self.registration if self.radio_on() else 0
+        parameters = [str(stat)]
+        if self.reg_urcs[prefix] == 2 and stat in (1, 5):
+            parameters += ['"%s"' % self.tac, '"%s"' % self.cell_id, '7']
+        if query:
+            parameters.insert(0, str(self.reg_urcs[prefix]))
+        return '%s: %s' % (prefix, ','.join(parameters))
+
+    def signal_quality(self):
+        return '%d,99' % (self.csq if self.radio_on() else 99)
+
+class Conditions:
+    """
+    How badly the emulated modem behaves - any of these can be set by a scenario's conditions section.
+    """
+
+    DEFAULTS = {
+        # Response delay & random extra delay, in ms
+        'latency': 20,
+        'jitter': 0,
+
+        # Probability of writing a response in several fragments, and the delay between fragments in ms
+        'fragment': 0.0,
+        'fragment_delay': 5,
+
+        # Probability of a garbage line before a response
+        'garbage': 0.0,
+
+        # Probability of not responding at all
+        'dropout': 0.0,
+
+        # Seconds between CSQ URCs (when enabled by AT+QINDCFG), 0 for none
+        'urc_interval': 0,
+
+        # Maximum random change in the signal measurements at each URC/poll, 0 for none
+        'wander': 0,
+
+        # Seconds an AT+CFUN=1,1 reset takes, during which the port disappears
+        'reset_time': 5,
+    }
+
+    def __init__(self, settings=None):
+        self.values = dict(Conditions.DEFAULTS)
+        if settings:
+            self.values.update(settings)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['values'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+class ModemEmulator:
+    """
+    A pseudo-terminal that answers AT commands like a Quectel modem.
+    """
+
+    # Commands concatenated on one line are separated by semicolons outside of quotes
+    SEPARATOR = re.compile(r';(?=(?:[^"]*"[^"]*")*[^"]*$)')
+
+    GARBAGE = [b'\xff\xfe\x00garbage', b'+QIND: "unknown",1', b'RDY', b'\x1b[0m']
+
+    def __init__(self, modem=None, conditions=None, steps=None, loop=False, link=None, echo=False):
+        """
+        Create a new emulator.
+        steps is a list of scenario steps - dictionaries with an "after" time in seconds & modem/conditions settings
+        (or "reset": seconds to simulate a reset).
+        If link is given, a symlink to the pty is kept there (and moved when a reset creates a new pty).
+        """
+        self.state = ModemState(modem)
+        self.conditions = Conditions(conditions)
+        self.steps = sorted(steps or [], key=lambda step: step['after'])
+        self.loop = loop
+        self.link = link
+        self.echo = echo
+
+        # Commands received & responses dropped, for tests to check
+        self.received = []
+        self.dropped = 0
+
+        self.running = False
+        self.master = None
+        self.path = None
+
+        # Writes of whole lines (responses & URCs) mustn't interleave
+        self.write_lock = threading.Lock()
+
+        # Set while the port is "unplugged" by a reset
+        self.resetting = threading.Event()
+
+        self.__open()
+
+    def __open(self):
+        """
+        Create the pseudo-terminal.
+        """
+        master, slave = pty.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        self.master = master
+        self.slave = slave
+        self.path = os.ttyname(slave)
+
+        if self.link is not None:
+            if os.path.lexists(self.link):
+                os.remove(self.link)
+            os.symlink(self.path, self.link)
+
+        logger.info("Modem emulator listening on %s%s" % (self.path, " (%s)" % self.link if self.link else ""))
+
+    def __close(self):
+        """
+        Remove the pseudo-terminal - readers get an error, as when a USB modem disappears.
+        """
+        if self.link is not None and os.path.lexists(self.link):
+            os.remove(self.link)
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def start(self):
+        """
+        Start answering commands (and running the scenario) on background threads.
+        """
+        self.running = True
+        for target in (self.__serve, self.__run_urcs, self.__run_scenario):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.__close()
+
+    def reset(self, duration=None):
+        """
+        Simulate the modem resetting - the port disappears for duration seconds, then comes back (as a new pty).
+        """
+        duration = self.conditions.reset_time if duration is None else duration
+
+        # Give the host a moment to read anything already sent (e.g. the OK to AT+CFUN=1,1)
+        time.sleep(0.2)
+        logger.info("Resetting for %ss" % duration)
+        self.resetting.set()
+        self.__close()
+        time.sleep(duration)
+        self.state.cfun = 1
+        self.__open()
+        self.resetting.clear()
+        self.__write_line(b'RDY')
+
+    def __write(self, data):
+        try:
+            os.write(self.master, data)
+        except OSError:
+            pass
+
+    def __write_line(self, line):
+        with self.write_lock:
+            self.__write(b'\r\n' + line + b'\r\n')
+
+    def __respond(self, lines):
+        """
+        Write a response, as badly as the conditions say.
+        """
+        conditions = self.conditions
+        time.sleep((conditions.latency + random.uniform(0, conditions.jitter)) / 1000)
+
+        if random.random() < conditions.garbage:
+            self.__write_line(random.choice(ModemEmulator.GARBAGE))
+
+        data = b''.join(b'\r\n' + line.encode('ascii') + b'\r\n' for line in lines)
+        with self.write_lock:
+            if random.random() < conditions.fragment and len(data) > 1:
+                cuts = sorted(random.sample(range(1, len(data)), min(len(data) - 1, random.randint(1, 4))))
+                for start, end in zip([0] + cuts, cuts + [len(data)]):
+                    self.__write(data[start:end])
+                    time.sleep(conditions.fragment_delay / 1000)
+            else:
+                self.__write(data)
+
+    def __serve(self):
+        """
+        Read command lines & answer them.
+        """
+        buffer = b''
+        while self.running:
+            if self.resetting.is_set():
+                time.sleep(0.05)
+                buffer = b''
+                continue
+
+            try:
+                readable, _, _ = select.select([self.master], [], [], 0.1)
+                if not readable:
+                    continue
+                buffer += os.read(self.master, 1024)
+            except OSError:
+                time.sleep(0.05)
+                continue
+
+            while b'\r' in buffer:
+                line, _, buffer = buffer.partition(b'\r')
+                line = line.strip(b'\n').decode('ascii', errors='replace').strip()
+                if line:
+                    self.__handle(line)
+
+    def __handle(self, line):
+        """
+        Answer one command line.
+        """
+        self.received.append(line)
+        if self.echo:
+            self.__write(line.encode('ascii') + b'\r')
+
+        if random.random() < self.conditions.dropout:
+            logger.debug("Dropping %s" % line)
+            self.dropped += 1
+            return
+
+        if not line.upper().startswith('AT'):
+            self.__respond(['ERROR'])
+            return
+
+        if self.conditions.wander:
+            self.state.wander(self.conditions.wander)
+
+        # AT<cmd1>;<cmd2>;... - answer each in turn, stopping at the first error
+        lines = []
+        after = None
+        for command in ModemEmulator.SEPARATOR.split(line[2:]):
+            result = self.__command(command.strip())
+            if result is None:
+                lines.append('ERROR')
+                break
+            if callable(result):
+                after = result
+                continue
+            lines.extend(result)
+        else:
+            lines.append('OK')
+
+        self.__respond(lines)
+        if after is not None:
+            after()
+
+    def __command(self, command):
+        """
+        Get the response lines to a single command, a callable to run after the response, or None for an error.
+        """
+        state = self.state
+        upper = command.upper()
+
+        if upper in ('', 'E0', 'E1', 'V1', 'Q0'):
+            return []
+        if upper == 'I':
+            return ['Quectel', 'RM500Q-GL', 'Revision: RM500QGLABR11A06M4G']
+        if upper == '+CGMR':
+            return ['RM500QGLABR11A06M4G']
+        if upper == '+QENG="SERVINGCELL"':
+            return state.serving_cell()
+        if upper == '+QENG="NEIGHBOURCELL"':
+            return state.neighbour_cells()
+        if upper == '+QCAINFO':
+            return state.carrier_aggregation()
+        if upper == '+CSQ':
+            return ['+CSQ: %s' % state.signal_quality()]
+        if upper == '+QTEMP':
+            return [
+                '+QTEMP:"%s","%d"' % (region, state.temperature + offset)
+                for region, offset in (('modem-lte-sub6-pa1', 0), ('modem-sdr0-pa0', -2), ('cpu0-a7-usr', 3))
+            ]
+        if upper == '+QNETDEVSTATUS?':
+            return [] if state.status == 'SEARCH' else ['+QNETDEVSTATUS: 1,1,4,1']
+
+        # URC configuration
+        if upper.startswith('+QINDCFG="CSQ"'):
+            state.urc_csq = upper.split(',')[1:2] == ['1']
+            return []
+        for prefix in state.reg_urcs:
+            if upper == prefix + '?':
+                return [state.registration_line(prefix)]
+            if upper.startswith(prefix + '='):
+                state.reg_urcs[prefix] = int(upper[len(prefix) + 1:])
+                return []
+
+        # Radio functionality
+        if upper == '+CFUN?':
+            return ['+CFUN: %d' % state.cfun]
+        if upper.startswith('+CFUN='):
+            parameters = upper[6:].split(',')
+            if parameters == ['1', '1']:
+                return lambda: threading.Thread(target=self.reset, daemon=True).start()
+            state.cfun = int(parameters[0])
+            return []
+
+        return None
+
+    def __run_urcs(self):
+        """
+        Send CSQ URCs periodically, if enabled.
+        """
+        while self.running:
+            interval = self.conditions.urc_interval
+            time.sleep(interval if interval else 0.5)
+            if interval and self.state.urc_csq and not self.resetting.is_set():
+                if self.conditions.wander:
+                    self.state.wander(self.conditions.wander)
+                    self.state.values['csq'] = max(0, min(31, self.state.csq + random.randint(-1, 1)))
+                self.__write_line(('+QIND: "csq",%s' % self.state.signal_quality()).encode('ascii'))
+
+    def __run_scenario(self):
+        """
+        Apply the scenario steps at their times.
+        """
+        while self.running and self.steps:
+            start = time.monotonic()
+            for step in self.steps:
+                delay = start + step['after'] - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if not self.running:
+                    return
+
+                logger.info("Scenario step at %ss: %s" % (step['after'], step))
+                self.apply(step)
+
+            if not self.loop:
+                return
+
+    def apply(self, step):
+        """
+        Apply a scenario step.
+        """
+        if 'conditions' in step:
+            self.conditions.values.update(step['conditions'])
+
+        if 'modem' in step:
+            old_registration = self.state.registration
+            self.state.values.update(step['modem'])
+
+            # Tell anyone listening about registration changes
+            if self.state.registration != old_registration:
+                for prefix, setting in self.state.reg_urcs.items():
+                    if setting:
+                        self.__write_line(self.state.registration_line(prefix, query=False).encode('ascii'))
+
+        if 'reset' in step:
+            self.reset(step['reset'])
+
+def load_scenario(path):
+    """
+    Load a YAML scenario file - modem & conditions sections for the start, then steps.
+    """
+    import yaml
+    with open(path, 'r') as scenario_file:
+        return yaml.load(scenario_file, Loader=yaml.SafeLoader) or {}
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulate a Quectel modem AT port on a pseudo-terminal.')
+    parser.add_argument('--scenario', help='YAML scenario file')
+    parser.add_argument('--link', help='Keep a symlink to the pty at this path')
+    parser.add_argument('--seed', type=int, help='Random seed, for repeatable runs')
+    parser.add_argument('--echo', action='store_true', help='Echo commands, as modems do before ATE0')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='<%(levelname)s> %(name)s: %(message)s')
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    scenario = load_scenario(args.scenario) if args.scenario else {}
+    emulator = ModemEmulator(
+        scenario.get('modem'),
+        scenario.get('conditions'),
+        scenario.get('steps'),
+        scenario.get('loop', False),
+        args.link,
+        args.echo
+    ).start()
+
+    print(emulator.link or emulator.path, flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'app'))
+
+from at.command import ResultField, ResultValueState, NOT_AVAILABLE
+from at.decoder import Schema, tokenize, split_line
+from at.commands import ServingCellCommand, SignalQualityCommand
+
+OK = ResultValueState.OK
+WARNING = ResultValueState.WARNING
+ERROR = ResultValueState.ERROR
+NOT_APPLICABLE = ResultValueState.NOT_APPLICABLE
+
+def decode(command, *lines):
+    """
+    Parse a response with a command, returning its results as {key: (value, state)}.
+    """
+    command.update(True, list(lines))
+    results = {result.key: (result.value, result.state) for result in command.results}
+    assert len(results) == len(command.results), "Duplicate result keys"
+    return results
+
+class TokenizeTest(unittest.TestCase):
+
+    def test_plain(self):
+        self.assertEqual(tokenize('"servingcell","NOCONN",234,-95'), ['servingcell', 'NOCONN', '234', '-95'])
+
+    def test_empty_parameters(self):
+        self.assertEqual(tokenize('1,,3,'), ['1', '', '3', ''])
+
+    def test_quoted_comma(self):
+        self.assertEqual(tokenize('"a,b",2,"c"'), ['a,b', '2', 'c'])
+
+    def test_unterminated_quote(self):
+        self.assertEqual(tokenize('1,"a,b'), ['1', 'a,b'])
+
+    def test_split_line(self):
+        self.assertEqual(split_line('+CSQ: 20,99'), ('+CSQ', ['20', '99']))
+        self.assertEqual(split_line('OK'), (None, None))
+
+class SchemaTest(unittest.TestCase):
+
+    FIELDS = (
+        ResultField('a', 'A', 'A', int),
+        None,
+        ResultField('c', 'C', 'C'),
+        ResultField('d', 'D', 'D', int, ('255',)),
+    )
+
+    def test_decode(self):
+        results = Schema('T', SchemaTest.FIELDS).decode(['1', 'skipped', 'x', '7'])
+        self.assertEqual([(result.key, result.value) for result in results], [('a', 1), ('c', 'x'), ('d', 7)])
+
+    def test_decode_from_offset(self):
+        results = Schema('T', SchemaTest.FIELDS).decode(['T', '1', 'skipped', 'x', '7'], 1)
+        self.assertEqual([result.value for result in results], [1, 'x', 7])
+
+    def test_placeholders(self):
+        for placeholder in ('', '-', '-32768'):
+            results = Schema('T', SchemaTest.FIELDS).decode([placeholder, '', placeholder, placeholder])
+            self.assertEqual([result.value for result in results], [NOT_AVAILABLE] * 3)
+            self.assertEqual([result.state for result in results], [NOT_APPLICABLE] * 3)
+
+    def test_field_placeholder(self):
+        results = Schema('T', SchemaTest.FIELDS).decode(['1', '', 'x', '255'])
+        self.assertIs(results[2].value, NOT_AVAILABLE)
+
+    def test_unparseable(self):
+        results = Schema('T', SchemaTest.FIELDS).decode(['x1', '', 'x', '7'])
+        self.assertIs(results[0].value, NOT_AVAILABLE)
+
+    def test_too_short(self):
+        self.assertIsNone(Schema('T', SchemaTest.FIELDS).decode(['1', '', 'x']))
+
+    def test_optional_fields(self):
+        schema = Schema('T', SchemaTest.FIELDS, required=2)
+        self.assertIsNone(schema.decode(['1']))
+        self.assertEqual([result.key for result in schema.decode(['1', ''])], ['a'])
+        self.assertEqual([result.key for result in schema.decode(['1', '', 'x'])], ['a', 'c'])
+
+class ServingCellTest(unittest.TestCase):
+
+    def setUp(self):
+        self.command = ServingCellCommand()
+
+    def test_lte_old_firmware(self):
+        self.assertEqual(decode(
+            self.command,
+            '+QENG: "servingcell","NOCONN","LTE","FDD",234,20,1A2B3C4,123,1617,3,5,5,1A2B,-95,-10,-65,12'
+        ), {
+            'status': ('NOCONN', OK),
+            'lte_dup_type': ('FDD', OK),
+            'lte_mcc': ('234', OK),
+            'lte_mnc': ('20', OK),
+            'lte_cid': ('1A2B3C4', OK),
+            'lte_pcid': (123, OK),
+            'lte_earfcn': (1617, OK),
+            'lte_freq_band_ind': (3, OK),
+            'lte_ul_bw': (5, OK),
+            'lte_dl_bw': (5, OK),
+            'lte_tac': ('1A2B', OK),
+            'lte_rsrp': (-95, OK),
+            'lte_rsrq': (-10, OK),
+            'lte_rssi': (-65, OK),
+            'lte_sinr': (12, OK),
+        })
+
+    def test_lte_connected(self):
+        results = decode(
+            self.command,
+            '+QENG: "servingcell","CONNECT","LTE","FDD",234,15,2F1E0D1,301,6300,20,3,3,5C6D,-104,-12,-74,5,8,190,28'
+        )
+        self.assertEqual(results['status'], ('CONNECT', OK))
+        self.assertEqual(results['lte_mnc'], ('15', OK))
+        self.assertEqual(results['lte_cid'], ('2F1E0D1', OK))
+        self.assertEqual(results['lte_earfcn'], (6300, OK))
+        self.assertEqual(results['lte_freq_band_ind'], (20, OK))
+        self.assertEqual(results['lte_rsrp'], (-104, OK))
+        self.assertEqual(results['lte_sinr'], (5, OK))
+        self.assertEqual(results['lte_cqi'], (8, OK))
+        self.assertEqual(results['lte_tx_power'], (190, OK))
+        self.assertEqual(results['lte_srxlev'], (28, OK))
+        self.assertEqual(len(results), 18)
+
+    def test_lte_tx_power_unavailable(self):
+        results = decode(
+            self.command,
+            '+QENG: "servingcell","NOCONN","LTE","TDD",310,260,0A1B2C3,87,39750,41,5,5,7E8F,-88,-9,-60,18,11,-32768,44'
+        )
+        self.assertEqual(results['lte_dup_type'], ('TDD', OK))
+        self.assertEqual(results['lte_mcc'], ('310', OK))
+        self.assertEqual(results['lte_mnc'], ('260', OK))
+        self.assertEqual(results['lte_cid'], ('0A1B2C3', OK))
+        self.assertEqual(results['lte_earfcn'], (39750, OK))
+        self.assertEqual(results['lte_cqi'], (11, OK))
+        self.assertEqual(results['lte_tx_power'], (NOT_AVAILABLE, NOT_APPLICABLE))
+        self.assertEqual(results['lte_srxlev'], (44, OK))
+
+    def test_en_dc(self):
+        results = decode(
+            self.command,
+            '+QENG: "servingcell","NOCONN"',
+            '+QENG: "LTE","FDD",234,20,1A2B3C4,123,1617,3,5,5,1A2B,-95,-10,-65,15,11,230,38',
+            '+QENG: "NR5G-NSA",234,20,100,-90,20,-11,627264,78,12,1'
+        )
+        self.assertEqual(results['status'], ('NOCONN', OK))
+        self.assertEqual(results['lte_pcid'], (123, OK))
+        self.assertEqual(results['lte_rsrp'], (-95, OK))
+        self.assertEqual(results['lte_sinr'], (15, OK))
+        self.assertEqual(results['lte_srxlev'], (38, OK))
+        self.assertEqual({key: value for key, value in results.items() if key.startswith('nr_nsa_')}, {
+            'nr_nsa_mcc': ('234', OK),
+            'nr_nsa_mnc': ('20', OK),
+            'nr_nsa_pcid': (100, OK),
+            'nr_nsa_rsrp': (-90, OK),
+            'nr_nsa_sinr': (20, OK),
+            'nr_nsa_rsrq': (-11, OK),
+            'nr_nsa_arfcn': (627264, OK),
+            'nr_nsa_band': (78, OK),
+            'nr_nsa_dl_bw': (12, OK),
+            'nr_nsa_scs': (1, OK),
+        })
+        self.assertEqual(len(results), 1 + 17 + 10)
+
+    def test_en_dc_nr_unavailable(self):
+        results = decode(
+            self.command,
+            '+QENG: "servingcell","CONNECT"',
+            '+QENG: "LTE","FDD",262,1,3C4D5E6,410,1300,3,5,5,9A0B,-101,-11,-70,9,10,210,30',
+            '+QENG: "NR5G-NSA",262,1,512,-32768,-32768,-32768,636666,78,12,1'
+        )
+        self.assertEqual(results['lte_mcc'], ('262', OK))
+        self.assertEqual(results['lte_rsrp'], (-101, OK))
+        self.assertEqual(results['nr_nsa_pcid'], (512, OK))
+        self.assertEqual(results['nr_nsa_rsrp'], (NOT_AVAILABLE, NOT_APPLICABLE))
+        self.assertEqual(results['nr_nsa_sinr'], (NOT_AVAILABLE, NOT_APPLICABLE))
+        self.assertEqual(results['nr_nsa_rsrq'], (NOT_AVAILABLE, NOT_APPLICABLE))
+        self.assertEqual(results['nr_nsa_arfcn'], (636666, OK))
+
+    def test_nr5g_sa(self):
+        self.assertEqual(decode(
+            self.command,
+            '+QENG: "servingcell","NOCONN","NR5G-SA","TDD",234,15,0A1B2C3D4,400,1A2B,643296,78,12,-88,-11,18,1,30'
+        ), {
+            'status': ('NOCONN', OK),
+            'nr_sa_dup_type': ('TDD', OK),
+            'nr_sa_mcc': ('234', OK),
+            'nr_sa_mnc': ('15', OK),
+            'nr_sa_cid': ('0A1B2C3D4', OK),
+            'nr_sa_pcid': (400, OK),
+            'nr_sa_tac': ('1A2B', OK),
+            'nr_sa_arfcn': (643296, OK),
+            'nr_sa_band': (78, OK),
+            'nr_sa_dl_bw': (12, OK),
+            'nr_sa_rsrp': (-88, OK),
+            'nr_sa_rsrq': (-11, OK),
+            'nr_sa_sinr': (18, OK),
+            'nr_sa_scs': (1, OK),
+            'nr_sa_srxlev': (30, OK),
+        })
+
+    def test_wcdma(self):
+        self.assertEqual(decode(
+            self.command,
+            '+QENG: "servingcell","LIMSRV","WCDMA",234,15,1A2B,3C4D,10612,123,1,-80,-6,-,-,-,-,-'
+        ), {
+            'status': ('LIMSRV', WARNING),
+            'wcdma_mcc': ('234', OK),
+            'wcdma_mnc': ('15', OK),
+            'wcdma_lac': ('1A2B', OK),
+            'wcdma_cid': ('3C4D', OK),
+            'wcdma_uarfcn': (10612, OK),
+            'wcdma_psc': (123, OK),
+            'wcdma_rac': ('1', OK),
+            'wcdma_rscp': (-80, OK),
+            'wcdma_ecio': (-6, OK),
+            'wcdma_phy_ch': (NOT_AVAILABLE, NOT_APPLICABLE),
+            'wcdma_sf': (NOT_AVAILABLE, NOT_APPLICABLE),
+            'wcdma_slot': (NOT_AVAILABLE, NOT_APPLICABLE),
+        })
+
+    def test_searching(self):
+        self.assertEqual(decode(self.command, '+QENG: "servingcell","SEARCH"'), {'status': ('SEARCH', ERROR)})
+
+    def test_short_lines(self):
+        # Technologies missing required parameters aren't reported at all
+        self.assertEqual(decode(
+            self.command,
+            '+QENG: "servingcell","NOCONN","LTE","FDD",234,20,1A2B3C4,123,1617,3,5,5,1A2B,-95,-10'
+        ), {'status': ('NOCONN', OK)})
+        results = decode(
+            self.command,
+            '+QENG: "servingcell","NOCONN"',
+            '+QENG: "LTE","FDD",234,20,1A2B3C4,123,1617,3,5,5,1A2B,-95,-10,-65,15',
+            '+QENG: "NR5G-NSA",234,20,100,-90'
+        )
+        self.assertEqual(results['lte_sinr'], (15, OK))
+        self.assertFalse([key for key in results if key.startswith('nr_nsa_')])
+        self.assertEqual(decode(self.command, '+QENG: "servingcell"'), {})
+
+    def test_unknown_technology(self):
+        self.assertEqual(decode(self.command, '+QENG: "servingcell","NOCONN","GSM",1,2,3'), {'status': ('NOCONN', OK)})
+
+class SignalQualityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.command = SignalQualityCommand()
+
+    def test_csq(self):
+        self.assertEqual(decode(self.command, '+CSQ: 20,99'), {
+            'csq': (20, OK),
+            'csq_ber': (NOT_AVAILABLE, NOT_APPLICABLE),
+        })
+        self.assertEqual(decode(self.command, '+CSQ: 31,0'), {'csq': (31, OK), 'csq_ber': (0, OK)})
+        self.assertEqual(decode(self.command, '+CSQ: 5,99')['csq'], (5, ERROR))
+        self.assertEqual(decode(self.command, '+CSQ: 99,99'), {
+            'csq': (NOT_AVAILABLE, ERROR),
+            'csq_ber': (NOT_AVAILABLE, NOT_APPLICABLE),
+        })
+
+    def test_short_line(self):
+        self.assertEqual(decode(self.command, '+CSQ: 20'), {})
+
+if __name__ == '__main__':
+    unittest.main()
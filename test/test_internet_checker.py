@@ -0,0 +1,252 @@
+import os
+import sys
+import time
+import socket
+import struct
+import threading
+import unittest
+import http.server
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'app'))
+
+from cm import InternetChecker
+from cm.probes import Probe, TcpProbe, DnsProbe, HttpProbe
+
+def wait_for(condition, timeout=5):
+    """
+    Wait for condition() to become true, failing if it doesn't within timeout seconds.
+    """
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise AssertionError("Timed out waiting for %s" % condition)
+        time.sleep(0.01)
+
+def unused_port(kind=socket.SOCK_STREAM):
+    """
+    Get a local port nothing is listening on.
+    """
+    sock = socket.socket(socket.AF_INET, kind)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+class DnsServer:
+    """
+    Answers DNS queries on a local UDP port - with a reply to some other query first, then the real one.
+    """
+
+    def __init__(self, answer=True):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.answer = answer
+        self.queries = []
+        thread = threading.Thread(target=self.__serve)
+        thread.daemon = True
+        thread.start()
+
+    def __serve(self):
+        while True:
+            try:
+                query, client = self.sock.recvfrom(512)
+            except OSError:
+                return
+            self.queries.append(query)
+            if not self.answer:
+                continue
+
+            query_id = struct.unpack('!H', query[:2])[0]
+            self.sock.sendto(struct.pack('!HHHHHH', query_id ^ 1, 0x8180, 1, 0, 0, 0), client)
+            self.sock.sendto(struct.pack('!HHHHHH', query_id, 0x8180, 1, 0, 0, 0) + query[12:], client)
+
+    def close(self):
+        self.sock.close()
+
+class HeadHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_HEAD(self):
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class CountingProbe(TcpProbe):
+    """
+    A TCP probe that counts its checks.
+    """
+
+    def __init__(self, host, port):
+        super().__init__(host, port)
+        self.calls = 0
+
+    def check(self, timeout):
+        self.calls += 1
+        return super().check(timeout)
+
+class BlockingProbe(Probe):
+    """
+    A probe that doesn't answer until it's released.
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __str__(self):
+        return "blocking"
+
+    def check(self, timeout):
+        self.calls += 1
+        self.release.wait()
+        return True
+
+class ProbeTest(unittest.TestCase):
+
+    def test_from_config(self):
+        self.assertIsInstance(Probe.from_config({'host': '8.8.8.8'}), TcpProbe)
+        self.assertEqual(str(Probe.from_config({'type': 'tcp', 'host': '1.1.1.1', 'port': 443})), 'tcp://1.1.1.1:443')
+        self.assertEqual(str(Probe.from_config({'type': 'dns', 'server': '1.1.1.1'})), 'dns://1.1.1.1:53/example.com')
+        self.assertEqual(str(Probe.from_config({'type': 'http', 'url': 'http://example.com/'})), 'http://example.com/')
+        with self.assertRaises(ValueError):
+            Probe.from_config({'type': 'icmp'})
+
+    def test_tcp(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        try:
+            self.assertTrue(TcpProbe('127.0.0.1', listener.getsockname()[1]).check(1))
+        finally:
+            listener.close()
+
+    def test_tcp_refused(self):
+        with self.assertRaises(OSError):
+            TcpProbe('127.0.0.1', unused_port()).check(1)
+
+    def test_dns(self):
+        server = DnsServer()
+        try:
+            self.assertTrue(DnsProbe('127.0.0.1', 'example.com', server.port).check(1))
+        finally:
+            server.close()
+
+        # An A record query for the name
+        query = server.queries[0]
+        self.assertEqual(struct.unpack('!HHHH', query[2:10]), (0x0100, 1, 0, 0))
+        self.assertEqual(query[12:], b'\x07example\x03com\x00\x00\x01\x00\x01')
+
+    def test_dns_no_answer(self):
+        server = DnsServer(answer=False)
+        try:
+            start = time.monotonic()
+            with self.assertRaises(socket.timeout):
+                DnsProbe('127.0.0.1', 'example.com', server.port).check(0.2)
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            server.close()
+
+    def test_http(self):
+        server = http.server.HTTPServer(('127.0.0.1', 0), HeadHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            self.assertTrue(HttpProbe('http://127.0.0.1:%d/generate_204' % server.server_port).check(1))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_http_refused(self):
+        with self.assertRaises(OSError):
+            HttpProbe('http://127.0.0.1:%d/' % unused_port()).check(1)
+
+class InternetCheckerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = None
+        self.port = unused_port()
+
+    def tearDown(self):
+        if self.listener is not None:
+            self.listener.close()
+
+    def listen(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', self.port))
+        self.listener.listen(16)
+
+    def test_adaptive_delay(self):
+        self.listen()
+        probe = CountingProbe('127.0.0.1', self.port)
+        checker = InternetChecker(poll_delay=400, max_failures=2, fast_delay=50, timeout=1, probes=[probe])
+        changes = []
+        checker.add_listener(lambda: changes.append(checker.has_internet()))
+        checker.start()
+        try:
+            wait_for(lambda: probe.calls >= 1)
+            self.assertTrue(checker.has_internet())
+            self.assertEqual(checker.delay, 400)
+
+            # Failing checks are repeated at the fast delay until we give up on the link
+            self.listener.close()
+            self.listener = None
+            start = time.monotonic()
+            checker.check_now()
+            wait_for(lambda: changes == [False])
+            self.assertLess(time.monotonic() - start, 0.4)
+            self.assertFalse(checker.has_internet())
+            self.assertEqual(checker.delay, 50)
+
+            # Once it's back, the delay doubles back up to the normal one
+            self.listen()
+            wait_for(lambda: changes == [False, True])
+            self.assertTrue(checker.has_internet())
+            wait_for(lambda: checker.delay > 50)
+            self.assertIn(checker.delay, (100, 200))
+            wait_for(lambda: checker.delay == 400)
+        finally:
+            checker.stop()
+
+    def test_race(self):
+        self.listen()
+        slow = BlockingProbe()
+        fast = CountingProbe('127.0.0.1', self.port)
+        checker = InternetChecker(poll_delay=50, probes=[slow, fast], timeout=1)
+        checker.start()
+        try:
+            # The probe that answers wins without waiting for the other
+            wait_for(lambda: fast.calls >= 3)
+            self.assertEqual(checker.failures, 0)
+
+            # ...and the one that doesn't is left running rather than started again each check
+            self.assertEqual(slow.calls, 1)
+        finally:
+            checker.stop()
+            slow.release.set()
+
+    def test_hung_probes(self):
+        slow = BlockingProbe()
+        checker = InternetChecker(poll_delay=50, max_failures=1, probes=[slow], timeout=0.05)
+        threads = threading.active_count()
+        checker.start()
+        try:
+            wait_for(lambda: checker.failures >= 3)
+            self.assertFalse(checker.has_internet())
+            self.assertEqual(slow.calls, 1)
+            self.assertLessEqual(threading.active_count(), threads + 2)
+
+            # Once it answers, it's started again for the next check
+            slow.release.set()
+            wait_for(lambda: checker.has_internet())
+            wait_for(lambda: slow.calls > 1)
+        finally:
+            checker.stop()
+            slow.release.set()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'app'))
+
+from at.store import MetricStore
+from at.history import History
+
+class MetricStoreTest(unittest.TestCase):
+
+    CAPACITY = 100
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'metrics.dat')
+        self.start = time.time() - 1000
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open(self, capacity=CAPACITY):
+        return MetricStore(self.path, MetricStore.RECORDS_OFFSET + capacity * MetricStore.RECORD.size)
+
+    def test_query(self):
+        store = self.open()
+        for index in range(10):
+            store.append('a', index, self.start + index)
+            store.append('b', -index, self.start + index)
+
+        times, values = store.query('a')
+        self.assertEqual(list(times), [self.start + index for index in range(10)])
+        self.assertEqual(list(values), list(range(10)))
+        self.assertEqual(list(store.query('b', self.start + 7)[1]), [-7, -8, -9])
+        self.assertEqual(list(store.query('b', self.start + 6.5)[1]), [-7, -8, -9])
+        self.assertEqual(len(store.query('a', self.start + 100)[0]), 0)
+        self.assertIsNone(store.query('c'))
+        store.close()
+
+    def test_wraps(self):
+        store = self.open()
+        for index in range(250):
+            store.append('a', index, self.start + index)
+
+        self.assertEqual(len(store), MetricStoreTest.CAPACITY)
+        self.assertEqual(list(store.query('a')[1]), list(range(150, 250)))
+
+        # Bisecting finds the start whether it's before or after the end of the file
+        for since in (100, 150, 160, 199, 200, 201, 249, 250):
+            self.assertEqual(list(store.query('a', self.start + since)[1]), list(range(max(since, 150), 250)), since)
+        store.close()
+
+    def test_clock_set_back(self):
+        store = self.open()
+        for index in range(10):
+            store.append('a', index, self.start + index)
+        for index in range(10, 20):
+            store.append('a', index, self.start + index - 15)
+
+        # Nothing from before since, however it's ordered in the file
+        for since in range(-6, 11):
+            times, values = store.query('a', self.start + since)
+            self.assertTrue(all(timestamp >= self.start + since for timestamp in times), since)
+
+        # History needs samples in time order, so anything older than the latest replayed is skipped
+        history = History()
+        store.replay(history)
+        self.assertEqual(list(history.query('a', 0)[1]), list(range(10)))
+        store.close()
+
+    def test_reopen(self):
+        store = self.open()
+        for index in range(150):
+            store.append('a', index, self.start + index, 2.5)
+        store.sync()
+        for index in range(150, 180):
+            store.append('a', index, self.start + index, 2.5)
+        store.append('b', 1, self.start + 180)
+
+        # Not closed - the write position is found from the records rather than the synced header
+        store.mm.flush()
+        store = self.open()
+        self.assertEqual(store.sequence, 181)
+        self.assertEqual(list(store.query('a')[1]), list(range(81, 180)))
+        self.assertEqual(store.intervals, [2.5, None])
+
+        store.append('a', 180, self.start + 180)
+        self.assertEqual(list(store.query('a', self.start + 179)[1]), [179, 180])
+        store.close()
+
+    def test_incompatible(self):
+        store = self.open()
+        store.append('a', 1, self.start)
+        store.close()
+
+        # A different size can't be used, so it's started afresh
+        store = self.open(MetricStoreTest.CAPACITY * 2)
+        self.assertEqual(len(store), 0)
+        self.assertIsNone(store.query('a'))
+        store.close()
+
+    def test_replay_intervals(self):
+        store = self.open(10000)
+        for index in range(3600):
+            store.append('fast', index, self.start - 3600 + index, 1)
+        for index in range(360):
+            store.append('slow', index, self.start - 3600 + index * 10, 10)
+        store.close()
+
+        # Each metric gets a raw buffer sized for how often it was sampled
+        store = self.open(10000)
+        history = History(raw_interval=5)
+        store.replay(history)
+        self.assertEqual(history.metrics['fast'][0].capacity, history.raw_capacity(1))
+        self.assertEqual(history.metrics['slow'][0].capacity, history.raw_capacity(10))
+        store.close()
+
+    def test_concurrent_query(self):
+        store = self.open(20000)
+        stop = threading.Event()
+
+        def append():
+            index = 0
+            while not stop.is_set():
+                store.append('a', index, self.start + index)
+                index += 1
+
+        writer = threading.Thread(target=append)
+        writer.start()
+        try:
+            # Whatever the writer is doing, every query sees whole records in order
+            for _ in range(20):
+                times, values = store.query('a')
+                self.assertEqual([value - values[0] for value in values], [timestamp - times[0] for timestamp in times])
+                self.assertEqual(list(values), sorted(values))
+        finally:
+            stop.set()
+            writer.join()
+            store.close()
+
+if __name__ == '__main__':
+    unittest.main()
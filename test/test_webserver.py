@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import socket
+import unittest
+import http.client
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, '..', 'app'))
+
+from at import Poller
+from cm import Supervisor, InternetChecker
+from webserver import Webserver
+from webserver.routes import Api
+
+class WebserverTest(unittest.TestCase):
+    """
+    Serves the app on a free port, as main.py does.
+    """
+
+    stream_keepalive = Api.stream_keepalive
+
+    def setUp(self):
+        poller = Poller('/dev/null', 1000)
+
+        # Nothing is started apart from the internet checker, which won't check anything for an hour
+        ip_checker = InternetChecker(poll_delay=3600 * 1000)
+        supervisor = Supervisor('/bin/false', 5000, None, 10, poller, ip_checker)
+
+        self.webserver = Webserver(0, poller, supervisor, ip_checker, {'workers': 4, 'streams': 1, 'timeout': 5})
+        self.webserver.start_server()
+        self.connections = []
+
+    def tearDown(self):
+        for connection in self.connections:
+            connection.close()
+
+        # Let the workers finish (e.g. notice a closed stream) before the server they write to is closed
+        self.webserver.server.task_dispatcher.shutdown()
+        self.webserver.server.close()
+        Api.stream_keepalive = WebserverTest.stream_keepalive
+
+    def connect(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.webserver.port, timeout=5)
+        self.connections.append(connection)
+        return connection
+
+    def get(self, connection, path, headers={}):
+        connection.request('GET', path, headers=headers)
+        return connection.getresponse()
+
+    def test_keep_alive(self):
+        connection = self.connect()
+        response = self.get(connection, '/api/status')
+        self.assertEqual(response.status, 200)
+        response.read()
+        sock = connection.sock
+
+        # The same connection serves the next request
+        response = self.get(connection, '/api/status')
+        self.assertEqual(response.status, 200)
+        response.read()
+        self.assertIs(connection.sock, sock)
+
+    def test_pipelining(self):
+        sock = socket.create_connection(('127.0.0.1', self.webserver.port), timeout=5)
+        try:
+            sock.sendall(b'GET /api/status HTTP/1.1\r\nHost: x\r\n\r\n' * 2 + b'GET /api/status HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+            received = b''
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                received += data
+        finally:
+            sock.close()
+        self.assertEqual(received.count(b'HTTP/1.1 200 OK'), 3)
+
+    def test_stream_limit(self):
+        Api.stream_keepalive = 0.1
+        stream = self.connect()
+        response = self.get(stream, '/api/stream')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Content-Type'), 'text/event-stream; charset=utf-8')
+        self.assertEqual(response.readline(), b'retry: 2000\n')
+
+        # The only stream slot is taken
+        connection = self.connect()
+        rejected = self.get(connection, '/api/stream')
+        self.assertEqual(rejected.status, 503)
+        self.assertEqual(rejected.getheader('Retry-After'), '30')
+        rejected.read()
+
+        # ...but other requests are still served
+        response = self.get(connection, '/api/status')
+        self.assertEqual(response.status, 200)
+        response.read()
+
+        # Once the stream's client goes away its slot is freed - noticed when the next keepalive is sent
+        stream.close()
+        for attempt in range(50):
+            response = self.get(connection, '/api/stream')
+            if response.status == 200:
+                break
+            response.read()
+            time.sleep(0.1)
+        self.assertEqual(response.status, 200)
+
+if __name__ == '__main__':
+    unittest.main()